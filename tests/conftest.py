@@ -0,0 +1,130 @@
+"""Shared fixtures: a tiny Zephyr-like source tree with a CMake generated ninja build in it."""
+
+import os
+import struct
+from typing import Dict, List, NamedTuple, Tuple
+
+import pytest
+
+RULES_NINJA = """\
+# CMAKE generated file: DO NOT EDIT!
+rule C_COMPILER__app_Debug
+  depfile = $DEP_FILE
+  deps = gcc
+  command = /sdk/bin/gcc $DEFINES $INCLUDES $FLAGS -MD -MT $out -MF $DEP_FILE -o $out -c $in
+  description = Building C object $out
+
+rule ASM_COMPILER__app_Debug
+  command = /sdk/bin/gcc $DEFINES $INCLUDES $FLAGS -o $out -c $in
+
+rule C_STATIC_LIBRARY_LINKER__app_Debug
+  command = $PRE_LINK && /sdk/bin/ar qc $TARGET_FILE $LINK_FLAGS $in && $POST_BUILD
+
+rule CUSTOM_COMMAND
+  command = $COMMAND
+"""
+
+BUILD_NINJA = """\
+ninja_required_version = 1.5
+cmake_ninja_workdir = <BLD>/
+include CMakeFiles/rules.ninja
+
+build app/CMakeFiles/app.dir/src/main.c.obj: C_COMPILER__app_Debug <SRC>/app/main.c $
+    || cmake_object_order_depends_target_app
+  DEFINES = -DKERNEL -D__ZEPHYR__=1
+  DEP_FILE = app/CMakeFiles/app.dir/src/main.c.obj.d
+  FLAGS = -Os -imacros<BLD>/zephyr/include/generated/autoconf.h --imacros=<SRC>/a b.h
+  INCLUDES = -I<SRC>/include -Izephyr/include/generated
+
+build app/CMakeFiles/app.dir/./arch/start.S.obj: ASM_COMPILER__app_Debug $
+    <SRC>/arch/start$ up.S
+  FLAGS = -xassembler-with-cpp
+
+build app/CMakeFiles/app.dir/misc/empty_file.c.obj: C_COMPILER__app_Debug zephyr/misc/empty_file.c
+
+build app/libapp.a: C_STATIC_LIBRARY_LINKER__app_Debug app/CMakeFiles/app.dir/src/main.c.obj
+  TARGET_FILE = app/libapp.a
+
+build zephyr/include/generated/version.h: CUSTOM_COMMAND
+  COMMAND = cd <BLD> && cmake -P gen_version.cmake
+
+build cmake_object_order_depends_target_app: phony || zephyr/include/generated/version.h
+"""
+
+SOURCE_FILES = [
+    os.path.join("app", "main.c"),
+    os.path.join("arch", "start up.S"),
+    os.path.join("drivers", "unused", "unused.c"),
+    os.path.join("include", "kernel.h"),
+    os.path.join("lib", "unused.c"),
+]
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-files",
+        type=int,
+        default=0,
+        help="run the benchmarks on a synthetic tree with this many C files, e.g. 10000 to 200000.",
+    )
+    parser.addoption(
+        "--benchmark-max-slowdown",
+        type=float,
+        default=1.0,
+        help="fail a benchmark stage which is this many times slower than the original script.",
+    )
+    parser.addoption(
+        "--benchmark-max-bytes-per-file",
+        type=int,
+        default=1024,
+        help="fail a benchmark stage whose peak memory per C file in the tree is above this.",
+    )
+
+
+class ZephyrBuild(NamedTuple):
+    src_dir: str
+    build_dir: str
+    compiler_path: str
+
+
+def write_ninja_files(build_dir: str, src_dir: str):
+    os.makedirs(os.path.join(build_dir, "CMakeFiles"), exist_ok=True)
+    with open(os.path.join(build_dir, "CMakeFiles", "rules.ninja"), "w") as f:
+        f.write(RULES_NINJA)
+    with open(os.path.join(build_dir, "build.ninja"), "w") as f:
+        f.write(BUILD_NINJA.replace("<SRC>", src_dir).replace("<BLD>", build_dir))
+
+
+def write_ninja_deps(path: str, deps: List[Tuple[str, List[str]]], version: int = 4):
+    """Write a `.ninja_deps` log the way ninja does, with a path record before its first use."""
+    ids: Dict[str, int] = {}
+    with open(path, "wb") as f:
+        f.write(b"# ninjadeps\n" + struct.pack("=i", version))
+
+        def path_id(path: str) -> int:
+            if path not in ids:
+                raw = path.encode()
+                raw += b"\0" * (-len(raw) % 4)
+                checksum = ~len(ids) & 0xFFFFFFFF
+                f.write(struct.pack("=I", len(raw) + 4) + raw + struct.pack("=I", checksum))
+                ids[path] = len(ids)
+            return ids[path]
+
+        for output, inputs in deps:
+            record = struct.pack("=i", path_id(output))
+            record += struct.pack("=Q" if version == 4 else "=I", 1)  # mtime
+            record += struct.pack(f"={len(inputs)}i", *(path_id(dep) for dep in inputs))
+            f.write(struct.pack("=I", len(record) | 0x80000000) + record)
+
+
+@pytest.fixture
+def zephyr_build(tmp_path) -> ZephyrBuild:
+    """A source tree with the build dir nested in it, like the default `zephyr/build`."""
+    src_dir = str(tmp_path / "zephyr")
+    build_dir = os.path.join(src_dir, "build")
+    for source_file in SOURCE_FILES:
+        os.makedirs(os.path.join(src_dir, os.path.dirname(source_file)), exist_ok=True)
+        open(os.path.join(src_dir, source_file), "w").close()
+    os.makedirs(os.path.join(src_dir, ".vscode"))
+    write_ninja_files(build_dir, src_dir)
+    return ZephyrBuild(src_dir, build_dir, os.path.join(str(tmp_path), "sdk", "bin", "gcc"))
@@ -0,0 +1,157 @@
+"""Generate synthetic Zephyr-like source trees with a matching ninja build of any size.
+
+`python -m tests.synthetic <out_dir> --c-files 200000` writes `<out_dir>/zephyr`, the source tree,
+and `<out_dir>/build`, the build dir with `build.ninja`, `CMakeFiles/rules.ninja` and `.ninja_deps`.
+"""
+
+import argparse
+import math
+import os
+import random
+from typing import List, NamedTuple, Set, Tuple
+
+from tests.conftest import RULES_NINJA, write_ninja_deps
+
+TOP_DIRS = ["arch", "boards", "drivers", "kernel", "lib", "modules", "soc", "subsys"]
+
+GLOBAL_HEADERS = 200
+
+DEPS_PER_OBJECT = 5
+
+
+class SyntheticBuild(NamedTuple):
+    src_dir: str
+    build_dir: str
+    compiler_path: str
+    c_files: int
+    used_c_files: Set[str]
+    used_h_files: Set[str]
+
+
+def get_leaf_dirs(c_files: int, files_per_dir: int, depth: int) -> List[str]:
+    """Spread the leaf dirs evenly over `depth` levels below the top dirs."""
+    leaf_count = math.ceil(c_files / files_per_dir)
+    per_top = math.ceil(leaf_count / len(TOP_DIRS))
+    fanout = max(2, math.ceil(per_top ** (1 / depth)))
+    leaf_dirs = []
+    for i in range(leaf_count):
+        top, index = TOP_DIRS[i % len(TOP_DIRS)], i // len(TOP_DIRS)
+        parts = [top]
+        for _ in range(depth):
+            index, digit = divmod(index, fanout)
+            parts.append(f"sub{digit}")
+        leaf_dirs.append("/".join(parts))
+    return leaf_dirs
+
+
+def touch(path: str):
+    open(path, "w").close()
+
+
+def generate_synthetic_build(
+    root: str,
+    c_files: int = 10_000,
+    files_per_dir: int = 8,
+    depth: int = 5,
+    used_dir_ratio: float = 0.1,
+    seed: int = 0,
+) -> SyntheticBuild:
+    """Write a source tree of `c_files` C files and a build using some of them under `root`.
+
+    Like in Zephyr, a build uses a few of the dirs: a leaf dir is used with `used_dir_ratio` and
+    then half of its C files are compiled. Every leaf dir also has two headers, and every object
+    depends on the headers of its dir and on a few of the `include` dir.
+    """
+    rng = random.Random(seed)
+    src_dir = os.path.join(root, "zephyr")
+    build_dir = os.path.join(root, "build")
+
+    global_headers = [f"include/zephyr/header{i}.h" for i in range(GLOBAL_HEADERS)]
+    os.makedirs(os.path.join(src_dir, "include", "zephyr"))
+    for header in global_headers:
+        touch(os.path.join(src_dir, header))
+
+    used_c_files: Set[str] = set()
+    deps: List[Tuple[str, List[str]]] = []
+    edges: List[str] = []
+    remaining = c_files
+    for leaf_dir in get_leaf_dirs(c_files, files_per_dir, depth):
+        os.makedirs(os.path.join(src_dir, leaf_dir))
+        dir_headers = [f"{leaf_dir}/{name}.h" for name in ("api", "priv")]
+        for header in dir_headers:
+            touch(os.path.join(src_dir, header))
+
+        used_dir = rng.random() < used_dir_ratio
+        for i in range(min(files_per_dir, remaining)):
+            c_file = f"{leaf_dir}/file{i}.c"
+            touch(os.path.join(src_dir, c_file))
+            if not used_dir or i % 2:
+                continue
+
+            used_c_files.add(c_file)
+            obj = f"zephyr/CMakeFiles/zephyr.dir/{c_file}.obj"
+            edges.append(
+                f"build {obj}: C_COMPILER__app_Debug {src_dir}/{c_file}"
+                " || cmake_object_order_depends_target_app\n"
+                "  DEFINES = -DKERNEL -D__ZEPHYR__=1\n"
+                f"  DEP_FILE = {obj}.d\n"
+                f"  FLAGS = -Os -imacros {build_dir}/zephyr/include/generated/autoconf.h\n"
+                f"  INCLUDES = -I{src_dir}/include -I{src_dir}/{leaf_dir}"
+                " -Izephyr/include/generated\n\n"
+            )
+            deps.append(
+                (
+                    obj,
+                    [
+                        f"{src_dir}/{header}"
+                        for header in dir_headers + rng.sample(global_headers, DEPS_PER_OBJECT)
+                    ],
+                )
+            )
+        remaining -= files_per_dir
+
+    os.makedirs(os.path.join(build_dir, "CMakeFiles"))
+    with open(os.path.join(build_dir, "CMakeFiles", "rules.ninja"), "w") as f:
+        f.write(RULES_NINJA)
+    with open(os.path.join(build_dir, "build.ninja"), "w") as f:
+        f.write(
+            "ninja_required_version = 1.5\n"
+            f"cmake_ninja_workdir = {build_dir}/\n"
+            "include CMakeFiles/rules.ninja\n\n"
+        )
+        f.writelines(edges)
+        objects = " ".join(obj for obj, _ in deps)
+        f.write(
+            f"build zephyr/libzephyr.a: C_STATIC_LIBRARY_LINKER__app_Debug {objects}\n"
+            "  TARGET_FILE = zephyr/libzephyr.a\n\n"
+            "build cmake_object_order_depends_target_app: phony\n"
+        )
+    write_ninja_deps(os.path.join(build_dir, ".ninja_deps"), deps)
+
+    used_h_files = {os.path.relpath(dep, src_dir) for _, inputs in deps for dep in inputs}
+    return SyntheticBuild(
+        src_dir,
+        build_dir,
+        os.path.join(root, "sdk", "bin", "gcc"),
+        c_files,
+        {os.path.normpath(f) for f in used_c_files},
+        used_h_files,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tests.synthetic", description=__doc__)
+    parser.add_argument("out_dir", help="the dir to write the source tree and the build dir to.")
+    parser.add_argument("--c-files", type=int, default=10_000, help="the number of C files.")
+    parser.add_argument("--depth", type=int, default=5, help="the nesting of the leaf dirs.")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the used dirs.")
+    args = parser.parse_args()
+    build = generate_synthetic_build(args.out_dir, args.c_files, depth=args.depth, seed=args.seed)
+    print(
+        f"Wrote [{build.c_files}] C files, [{len(build.used_c_files)}] of them used:\n"
+        f"[{build.src_dir}]\n[{build.build_dir}]"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Benchmark the helper stages on a synthetic tree against the original script.
+
+The benchmarks only run with `pytest tests/test_benchmark.py --benchmark-files 100000`, they need
+neither a Zephyr checkout nor the SDK. Each stage is timed, its peak memory is traced and its
+result is compared with the one of the same step of `tests/original/zephyr2vsc.py`.
+"""
+
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import pytest
+
+from tests.synthetic import SyntheticBuild, generate_synthetic_build
+from zephyr2vsc.helpers import (
+    generate_compilation_db,
+    generate_vscode_config_jsons,
+    get_all_c_files_relative_path,
+    get_ninja_rules,
+    get_relevant_c_files_relative_path,
+    get_relevant_header_files_relative_path,
+)
+from zephyr2vsc.ninja import NinjaManifest
+
+ORIGINAL_SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "original", "zephyr2vsc.py")
+
+
+def load_original_script() -> Any:
+    spec = importlib.util.spec_from_file_location("original_zephyr2vsc", ORIGINAL_SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+class Measurement(NamedTuple):
+    result: Any
+    seconds: float
+    peak_bytes: int
+
+
+def measure(
+    *computes: Callable[[], Any],
+    setup: Callable[[], Any] = lambda: None,
+    repeat: int = 5,
+    budget: float = 1.0,
+) -> List[Measurement]:
+    """Time the fastest of at least `repeat` runs of each of the `computes`, then trace the peak
+    memory of one more run of each. `setup` runs untimed before each run.
+
+    The `computes` take turns, in reverse order every other time, so a busy moment of the machine
+    or the caches left cold by one of them slow down all of them. The quick stages run again until
+    `budget` seconds are spent, a single run of them is noise. The results are those of the traced
+    runs, in the order of the `computes`.
+    """
+    results: List[Any] = [None] * len(computes)
+    seconds = [float("inf")] * len(computes)
+    peak_bytes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        runs, deadline = 0, time.perf_counter() + budget
+        while runs < repeat or time.perf_counter() < deadline:
+            order = list(enumerate(computes))
+            for i, compute in order if runs % 2 == 0 else reversed(order):
+                setup()
+                start = time.perf_counter()
+                compute()
+                seconds[i] = min(seconds[i], time.perf_counter() - start)
+            runs += 1
+
+        for i, compute in enumerate(computes):
+            setup()
+            tracemalloc.start()
+            try:
+                results[i] = compute()
+                peak_bytes.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+    return [Measurement(*measurement) for measurement in zip(results, seconds, peak_bytes)]
+
+
+def compile_commands(db_full_path: str) -> List[Dict[str, str]]:
+    with open(db_full_path) as f:
+        return [entry for entry in json.load(f) if entry["output"].endswith(".obj")]
+
+
+def excluded_c_files(settings_json: str, all_c_files: List[str]) -> set:
+    with open(settings_json) as f:
+        files_exclude = json.load(f)["files.exclude"]
+    dirs = tuple(pattern[:-2] for pattern in files_exclude if pattern.endswith("/**"))
+    return {f for f in all_c_files if f in files_exclude or f.startswith(dirs)}
+
+
+@pytest.fixture(scope="module")
+def synthetic_build(request, tmp_path_factory) -> SyntheticBuild:
+    c_files = request.config.getoption("--benchmark-files")
+    if not c_files:
+        pytest.skip("run with --benchmark-files N to benchmark a tree of N C files")
+    return generate_synthetic_build(str(tmp_path_factory.mktemp("benchmark")), c_files)
+
+
+def test_synthetic_build_matches_the_helpers(tmp_path):
+    build = generate_synthetic_build(str(tmp_path), c_files=500, depth=3, used_dir_ratio=0.5)
+    src_dir, build_dir = build.src_dir, build.build_dir
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert len(get_all_c_files_relative_path(src_dir)) == build.c_files == 500
+        assert get_relevant_c_files_relative_path(src_dir, build_dir) == build.used_c_files
+        assert get_relevant_header_files_relative_path(src_dir, build_dir) == build.used_h_files
+    assert 0 < len(build.used_c_files) < 500
+    assert all(f.count(os.sep) == 4 for f in build.used_c_files)
+
+
+def test_benchmark_against_the_original_script(request, synthetic_build: SyntheticBuild):
+    max_slowdown = request.config.getoption("--benchmark-max-slowdown")
+    max_bytes_per_file = request.config.getoption("--benchmark-max-bytes-per-file")
+    src_dir, build_dir = synthetic_build.src_dir, synthetic_build.build_dir
+    os.makedirs(os.path.join(src_dir, ".vscode"), exist_ok=True)
+
+    original = load_original_script()
+    everything: Dict[str, Any] = {
+        "compilerPath": synthetic_build.compiler_path,
+        "srcDir": src_dir,
+        "bldDir": build_dir,
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        original.DeriveOtheConfigs(everything)
+
+    def run_original(step: Callable[[Dict[str, Any]], None], key: str) -> Callable[[], Any]:
+        def run() -> Any:
+            step(everything)
+            return everything[key]
+
+        return run
+
+    results: Dict[str, Any] = {}
+    db_full_path = os.path.join(build_dir, "zephyr_compile_db.json")
+
+    def unload_manifest():
+        # each stage reading build.ninja pays for parsing it, like each step of the original does
+        NinjaManifest.unload(build_dir)
+
+    def remove_configs():
+        # the original replaces the files, they are not merged into the ones of the other
+        vscode_dir = os.path.join(src_dir, ".vscode")
+        for name in os.listdir(vscode_dir):
+            os.remove(os.path.join(vscode_dir, name))
+
+    def generate_configs() -> str:
+        used_c_files = results["used_files"]
+        unused_c_files = set(results["all_files"]) - used_c_files
+        generate_vscode_config_jsons(
+            unused_c_files, used_c_files, synthetic_build.compiler_path, db_full_path, src_dir
+        )
+        return os.path.join(src_dir, ".vscode", "settings.json")
+
+    def generate_original_configs() -> List[str]:
+        everything.setdefault("compDBFileFullpath", db_full_path)
+        original.GetExcludedCFilesRelativePath(everything)
+        original.GetIncludedCFilesContainingFolder(everything)
+        original.GenerateVSCConfigJSONs(everything)
+        return everything["excludeCFiles"]
+
+    # stage: (compute, the same step of the original script and its result if any, untimed setup)
+    Stage = Tuple[Callable[[], Any], Optional[Callable[[], Any]], Callable[[], None]]
+    stages: Dict[str, Stage] = {
+        "rules": (
+            lambda: get_ninja_rules(build_dir),
+            run_original(original.GetNinjaRules, "ninjaRules"),
+            lambda: None,
+        ),
+        "used_files": (
+            lambda: get_relevant_c_files_relative_path(src_dir, build_dir),
+            run_original(original.GetRelevantCFilesRelativePath, "cFiles"),
+            unload_manifest,
+        ),
+        "used_h_files": (
+            lambda: get_relevant_header_files_relative_path(src_dir, build_dir),
+            None,
+            unload_manifest,
+        ),
+        "all_files": (
+            lambda: get_all_c_files_relative_path(src_dir),
+            run_original(original.GetAllCFilesRelativePath, "allCFiles"),
+            lambda: None,
+        ),
+        "compdb": (
+            lambda: generate_compilation_db(build_dir, results["rules"]),
+            (
+                run_original(original.GenerateCompilationDB, "compDBFileFullpath")
+                if shutil.which("ninja")
+                else None
+            ),
+            unload_manifest,
+        ),
+        "configs": (
+            generate_configs,
+            generate_original_configs,
+            remove_configs,
+        ),
+    }
+
+    rows = []
+    failures = []
+    for name, (compute, compute_original, setup) in stages.items():
+        # the original runs first, the result of the stage is the one left behind
+        baseline: Optional[Measurement] = None
+        if compute_original is not None:
+            baseline, measurement = measure(compute_original, compute, setup=setup)
+        else:
+            (measurement,) = measure(compute, setup=setup)
+        results[name] = measurement.result
+
+        if name == "used_h_files":
+            assert measurement.result == synthetic_build.used_h_files
+        elif name == "compdb" and compute_original is not None:
+            # both write the same DB, the one of the original is read before it is replaced again
+            with contextlib.redirect_stdout(io.StringIO()):
+                original_commands = compile_commands(compute_original())
+                assert compile_commands(compute()) == original_commands
+        elif name == "configs":
+            # the unused files the original lists one by one are hidden by the dir globs
+            assert excluded_c_files(measurement.result, results["all_files"]) == set(
+                baseline.result  # type: ignore
+            )
+        elif baseline is not None:
+            assert set(measurement.result) == set(baseline.result), name
+
+        bytes_per_file = measurement.peak_bytes / synthetic_build.c_files
+        if bytes_per_file > max_bytes_per_file:
+            failures.append(f"{name} peaks at [{bytes_per_file:.0f}] bytes per C file")
+        ratio = baseline.seconds / measurement.seconds if baseline else None
+        if ratio is not None and ratio * max_slowdown < 1:
+            failures.append(f"{name} is [{1 / ratio:.1f}] times slower than the original")
+        rows.append((name, measurement, baseline, ratio))
+
+    with request.config.pluginmanager.get_plugin("capturemanager").global_and_fixture_disabled():
+        print(
+            f"\n\n[{synthetic_build.c_files}] C files, [{len(synthetic_build.used_c_files)}] used"
+        )
+        print(f"{'stage':<14}{'seconds':>10}{'peak MB':>10}{'original s':>12}{'speedup':>10}")
+        for name, measurement, baseline, ratio in rows:
+            print(
+                f"{name:<14}{measurement.seconds:>10.3f}{measurement.peak_bytes / 1e6:>10.1f}"
+                + (f"{baseline.seconds:>12.3f}{ratio:>9.1f}x" if baseline else f"{'-':>12}")
+            )
+    assert not failures, failures
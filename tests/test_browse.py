@@ -0,0 +1,74 @@
+"""Test the browse paths derived from the used files and the include dirs."""
+
+import json
+import os
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc.browse import get_browse_paths, get_minimal_roots
+from zephyr2vsc.compdb import get_include_paths
+from zephyr2vsc.workspace import Workspace
+
+
+def test_nested_dirs_are_swept_into_their_roots():
+    dirs = ["/z/a/b", "/z/a-c", "/z/a", "/z/a/b/c", "/z/ab", "/y", "/z/a/"]
+    assert get_minimal_roots(os.path.normpath(d) for d in dirs) == [
+        os.path.normpath(d) for d in ["/y", "/z/a", "/z/a-c", "/z/ab"]
+    ]
+
+
+def test_include_paths_of_commands_and_arguments():
+    command = (
+        "gcc -I../include -isystem /sdk/inc -I'/src/my dir' -include /bld/gen/autoconf.h"
+        " -DNAME=-Ifoo --imacros=/src/defs.h -o x.obj -c /src/x.c"
+    )
+    include_dirs = {"/include", "/sdk/inc", "/src/my dir"}
+    include_files = {"/bld/gen/autoconf.h", "/src/defs.h"}
+    expected = (
+        {os.path.normpath(d) for d in include_dirs},
+        {os.path.normpath(f) for f in include_files},
+    )
+    assert get_include_paths({"directory": "/bld", "command": command}) == expected
+
+    arguments = ["gcc", "-I", "../include", "-isystem/sdk/inc", "-I/src/my dir"]
+    arguments += ["-include", "/bld/gen/autoconf.h", "--imacros=/src/defs.h", "-c", "/src/x.c"]
+    assert get_include_paths({"directory": "/bld", "arguments": arguments}) == expected
+
+
+def test_browse_paths(tmp_path):
+    src_dir = str(tmp_path / "zephyr")
+    for path in ["include/zephyr/sys", "soc/arm", "build/gen/sub", "modules/hal"]:
+        os.makedirs(os.path.join(src_dir, path))
+    open(os.path.join(src_dir, "build", "gen", "autoconf.h"), "w").close()
+    open(os.path.join(src_dir, "include", "zephyr", "toolchain.h"), "w").close()
+
+    browse_paths = get_browse_paths(
+        src_dir,
+        [os.path.join("soc", "arm", "soc.c"), os.path.join("soc", "arm", "irq", "irq.c")],
+        [
+            os.path.join(src_dir, "include"),
+            os.path.join(src_dir, "include", "zephyr", "sys"),
+            os.path.join(src_dir, "build", "gen", "sub"),
+            os.path.join(src_dir, "missing"),
+            str(tmp_path / "sdk"),
+        ],
+        [
+            os.path.join(src_dir, "build", "gen", "autoconf.h"),
+            os.path.join(src_dir, "include", "zephyr", "toolchain.h"),
+        ],
+    )
+    # the sdk dir does not exist
+    assert browse_paths == ["build/gen/sub", "include", "soc/arm", "build/gen/*"]
+    # a used file in the source dir itself covers all of it
+    assert get_browse_paths(src_dir, ["main.c", os.path.join("soc", "arm", "soc.c")], [], []) == [
+        "."
+    ]
+
+
+def test_browse_paths_cover_the_include_dirs_of_the_build(zephyr_build: ZephyrBuild):
+    os.makedirs(os.path.join(zephyr_build.build_dir, "zephyr", "include", "generated"))
+    workspace = Workspace(zephyr_build.src_dir, zephyr_build.build_dir, zephyr_build.compiler_path)
+    workspace.generate()
+
+    with open(workspace.config_jsons[1]) as f:
+        browse_paths = json.load(f)["configurations"][0]["browse"]["path"]
+    assert browse_paths == ["app", "build/zephyr/include/generated", "build/zephyr/misc", "include"]
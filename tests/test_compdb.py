@@ -0,0 +1,114 @@
+"""Test the compact, filtered compilation DB."""
+
+import json
+import os
+import stat
+
+import pytest
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc.compdb import (
+    compact_arguments,
+    rewrite_imacros_arguments,
+    rewrite_imacros_command,
+    write_compile_db,
+)
+from zephyr2vsc.helpers import generate_compilation_db, get_ninja_rules
+
+
+def test_include_dirs_are_normalized_and_deduplicated():
+    arguments = ["gcc", "-I../include", "-I", "/bld/../include", "-isystem", "/sdk/inc"]
+    arguments += ["-isystem/sdk/inc/", "-include", "/bld/autoconf.h", "-Iinclude/../gen", "-I"]
+    assert compact_arguments(arguments, "/bld") == [
+        "gcc",
+        "-I../include",
+        "-isystem",
+        "/sdk/inc",
+        "-include",
+        "/bld/autoconf.h",
+        "-Igen",
+        # a flag missing its dir is left to the compiler to complain about
+        "-I",
+    ]
+
+
+def test_flags_which_do_not_change_the_parsing_are_dropped():
+    arguments = ["gcc", "-Wall", "-Wno-main", "-Wp,-DX", "-MD", "-MT", "x.o", "-MFx.d", "-Os"]
+    arguments += ["-o", "x.o", "-c", "x.c"]
+    assert compact_arguments(arguments, "/bld") == ["gcc", "-Wp,-DX", "-Os", "x.c"]
+
+
+def test_compact_compilation_db_is_smaller_than_the_full_one(zephyr_build: ZephyrBuild, capsys):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    relevant_files = {os.path.join("app", "main.c"), os.path.join("arch", "start up.S")}
+    full_size = os.path.getsize(generate_compilation_db(build_dir, get_ninja_rules(build_dir)))
+
+    db_full_path = generate_compilation_db(
+        build_dir, get_ninja_rules(build_dir), src_dir, relevant_files, compact=True
+    )
+    size = os.path.getsize(db_full_path)
+    assert size < full_size
+    # the size of the full DB is reported without writing it
+    assert (
+        f"Compacted the compilation DB from [3] entries, [{full_size}] bytes to [2] entries, "
+        f"[{size}] bytes." in capsys.readouterr().out
+    )
+
+    with open(db_full_path, "r") as f:
+        compile_db = json.load(f)
+    assert [entry["file"] for entry in compile_db] == [
+        f"{src_dir}/app/main.c",
+        f"{src_dir}/arch/start up.S",
+    ]
+    assert compile_db[1] == {
+        "directory": build_dir,
+        "arguments": ["/sdk/bin/gcc", "-xassembler-with-cpp", f"{src_dir}/arch/start up.S"],
+        "file": f"{src_dir}/arch/start up.S",
+        "output": "app/CMakeFiles/app.dir/arch/start.S.obj",
+    }
+
+
+def test_imacros_is_rewritten_only_where_an_argument_starts():
+    arguments = ["gcc", "-imacros", "a.h", "-imacrosb.h", "--imacros=c.h", "-I/x-imacros/inc"]
+    expected = ["gcc", "-include", "a.h", "-includeb.h", "-includec.h", "-I/x-imacros/inc"]
+    assert rewrite_imacros_arguments(arguments) == expected
+    assert rewrite_imacros_command(" ".join(arguments[:5] + ["-I/x-imacros/inc"])) == " ".join(
+        expected
+    )
+    assert rewrite_imacros_command(" ".join(arguments[:5])) == " ".join(expected[:5])
+    assert rewrite_imacros_command("-imacros a.h\t--imacros=b.h") == "-include a.h\t-includeb.h"
+
+
+def test_compilation_db_is_replaced_atomically(tmp_path):
+    db_full_path = str(tmp_path / "zephyr_compile_db.json")
+    assert write_compile_db(db_full_path, [{"file": "a.c"}]) == (1, 24)
+
+    def entries():
+        yield {"file": "b.c"}
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        write_compile_db(db_full_path, entries())
+    assert os.listdir(tmp_path) == ["zephyr_compile_db.json"]
+    with open(db_full_path) as f:
+        assert json.load(f) == [{"file": "a.c"}]
+
+    # an entry with an arguments array is laid out by json.dumps
+    entry = {"arguments": ["gcc", "-c", "a.c"], "file": "a.c"}
+    write_compile_db(db_full_path, [entry])
+    with open(db_full_path) as f:
+        assert f.read() == f"[\n{json.dumps(entry, indent=2)}\n]\n"
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Windows has no file mode bits")
+def test_compilation_db_gets_the_mode_of_a_new_or_replaced_file(tmp_path):
+    db_full_path = str(tmp_path / "zephyr_compile_db.json")
+    umask = os.umask(0o022)
+    os.umask(umask)
+    write_compile_db(db_full_path, [{"file": "a.c"}])
+    # like open() would create it, not private like a temporary file
+    assert stat.S_IMODE(os.stat(db_full_path).st_mode) == 0o666 & ~umask
+
+    os.chmod(db_full_path, 0o640)
+    write_compile_db(db_full_path, [{"file": "b.c"}])
+    assert stat.S_IMODE(os.stat(db_full_path).st_mode) == 0o640
@@ -0,0 +1,119 @@
+"""Test the SQLite compile command index and the query subcommand."""
+
+import json
+import os
+
+import pytest
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc import compdb_index, const, helpers
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.compdb_index import (
+    CompileIndex,
+    CompileIndexWriter,
+    get_compile_flags,
+    get_file_uri_path,
+)
+from zephyr2vsc.helpers import generate_compilation_db, get_ninja_rules
+
+
+def query(capsys, *argv: str) -> object:
+    capsys.readouterr()
+    with pytest.raises(SystemExit) as exit_info:
+        main(["query", *argv])
+    return exit_info.value.code
+
+
+def test_get_compile_flags():
+    flags = get_compile_flags(
+        {
+            "directory": "/bld",
+            "arguments": ["gcc", "-DA", "-D", "B=1", "-I", "inc", "-isystem/sys", "-o", "x.o"],
+            "file": "../src/x.c",
+        }
+    )
+    assert flags.file == os.path.normpath("/src/x.c")
+    assert flags.include_dirs == [os.path.normpath("/bld/inc"), os.path.normpath("/sys")]
+    assert flags.defines == {"A": None, "B": "1"}
+
+
+def test_index_answers_lookups(zephyr_build: ZephyrBuild, capsys):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    index_path = os.path.join(build_dir, const.COMPILE_INDEX_FILE_NAME)
+    # the index is only written on request
+    main([zephyr_build.compiler_path, src_dir, build_dir])
+    assert not os.path.exists(index_path)
+    assert query(capsys, "--define", "KERNEL", "-b", build_dir) == 1
+    assert "Generate it with --compdb-index." in capsys.readouterr().err
+
+    main([zephyr_build.compiler_path, src_dir, build_dir, "--compdb-index"])
+    main_c = os.path.join(src_dir, "app", "main.c")
+
+    with CompileIndex(index_path) as index:
+        (flags,) = index.lookup(main_c)
+        assert flags.output == "app/CMakeFiles/app.dir/src/main.c.obj"
+        assert flags.defines == {"KERNEL": None, "__ZEPHYR__": "1"}
+        assert flags.include_dirs == [
+            os.path.join(src_dir, "include"),
+            os.path.join(build_dir, "zephyr", "include", "generated"),
+        ]
+        # the commands are indexed as ninja runs them, with -imacros
+        assert f"-imacros{build_dir}/zephyr/include/generated/autoconf.h" in flags.arguments
+        (start_s,) = index.lookup(os.path.join(src_dir, "arch", "start up.S"))
+        assert start_s.arguments[-1] == os.path.join(src_dir, "arch", "start up.S")
+        assert index.files_defining("KERNEL") == [main_c]
+        assert index.files_including(os.path.join(src_dir, "include")) == [main_c]
+        assert index.lookup(os.path.join(src_dir, "lib", "unused.c")) == []
+
+    assert query(capsys, main_c, "-b", build_dir) == 0
+    assert capsys.readouterr().out.startswith("/sdk/bin/gcc -DKERNEL -D__ZEPHYR__=1 ")
+    assert query(capsys, main_c, "-b", build_dir, "--json") == 0
+    assert json.loads(capsys.readouterr().out)["file"] == main_c
+    assert query(capsys, "--define", "__ZEPHYR__", "-b", build_dir) == 0
+    assert capsys.readouterr().out == main_c + "\n"
+    assert query(capsys, "--define", "NOT_DEFINED", "-b", build_dir) == 1
+    assert query(capsys, "--include-dir", os.path.join(src_dir, "include"), "-b", build_dir) == 0
+    assert capsys.readouterr().out == main_c + "\n"
+    assert query(capsys, "-b", build_dir) == 2
+    assert "give a file, --define or --include-dir" in capsys.readouterr().err
+    assert query(capsys, main_c, "-b", src_dir) == 1
+    assert "No compile command index" in capsys.readouterr().err
+
+
+def test_index_file_is_shared_and_opened_from_any_path(tmp_path):
+    index_path = str(tmp_path / "a #b?c%d" / const.COMPILE_INDEX_FILE_NAME)
+    os.makedirs(os.path.dirname(index_path))
+    writer = CompileIndexWriter(index_path)
+    writer.add({"directory": "/bld", "command": "gcc -DA -c x.c", "file": "x.c"})
+    writer.commit()
+    # like open() would create it, not private like a temporary file
+    umask = os.umask(0o022)
+    os.umask(umask)
+    assert os.stat(index_path).st_mode & 0o777 == (0o666 & ~umask if os.name != "nt" else 0o666)
+
+    assert "#" not in get_file_uri_path(index_path) and "?" not in get_file_uri_path(index_path)
+    with CompileIndex(index_path) as index:
+        assert index.files_defining("A") == [os.path.normpath("/bld/x.c")]
+
+
+def test_index_is_kept_if_the_compilation_db_fails(zephyr_build: ZephyrBuild, monkeypatch):
+    build_dir = zephyr_build.build_dir
+    index_path = os.path.join(build_dir, const.COMPILE_INDEX_FILE_NAME)
+    # the rows are written in batches
+    monkeypatch.setattr(compdb_index, "_BATCH_COMMANDS", 1)
+    generate_compilation_db(build_dir, set(get_ninja_rules(build_dir)), write_index=True)
+    with open(index_path, "rb") as f:
+        index = f.read()
+    files = os.listdir(build_dir)
+
+    def write_compile_db(db_full_path, entries, indent):
+        next(iter(entries))
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(helpers, "write_compile_db", write_compile_db)
+    with pytest.raises(KeyboardInterrupt):
+        generate_compilation_db(build_dir, set(get_ninja_rules(build_dir)), write_index=True)
+    # the temporary index is removed
+    assert sorted(os.listdir(build_dir)) == sorted(files)
+    with open(index_path, "rb") as f:
+        assert f.read() == index
@@ -0,0 +1,75 @@
+"""Test reading the headers each object depends on from the binary `.ninja_deps` log."""
+
+import json
+import os
+import struct
+
+import pytest
+
+from tests.conftest import ZephyrBuild, write_ninja_deps
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.deps import DepsLog
+from zephyr2vsc.helpers import get_relevant_header_files_relative_path
+
+
+@pytest.mark.parametrize("version", [3, 4])
+def test_later_records_replace_earlier_ones(tmp_path, version: int):
+    deps_file = str(tmp_path / ".ninja_deps")
+    write_ninja_deps(deps_file, [("a.obj", ["a.c", "old.h"]), ("a.obj", ["a.c", "new.h"])], version)
+    with open(deps_file, "ab") as f:
+        # a record truncated by an interrupted build
+        f.write(b"\x10\x00\x00\x80\x00")
+
+    deps_log = DepsLog.load(deps_file)
+    assert deps_log.paths == [b"a.obj", b"a.c", b"old.h", b"new.h"]
+    assert sorted(deps_log.dependency_paths()) == ["a.c", "new.h"]
+
+
+def test_log_is_read_up_to_a_path_with_a_wrong_checksum(tmp_path):
+    deps_file = str(tmp_path / ".ninja_deps")
+    write_ninja_deps(deps_file, [("a.obj", ["a.c"])])
+    with open(deps_file, "ab") as f:
+        # the checksum of the path with ID 2 is ~2
+        f.write(struct.pack("=I", 8) + b"b.c\0" + struct.pack("=I", 2))
+    assert DepsLog.load(deps_file).paths == [b"a.obj", b"a.c"]
+
+
+def test_not_a_deps_log(tmp_path):
+    (tmp_path / ".ninja_deps").write_bytes(b"# ninja log v5\n")
+    with pytest.raises(ValueError):
+        DepsLog.load(str(tmp_path / ".ninja_deps"))
+    (tmp_path / ".ninja_deps").write_bytes(b"# ninjadeps\n" + struct.pack("=i", 5))
+    with pytest.raises(ValueError, match="Unsupported ninja deps log version"):
+        DepsLog.load(str(tmp_path / ".ninja_deps"))
+    # an empty log has no deps
+    (tmp_path / ".ninja_deps").write_bytes(b"")
+    assert DepsLog.load(str(tmp_path / ".ninja_deps")).paths == []
+
+
+def test_unused_headers_are_excluded(zephyr_build: ZephyrBuild):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    for header in ["drivers/unused/unused.h", "drivers/used/used.h"]:
+        os.makedirs(os.path.join(src_dir, os.path.dirname(header)), exist_ok=True)
+        open(os.path.join(src_dir, header), "w").close()
+    assert get_relevant_header_files_relative_path(src_dir, build_dir) is None
+
+    main_obj = "app/CMakeFiles/app.dir/src/main.c.obj"
+    main_deps = [
+        f"{src_dir}/app/main.c",
+        f"{src_dir}/include/kernel.h",
+        f"{src_dir}/drivers/used/used.h",
+        "zephyr/include/generated/autoconf.h",
+    ]
+    write_ninja_deps(os.path.join(build_dir, ".ninja_deps"), [(main_obj, main_deps)])
+    assert get_relevant_header_files_relative_path(src_dir, build_dir) == {
+        os.path.join("include", "kernel.h"),
+        os.path.join("drivers", "used", "used.h"),
+        os.path.join(build_dir, "zephyr", "include", "generated", "autoconf.h"),
+    }
+
+    main([zephyr_build.compiler_path, src_dir, build_dir])
+    with open(os.path.join(src_dir, ".vscode", "settings.json")) as f:
+        files_exclude = json.load(f)["files.exclude"]
+    assert "drivers/unused/**" in files_exclude
+    assert "drivers/**" not in files_exclude
+    assert "include/**" not in files_exclude
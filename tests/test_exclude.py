@@ -0,0 +1,50 @@
+"""Test collapsing unused files into directory-level exclude globs."""
+
+from zephyr2vsc.exclude import build_path_trie, collapse_exclude_patterns, get_largest_unused_dirs
+
+
+def test_dirs_without_used_files_collapse_into_one_glob():
+    used = {
+        "kernel/sched.c",
+        "drivers/gpio/gpio_stm32.c",
+        "/bld/zephyr/isr_tables.c",
+        "../modules/hal/arch/init.c",
+    }
+    unused = {
+        "kernel/mem_domain.c",
+        "drivers/gpio/gpio_nrfx.c",
+        "drivers/i2c/i2c_stm32.c",
+        "drivers/i2c/i2c_nrfx.c",
+        "drivers/i2c/target/eeprom.c",
+        "arch/x86/core/cpuhalt.c",
+        "arch/x86/core/ia32/fatal.c",
+        "setup.c",
+    }
+
+    assert sorted(collapse_exclude_patterns(used, unused)) == [
+        "arch/**",
+        "drivers/gpio/gpio_nrfx.c",
+        "drivers/i2c/**",
+        "kernel/mem_domain.c",
+        "setup.c",
+    ]
+
+
+def test_no_used_files_never_hides_the_whole_tree():
+    assert sorted(collapse_exclude_patterns(set(), {"a/b.c", "c.c"})) == ["a/**", "c.c"]
+
+
+def test_the_largest_unused_dirs_are_kept():
+    used = {"kernel/sched.c", "drivers/gpio/gpio_stm32.c"}
+    unused = {
+        "drivers/i2c/i2c_stm32.c",
+        "drivers/i2c/target/eeprom.c",
+        "drivers/spi/spi_nrfx.c",
+        "modules/hal/nxp/a.c",
+        "modules/hal/nxp/b.h",
+        "modules/hal/st/c.c",
+        "kernel/mem_domain.c",
+    }
+    unused_dirs = build_path_trie(used, unused).unused_dirs()
+    assert sorted(unused_dirs) == [("drivers/i2c", 2), ("drivers/spi", 1), ("modules", 3)]
+    assert get_largest_unused_dirs(unused_dirs, 2) == [("modules", 3), ("drivers/i2c", 2)]
@@ -0,0 +1,64 @@
+"""Test the stage records and their trace export."""
+
+import json
+import os
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc import instrument
+from zephyr2vsc.__main__ import main
+
+
+@instrument.instrumented("double", lambda result: {"items": len(result)})
+def double(items):
+    instrument.count("calls", 1)
+    return items * 2
+
+
+def test_stages_nest_and_count_their_items():
+    with instrument.use(instrument.Profiler(trace_memory=True)) as profiler:
+        with instrument.stage("outer"):
+            double([1])
+            double([bytearray(1_000_000)])
+        assert instrument.get_profiler() is profiler
+    assert instrument.get_profiler() is None
+
+    outer, first, second = profiler.sorted_records()
+    assert (outer.name, outer.depth, first.name, first.depth) == ("outer", 0, "double", 1)
+    assert first.counts == {"calls": 1, "items": 2}
+    assert outer.wall_ns >= first.wall_ns + second.wall_ns
+    assert outer.peak_bytes is not None and second.peak_bytes is not None
+    assert outer.peak_bytes >= second.peak_bytes >= 1_000_000
+
+    table = profiler.format_table().splitlines()
+    assert table[1].startswith("outer ")
+    assert table[2].startswith("  double ") and table[2].endswith("calls=1, items=2")
+
+
+def test_stages_are_not_recorded_without_a_profiler():
+    assert double([1]) == [1, 1]
+    instrument.count("calls", 1)
+    assert instrument.get_profiler() is None
+
+
+def test_profile_is_a_chrome_trace(zephyr_build: ZephyrBuild, tmp_path, capsys):
+    profile = str(tmp_path / "profile.json")
+    main(
+        [
+            zephyr_build.compiler_path,
+            zephyr_build.src_dir,
+            zephyr_build.build_dir,
+            "--profile",
+            profile,
+        ]
+    )
+    assert "get_ninja_rules" in capsys.readouterr().out
+
+    with open(profile) as f:
+        events = json.load(f)["traceEvents"]
+    assert {event["ph"] for event in events} == {"X"}
+    assert {event["pid"] for event in events} == {os.getpid()}
+    by_name = {event["name"]: event for event in events}
+    assert by_name["get_ninja_rules"]["args"]["rules"] == 4
+    assert by_name["generate_vscode_config_jsons"]["args"]["exclude patterns"] > 0
+    assert by_name["build build"]["dur"] >= by_name["compdb"]["dur"]
+    assert by_name["compdb"]["args"]["peak_bytes"] > 0
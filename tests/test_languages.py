@@ -0,0 +1,120 @@
+"""Test the used and unused files of each registered source language."""
+
+import argparse
+import json
+import os
+
+import pytest
+
+from tests.conftest import ZephyrBuild, write_ninja_deps
+from zephyr2vsc import const
+from zephyr2vsc.__main__ import parse_language
+from zephyr2vsc.languages import get_suffixes, split_by_language, update_languages
+from zephyr2vsc.workspace import Workspace
+
+# a C++ compile rule, which CMake writes to rules.ninja
+RULES_NINJA = """
+rule CXX_COMPILER__app_Debug
+  command = /sdk/bin/g++ $DEFINES $INCLUDES $FLAGS -o $out -c $in
+"""
+
+# a C++ source and a linker script, whose snippets only the deps log lists
+BUILD_NINJA = """
+build app/CMakeFiles/app.dir/src/shell.cpp.obj: CXX_COMPILER__app_Debug <SRC>/app/shell.cpp
+
+build zephyr/linker.cmd: CUSTOM_COMMAND | <SRC>/soc/arm/linker.ld
+  COMMAND = /sdk/bin/gcc -E -P -MD -MF linker.cmd.dep -o zephyr/linker.cmd
+"""
+
+SOURCE_FILES = [
+    os.path.join("app", "shell.cpp"),
+    os.path.join("arch", "x86", "entry.S"),
+    os.path.join("include", "arm", "sections.ld"),
+    os.path.join("include", "x86.hpp"),
+    os.path.join("lib", "cpp", "new.cpp"),
+    os.path.join("soc", "arm", "linker.ld"),
+    os.path.join("soc", "x86", "linker.ld"),
+]
+
+
+def add_languages(zephyr_build: ZephyrBuild, deps_log: bool = True):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    for source_file in SOURCE_FILES:
+        os.makedirs(os.path.join(src_dir, os.path.dirname(source_file)), exist_ok=True)
+        open(os.path.join(src_dir, source_file), "w").close()
+    with open(os.path.join(build_dir, "CMakeFiles", "rules.ninja"), "a") as f:
+        f.write(RULES_NINJA)
+    with open(os.path.join(build_dir, "build.ninja"), "a") as f:
+        f.write(BUILD_NINJA.replace("<SRC>", src_dir))
+    if deps_log:
+        write_ninja_deps(
+            os.path.join(build_dir, ".ninja_deps"),
+            [
+                ("app/CMakeFiles/app.dir/src/main.c.obj", [f"{src_dir}/include/kernel.h"]),
+                (
+                    "zephyr/linker.cmd",
+                    [f"{src_dir}/soc/arm/linker.ld", f"{src_dir}/include/arm/sections.ld"],
+                ),
+            ],
+        )
+
+
+def generate(zephyr_build: ZephyrBuild, **kwargs) -> dict:
+    workspace = Workspace(
+        zephyr_build.src_dir, zephyr_build.build_dir, zephyr_build.compiler_path, **kwargs
+    )
+    workspace.generate()
+    with open(workspace.config_jsons[0]) as f:
+        return json.load(f)["files.exclude"]
+
+
+def test_unused_files_of_every_language_are_excluded(zephyr_build: ZephyrBuild, capsys):
+    add_languages(zephyr_build)
+    files_exclude = generate(zephyr_build)
+
+    assert {"arch/x86/**", "lib/**", "soc/x86/**", "include/x86.hpp"} <= set(files_exclude)
+    assert not {"app/**", "app/shell.cpp", "soc/**", "soc/arm/**", "include/arm/**"} & set(
+        files_exclude
+    )
+    out = capsys.readouterr().out
+    for count, name in [(2, "C"), (1, "C++"), (1, "assembly"), (1, "linker script")]:
+        assert f"Exclude [{count}] unused {name} files." in out
+
+    # the C++ compile commands are in the compile DB
+    with open(os.path.join(zephyr_build.build_dir, const.COMPILE_DB_FILE_NAME)) as f:
+        files = {os.path.basename(entry["file"]) for entry in json.load(f)}
+    assert "shell.cpp" in files
+
+
+def test_languages_are_configurable(zephyr_build: ZephyrBuild, capsys):
+    add_languages(zephyr_build, deps_log=False)
+    languages = update_languages(const.SOURCE_LANGUAGES, [("assembly", ())])
+    files_exclude = generate(zephyr_build, languages=languages)
+
+    # the assembly files are not excluded, the linker scripts and headers without a deps log
+    assert "lib/**" in files_exclude
+    assert not {"arch/**", "arch/x86/**", "soc/x86/**", "include/x86.hpp"} & set(files_exclude)
+    out = capsys.readouterr().out
+    assert "assembly" not in out and "unused linker script files" not in out
+
+
+def test_registry_helpers():
+    languages = update_languages(
+        const.SOURCE_LANGUAGES, [("C++", (".cpp", ".h")), ("linker script", ())]
+    )
+    # a suffix moves to the language it is given to, a language without suffixes is removed
+    assert languages["header"] == (".hpp",)
+    assert "linker script" not in languages
+    assert get_suffixes(languages, deps=True) == (".hpp",)
+    assert get_suffixes(languages, deps=False) == (".c", ".cpp", ".h", ".S", ".s")
+
+    split = split_by_language(["a.c", "b.S", "c.s", "d.h", "e.hpp", "f.txt", "g"], languages)
+    assert split == {"C": {"a.c"}, "C++": {"d.h"}, "assembly": {"b.S", "c.s"}, "header": {"e.hpp"}}
+
+
+def test_parse_language():
+    assert parse_language("Rust=.rs") == ("Rust", (".rs",))
+    assert parse_language("assembly=") == ("assembly", ())
+    for text in ["Rust", "=.rs", "Rust=rs", "Rust=.tar.gz"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_language(text)
@@ -0,0 +1,138 @@
+"""Test the zephyr2vsc CLI on the tiny fixture build."""
+
+import json
+import os
+import runpy
+import sys
+
+import pytest
+
+import zephyr2vsc
+from tests.conftest import ZephyrBuild, write_ninja_files
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.helpers import generate_vscode_config_jsons
+
+
+def generate(zephyr_build: ZephyrBuild, *options: str):
+    main([zephyr_build.compiler_path, zephyr_build.src_dir, zephyr_build.build_dir, *options])
+
+
+def check(zephyr_build: ZephyrBuild) -> object:
+    with pytest.raises(SystemExit) as exit_info:
+        generate(zephyr_build, "--check")
+    return exit_info.value.code
+
+
+def touch(path: str):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_check_and_incremental_regeneration(zephyr_build: ZephyrBuild, capsys):
+    assert check(zephyr_build) == 1
+
+    generate(zephyr_build)
+    with open(os.path.join(zephyr_build.src_dir, ".vscode", "settings.json")) as f:
+        settings = json.load(f)
+    assert "lib/**" in settings["files.exclude"]
+    assert check(zephyr_build) == 0
+
+    capsys.readouterr()
+    generate(zephyr_build)
+    assert capsys.readouterr().out.count("is up to date") == 8
+
+    # rules.ninja is included by build.ninja, it does not feed the source tree scan
+    touch(os.path.join(zephyr_build.build_dir, "CMakeFiles", "rules.ninja"))
+    assert check(zephyr_build) == 1
+    generate(zephyr_build)
+    out = capsys.readouterr().out
+    assert "Stage [used_h_files] is up to date" in out
+    assert "Stage [all_files] is up to date" in out
+    assert "Stage [compdb] is up to date" not in out
+    assert "Stage [configs] is up to date" not in out
+
+    # a deleted output is regenerated
+    os.remove(os.path.join(zephyr_build.build_dir, "zephyr_compile_db.json"))
+    assert check(zephyr_build) == 1
+    generate(zephyr_build, "--force")
+    assert check(zephyr_build) == 0
+
+
+def test_usage_without_arguments(capsys, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["zephyr2vsc"])
+    with pytest.raises(SystemExit) as exit_info:
+        runpy.run_path(
+            os.path.join(os.path.dirname(zephyr2vsc.__file__), "__main__.py"), {}, "__main__"
+        )
+    assert exit_info.value.code == 0
+    assert capsys.readouterr().out.startswith("usage: ")
+
+
+def test_configs_without_configurations_get_the_default_one(zephyr_build: ZephyrBuild):
+    src_dir = zephyr_build.src_dir
+    db_full_path = os.path.join(zephyr_build.build_dir, "zephyr_compile_db.json")
+    used_c_files = {os.path.join("app", "main.c")}
+    generate_vscode_config_jsons(
+        {os.path.join("lib", "unused.c")},
+        used_c_files,
+        zephyr_build.compiler_path,
+        db_full_path,
+        src_dir,
+    )
+
+    with open(os.path.join(src_dir, ".vscode", "c_cpp_properties.json")) as f:
+        (configuration,) = json.load(f)["configurations"]
+    assert configuration["name"] == "Zephyr"
+    assert configuration["compileCommands"] == db_full_path.replace("\\", "/")
+    assert "app" in configuration["browse"]["path"]
+
+
+def test_one_configuration_per_build_dir(zephyr_build: ZephyrBuild):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    other_build_dir = os.path.join(src_dir, "build_other")
+    write_ninja_files(other_build_dir, src_dir)
+    with open(os.path.join(other_build_dir, "build.ninja"), "a") as f:
+        f.write(f"build lib.c.obj: C_COMPILER__app_Debug {src_dir}/lib/unused.c\n")
+    for board, board_build_dir in [("nrf52dk_nrf52832", build_dir), ("qemu_x86", other_build_dir)]:
+        with open(os.path.join(board_build_dir, "CMakeCache.txt"), "w") as f:
+            f.write(f"# This is the CMakeCache file.\nCACHED_BOARD:STRING={board}\n")
+
+    main([zephyr_build.compiler_path, src_dir, build_dir, other_build_dir])
+
+    with open(os.path.join(src_dir, ".vscode", "c_cpp_properties.json")) as f:
+        configurations = json.load(f)["configurations"]
+    assert [c["name"] for c in configurations] == ["nrf52dk_nrf52832", "qemu_x86"]
+    assert configurations[1]["compileCommands"] == f"{other_build_dir}/zephyr_compile_db.json"
+    assert {"app", "lib"} <= set(configurations[1]["browse"]["path"])
+
+    with open(os.path.join(src_dir, ".vscode", "settings.json")) as f:
+        files_exclude = json.load(f)["files.exclude"]
+    assert "drivers/**" in files_exclude
+    assert "lib/**" not in files_exclude
+
+
+def test_watcher_and_search_exclude_the_unused_dirs_and_the_builds(
+    zephyr_build: ZephyrBuild, capsys
+):
+    generate(zephyr_build)
+
+    with open(os.path.join(zephyr_build.src_dir, ".vscode", "settings.json")) as f:
+        settings = json.load(f)
+    assert {"build/**", "drivers/**", "lib/**"} <= set(settings["files.watcherExclude"])
+    assert set(settings["search.exclude"]) == {"build/**"}
+    assert "Excluded [2] of [2] unused dirs with [2] of [2] unused source files" in (
+        capsys.readouterr().out
+    )
+
+
+@pytest.mark.parametrize("jobs", ["0", "-1", "two"])
+def test_jobs_must_be_a_positive_integer(zephyr_build: ZephyrBuild, capsys, jobs: str):
+    with pytest.raises(SystemExit) as exit_info:
+        main([zephyr_build.compiler_path, zephyr_build.src_dir, zephyr_build.build_dir, "-j", jobs])
+    assert exit_info.value.code == 2
+    assert f"expected a positive integer, got [{jobs}]" in capsys.readouterr().err
+
+
+def test_jobs_run_the_stages_one_at_a_time(zephyr_build: ZephyrBuild):
+    generate(zephyr_build, "-j", "1")
+    assert check(zephyr_build) == 0
@@ -0,0 +1,157 @@
+"""Test the in-process evaluation of build.ninja against what `ninja -t compdb` prints."""
+
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc.helpers import (
+    generate_compilation_db,
+    get_ninja_rules,
+    get_relevant_source_files_relative_path,
+)
+from zephyr2vsc.ninja import NinjaManifest
+
+
+def test_manifest_expands_edge_rule_and_global_variables(zephyr_build: ZephyrBuild):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    manifest = NinjaManifest.load(build_dir)
+
+    assert [edge.rule.name for edge in manifest.edges] == [
+        "C_COMPILER__app_Debug",
+        "ASM_COMPILER__app_Debug",
+        "C_COMPILER__app_Debug",
+        "C_STATIC_LIBRARY_LINKER__app_Debug",
+        "CUSTOM_COMMAND",
+    ]
+    c_edge, asm_edge = manifest.edges[:2]
+    assert c_edge.order_only == ["cmake_object_order_depends_target_app"]
+    assert asm_edge.outputs == ["app/CMakeFiles/app.dir/arch/start.S.obj"]
+    assert asm_edge.inputs == [f"{src_dir}/arch/start up.S"]
+    assert manifest.lookup_edge_variable(asm_edge, "command") == (
+        "/sdk/bin/gcc   -xassembler-with-cpp -o app/CMakeFiles/app.dir/arch/start.S.obj"
+        f" -c '{src_dir}/arch/start up.S'"
+    )
+    assert manifest.lookup_edge_variable(c_edge, "cmake_ninja_workdir") == f"{build_dir}/"
+
+
+def test_generate_compilation_db_only_keeps_compile_rules(zephyr_build: ZephyrBuild):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    db_full_path = generate_compilation_db(build_dir, get_ninja_rules(build_dir))
+
+    with open(db_full_path, "r") as f:
+        compile_db = json.load(f)
+
+    assert compile_db[0] == {
+        "directory": build_dir,
+        "command": f"/sdk/bin/gcc -DKERNEL -D__ZEPHYR__=1 -I{src_dir}/include"
+        f" -Izephyr/include/generated -Os -include{build_dir}/zephyr/include/generated/autoconf.h"
+        f" -include{src_dir}/a b.h -MD -MT app/CMakeFiles/app.dir/src/main.c.obj"
+        " -MF app/CMakeFiles/app.dir/src/main.c.obj.d"
+        f" -o app/CMakeFiles/app.dir/src/main.c.obj -c {src_dir}/app/main.c",
+        "file": f"{src_dir}/app/main.c",
+        "output": "app/CMakeFiles/app.dir/src/main.c.obj",
+    }
+    assert [entry["file"] for entry in compile_db] == [
+        f"{src_dir}/app/main.c",
+        f"{src_dir}/arch/start up.S",
+        "zephyr/misc/empty_file.c",
+    ]
+
+
+def test_manifest_indexes_included_files_once(zephyr_build: ZephyrBuild):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    os.makedirs(os.path.join(build_dir, "sub"))
+    with open(os.path.join(build_dir, "sub", "build.ninja"), "wb") as f:
+        f.write(
+            b"rule SUB_COMPILER\r\n  command = cc $in\r\n"
+            b"build sub/a.c.obj sub/b.c.obj: SUB_COMPILER $\r\n  " + src_dir.encode() + b"/sub/a.c"
+            b" | sub/gen.h\r\n"
+            b"build sub/gen.h: CUSTOM_COMMAND\r\n"
+        )
+    open(os.path.join(build_dir, "empty.ninja"), "w").close()
+    with open(os.path.join(build_dir, "build.ninja"), "a") as f:
+        f.write("subninja sub/build.ninja\ninclude empty.ninja\n")
+
+    manifest = NinjaManifest.load(build_dir)
+    assert NinjaManifest.load(build_dir) is manifest
+    # the CMake rules are read from rules.ninja, the manifest also has the included ones
+    assert manifest.rule_names() == get_ninja_rules(build_dir) | {"SUB_COMPILER"}
+    assert get_ninja_rules(build_dir) == {
+        "ASM_COMPILER__app_Debug",
+        "CUSTOM_COMMAND",
+        "C_COMPILER__app_Debug",
+        "C_STATIC_LIBRARY_LINKER__app_Debug",
+    }
+    assert manifest.edges[-2].outputs == ["sub/a.c.obj", "sub/b.c.obj"]
+    assert manifest.edges[-2].implicit_inputs == ["sub/gen.h"]
+    assert any("sub/gen.h" in edge.outputs for edge in manifest.edges)
+    # the continued edges are found, the generated sources are in the build dir
+    assert get_relevant_source_files_relative_path(src_dir, build_dir, (".c", ".S")) == {
+        os.path.join("app", "main.c"),
+        os.path.join("arch", "start up.S"),
+        os.path.join("sub", "a.c"),
+        os.path.join(build_dir, "zephyr", "misc", "empty_file.c"),
+    }
+
+    # a changed file is scanned again
+    with open(os.path.join(build_dir, "empty.ninja"), "w") as f:
+        f.write("rule EMPTY\n  command = true\n")
+    assert "EMPTY" in NinjaManifest.load(build_dir).rule_names()
+
+
+# a pool, a default target, a validation, paths made of edge variables, implicit outputs and
+# a binding made of a global variable
+NEWLINE_BUILD_NINJA = """
+pool single_pool
+  depth = 1
+
+cflags = -O2
+
+rule JOIN_COMPILER
+  command = /sdk/bin/gcc $defines -c $in -o $out
+
+build app/d.c.obj | app/d.c.lst: JOIN_COMPILER <SRC>/app/d.c <SRC>/app/e$ f.c
+  defines = $cflags -DD
+
+rule NEWLINE_COMPILER
+  command = /sdk/bin/gcc -c $in_newline -o $out
+  pool = single_pool
+
+build $obj_dir/b.c.obj: NEWLINE_COMPILER $src_dir/b.c $src_dir/c.c |@ app/validate
+  obj_dir = app
+  src_dir = <SRC>/app
+
+default app/b.c.obj
+"""
+
+
+@pytest.mark.skipif(shutil.which("ninja") is None, reason="ninja is not installed")
+def test_compile_commands_match_ninja_compdb(zephyr_build: ZephyrBuild):
+    build_dir = zephyr_build.build_dir
+    with open(os.path.join(build_dir, "build.ninja"), "a") as f:
+        f.write(NEWLINE_BUILD_NINJA.replace("<SRC>", zephyr_build.src_dir))
+    rules = [
+        "C_COMPILER__app_Debug",
+        "ASM_COMPILER__app_Debug",
+        "NEWLINE_COMPILER",
+        "JOIN_COMPILER",
+    ]
+    process = subprocess.run(
+        ["ninja", "-C", build_dir, "-t", "compdb", *rules], stdout=subprocess.PIPE, check=True
+    )
+
+    manifest = NinjaManifest.load(build_dir)
+    assert list(manifest.iter_compile_commands(set(rules))) == json.loads(process.stdout)
+
+
+def test_manifest_skips_edges_without_a_rule(zephyr_build: ZephyrBuild):
+    build_dir = zephyr_build.build_dir
+    edges = NinjaManifest.load(build_dir).edges
+    with open(os.path.join(build_dir, "build.ninja"), "a") as f:
+        f.write("build app/x.c.obj\nbuild app/y.c.obj:\nbuild app/z.c.obj: UNKNOWN app/z.c\n")
+
+    assert len(NinjaManifest.load(build_dir).edges) == len(edges)
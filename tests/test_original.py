@@ -35,6 +35,29 @@ BUILD_PATH = os.path.join(ZEPHYR_PATH, "build")
 BLINKY_PATH = os.path.join("samples", "basic", "blinky")
 
 
+def compile_commands(compile_db):
+    """The original script dumps every ninja edge, zephyr2vsc keeps only the compile edges."""
+    return [entry for entry in compile_db if entry["output"].endswith(".obj")]
+
+
+def excluded(files_exclude):
+    """The C files hidden by files.exclude, zephyr2vsc hides whole dirs with a "dir/**" glob."""
+    all_c_files = get_all_c_files_relative_path(ZEPHYR_PATH, exclude_dirs=[BUILD_PATH])
+    dirs = tuple(pattern[:-2] for pattern in files_exclude if pattern.endswith("/**"))
+    return {
+        c_file
+        for c_file in (f.replace("\\", "/") for f in all_c_files)
+        if c_file in files_exclude or c_file.startswith(dirs)
+    }
+
+
+def browsed(c_properties):
+    """The original browses every folder of a used C file, zephyr2vsc only their top folders."""
+    browse_paths = c_properties["configurations"][0]["browse"]["path"]
+    roots = tuple(path.rstrip("/") + "/" for path in browse_paths if not path.endswith("/*"))
+    return lambda folder: "./" in roots or (folder + "/").startswith(roots)
+
+
 @pytest.fixture
 def blinky():
     process = subprocess.run(
@@ -63,10 +86,10 @@ def test_blinky(blinky: None):
     with open(os.path.join(ZEPHYR_PATH, ".vscode", "c_cpp_properties.json"), "r") as f:
         c_properties = json.load(f)
 
-    assert compile_db_original == compile_db
-    assert set(settings_original["files.exclude"]) == set(settings["files.exclude"])
-    assert set(c_properties_original["configurations"][0]["browse"]["path"]) == set(
-        c_properties["configurations"][0]["browse"]["path"]
+    assert compile_commands(compile_db_original) == compile_db
+    assert excluded(settings_original["files.exclude"]) == excluded(settings["files.exclude"])
+    assert all(
+        map(browsed(c_properties), c_properties_original["configurations"][0]["browse"]["path"])
     )
 
     # test as module
@@ -75,7 +98,7 @@ def test_blinky(blinky: None):
 
     ninja_rules = get_ninja_rules(build_path)
     used_c_files = get_relevant_c_files_relative_path(src_path, build_path)
-    all_c_files = get_all_c_files_relative_path(src_path)
+    all_c_files = get_all_c_files_relative_path(src_path, exclude_dirs=[build_path])
     unused_c_files = all_c_files - used_c_files
     db_full_path = generate_compilation_db(build_path, ninja_rules)
     generate_vscode_config_jsons(
@@ -89,8 +112,8 @@ def test_blinky(blinky: None):
     with open(os.path.join(ZEPHYR_PATH, ".vscode", "c_cpp_properties.json"), "r") as f:
         c_properties = json.load(f)
 
-    assert compile_db_original == compile_db
-    assert set(settings_original["files.exclude"]) == set(settings["files.exclude"])
-    assert set(c_properties_original["configurations"][0]["browse"]["path"]) == set(
-        c_properties["configurations"][0]["browse"]["path"]
+    assert compile_commands(compile_db_original) == compile_db
+    assert excluded(settings_original["files.exclude"]) == excluded(settings["files.exclude"])
+    assert all(
+        map(browsed(c_properties), c_properties_original["configurations"][0]["browse"]["path"])
     )
@@ -0,0 +1,154 @@
+"""Test the parallel, pruning source tree walker."""
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc.helpers import get_all_c_files_relative_path
+from zephyr2vsc.scan import (
+    DirIndex,
+    get_git_index_file,
+    read_git_index,
+    scan_git_checkout,
+    scan_source_tree,
+)
+
+
+def test_scan_matches_os_walk(zephyr_build: ZephyrBuild):
+    src_dir = zephyr_build.src_dir
+    expected = {
+        os.path.relpath(os.path.join(dir, file), src_dir)
+        for dir, _, files in os.walk(src_dir)
+        for file in files
+        if file.endswith(".c")
+    }
+    assert scan_source_tree(src_dir, jobs=1) == expected
+    assert scan_source_tree(src_dir, (".c", ".S")) == expected | {
+        os.path.join("arch", "start up.S")
+    }
+
+
+def test_scan_prunes_ignored_and_build_dirs(zephyr_build: ZephyrBuild):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    for hidden in [".git/objects/x.c", "build/zephyr/isr_tables.c", "samples/hello/main.c"]:
+        os.makedirs(os.path.join(src_dir, os.path.dirname(hidden)), exist_ok=True)
+        open(os.path.join(src_dir, hidden), "w").close()
+    os.symlink(os.path.join(src_dir, "lib"), os.path.join(src_dir, "samples", "lib"))
+
+    assert get_all_c_files_relative_path(src_dir, exclude_dirs=[build_dir]) == {
+        os.path.join("app", "main.c"),
+        os.path.join("drivers", "unused", "unused.c"),
+        os.path.join("lib", "unused.c"),
+        os.path.join("samples", "hello", "main.c"),
+    }
+    assert get_all_c_files_relative_path(src_dir, [".git", "samples/*", "unused"]) == {
+        os.path.join("app", "main.c"),
+        os.path.join("build", "zephyr", "isr_tables.c"),
+        os.path.join("lib", "unused.c"),
+    }
+
+
+def test_index_only_lists_changed_dirs(zephyr_build: ZephyrBuild, tmp_path, monkeypatch):
+    src_dir = zephyr_build.src_dir
+    index_path = str(tmp_path / "index" / "index.sqlite")
+    expected = scan_source_tree(src_dir)
+    # dirs changed just before the scan may change again within the same mtime
+    for dir, _, _ in os.walk(src_dir):
+        os.utime(dir, ns=(10**18, 10**18))
+    assert scan_source_tree(src_dir, index_path=index_path) == expected
+    assert not DirIndex.load(index_path, src_dir, (".c",)).updated
+
+    listed = []
+    scandir = os.scandir
+
+    def listing_scandir(path):
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", listing_scandir)
+    assert scan_source_tree(src_dir, index_path=index_path) == expected
+    assert listed == []
+
+    os.makedirs(os.path.join(src_dir, "lib", "new"))
+    open(os.path.join(src_dir, "lib", "new", "new.c"), "w").close()
+    shutil.rmtree(os.path.join(src_dir, "drivers", "unused"))
+    listed.clear()
+    assert scan_source_tree(src_dir, index_path=index_path) == {
+        *expected - {os.path.join("drivers", "unused", "unused.c")},
+        os.path.join("lib", "new", "new.c"),
+    }
+    assert sorted(listed) == sorted(
+        os.path.join(src_dir, d) for d in ["drivers", "lib", os.path.join("lib", "new")]
+    )
+    # the other suffixes are indexed on their own
+    assert scan_source_tree(src_dir, (".S",), index_path=index_path) == {
+        os.path.join("arch", "start up.S")
+    }
+
+
+def test_broken_index_is_rebuilt(zephyr_build: ZephyrBuild, tmp_path):
+    src_dir = zephyr_build.src_dir
+    index_path = str(tmp_path / "index.sqlite")
+    with open(index_path, "w") as f:
+        f.write("not a SQLite file")
+    expected = scan_source_tree(src_dir)
+    assert scan_source_tree(src_dir, index_path=index_path) == expected
+
+    index = DirIndex.load(index_path, src_dir, (".c",))
+    assert index.entries
+    # a dir removed since it was indexed is listed again, which finds nothing
+    shutil.rmtree(os.path.join(src_dir, "lib"))
+    assert index.get(os.path.join(src_dir, "lib"), "lib" + os.sep) is None
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+@pytest.mark.parametrize("version", [2, 3, 4])
+def test_git_index_lists_the_tracked_files(zephyr_build: ZephyrBuild, version: int):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    open(os.path.join(src_dir, "untracked.c"), "w").close()
+    assert scan_git_checkout(src_dir) is None
+
+    def git(*args: str):
+        subprocess.run(["git", "-C", src_dir, *args], check=True, capture_output=True)
+
+    git("init", "-q")
+    git("config", "index.version", str(version))
+    # version 4 takes more than one byte to strip this path from the next one
+    open(os.path.join(src_dir, "drivers", "x" * 150 + ".c"), "w").close()
+    git("add", "-A")
+    if version == 3:
+        git("update-index", "--skip-worktree", "app/main.c")
+    git("rm", "-q", "--cached", "untracked.c")
+
+    tracked = scan_source_tree(src_dir, exclude_dirs=[build_dir]) - {"untracked.c"}
+    assert scan_git_checkout(src_dir, exclude_dirs=[build_dir]) == tracked
+    assert scan_git_checkout(src_dir, ignore_globs=["drivers"]) == {
+        f for f in scan_source_tree(src_dir, ignore_globs=["drivers"]) if f != "untracked.c"
+    }
+    assert len(read_git_index(os.path.join(src_dir, ".git", "index"))) > len(tracked)
+
+
+def test_git_index_of_a_worktree(tmp_path):
+    src_dir = str(tmp_path / "src")
+    os.makedirs(os.path.join(tmp_path, "repo.git"))
+    os.makedirs(src_dir)
+    open(os.path.join(tmp_path, "repo.git", "index"), "wb").close()
+
+    with open(os.path.join(src_dir, ".git"), "w") as f:
+        f.write("gitdir: ../repo.git\n")
+    assert get_git_index_file(src_dir) == os.path.join(src_dir, "../repo.git", "index")
+    with open(os.path.join(src_dir, ".git"), "w") as f:
+        f.write("not a gitdir link\n")
+    assert get_git_index_file(src_dir) is None
+
+
+@pytest.mark.parametrize("header", [b"DIRC\0\0\0\5\0\0\0\0", b"XXXX\0\0\0\2\0\0\0\0"])
+def test_unsupported_git_index(tmp_path, header: bytes):
+    index_file = str(tmp_path / "index")
+    with open(index_file, "wb") as f:
+        f.write(header)
+    with pytest.raises(ValueError, match="Unsupported git index"):
+        read_git_index(index_file)
@@ -0,0 +1,64 @@
+"""Test the stage scheduler."""
+
+import functools
+import threading
+
+import pytest
+
+from zephyr2vsc import instrument
+from zephyr2vsc.cache import BuildCache
+from zephyr2vsc.schedule import Stages, run_stages
+
+
+def test_independent_stages_overlap_and_dependent_ones_wait(tmp_path):
+    both_started = threading.Barrier(2, timeout=5)
+    results: dict = {}
+
+    def wait_for_the_other(result: str) -> str:
+        both_started.wait()
+        return result
+
+    stages: Stages = {
+        "scan": (lambda: wait_for_the_other("files"), [], [], []),
+        "rules": (lambda: wait_for_the_other("rules"), [], [], []),
+        "compdb": (lambda: results["rules"] + " db", [], [], ["rules", "builds"]),
+    }
+    with instrument.use(instrument.Profiler()) as profiler:
+        with instrument.stage("build"):
+            run_stages(BuildCache(str(tmp_path), {}), stages, results, jobs=2)
+
+    assert results == {"scan": "files", "rules": "rules", "compdb": "rules db"}
+    assert {record.name: record.depth for record in profiler.records} == {
+        "build": 0,
+        "scan": 1,
+        "rules": 1,
+        "compdb": 1,
+    }
+
+
+def test_stages_run_one_at_a_time_while_memory_is_traced(tmp_path):
+    running: list = []
+    overlapped = []
+
+    def compute(name: str) -> str:
+        running.append(name)
+        overlapped.append(len(running) > 1)
+        threading.Event().wait(0.02)
+        running.remove(name)
+        return name
+
+    stages: Stages = {name: (functools.partial(compute, name), [], [], []) for name in "abc"}
+    with instrument.use(instrument.Profiler(trace_memory=True)) as profiler:
+        run_stages(BuildCache(str(tmp_path), {}), stages, {}, jobs=3)
+    # tracemalloc has one peak for the process, overlapping stages would share it
+    assert overlapped == [False] * 3
+    assert all(record.peak_bytes is not None for record in profiler.records)
+
+
+def test_cyclic_stages_are_rejected(tmp_path):
+    stages: Stages = {
+        "a": (lambda: 1, [], [], ["b"]),
+        "b": (lambda: 2, [], [], ["a"]),
+    }
+    with pytest.raises(ValueError, match="depend on each other: a, b"):
+        run_stages(BuildCache(str(tmp_path), {}), stages, {}, jobs=1)
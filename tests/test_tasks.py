@@ -0,0 +1,80 @@
+"""Test the task compiling the current file and its object file tables."""
+
+import json
+import os
+import subprocess
+import sys
+from typing import List
+
+import pytest
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.tasks import (
+    COMPILE_TASK_LABEL,
+    find_object,
+    get_object_table_path,
+    write_object_table,
+)
+
+
+def test_compile_task_builds_the_object_of_the_file(zephyr_build: ZephyrBuild, monkeypatch):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    tasks_path = os.path.join(src_dir, ".vscode", "tasks.json")
+    with open(tasks_path, "w") as f:
+        json.dump({"version": "2.0.0", "tasks": [{"label": "mine", "command": "make"}]}, f)
+
+    main([zephyr_build.compiler_path, src_dir, build_dir])
+    with open(get_object_table_path(build_dir)) as f:
+        assert f.read().splitlines() == [
+            f"{src_dir}/app/main.c\tapp/CMakeFiles/app.dir/src/main.c.obj",
+            f"{src_dir}/arch/start up.S\tapp/CMakeFiles/app.dir/arch/start.S.obj",
+            f"{build_dir}/zephyr/misc/empty_file.c\tapp/CMakeFiles/app.dir/misc/empty_file.c.obj",
+        ]
+    with open(tasks_path) as f:
+        tasks = json.load(f)["tasks"]
+    assert [task["label"] for task in tasks] == ["mine", COMPILE_TASK_LABEL]
+    assert tasks[1]["args"] == ["-m", "zephyr2vsc", "compile", "${file}", "--build-dir", build_dir]
+
+    # the task runs the Python which generated it, another one regenerates it
+    monkeypatch.setattr(sys, "executable", "/other/python")
+    main([zephyr_build.compiler_path, src_dir, build_dir])
+    with open(tasks_path) as f:
+        assert json.load(f)["tasks"][1]["command"] == "/other/python"
+    monkeypatch.undo()
+
+    assert find_object(build_dir, os.path.join(src_dir, "app", ".", "main.c")) == (
+        "app/CMakeFiles/app.dir/src/main.c.obj"
+    )
+    commands: List[List[str]] = []
+    returncodes = [0, 2]
+
+    def run(command: List[str]) -> subprocess.CompletedProcess:
+        commands.append(command)
+        return subprocess.CompletedProcess(command, returncodes.pop(0))
+
+    monkeypatch.setattr(subprocess, "run", run)
+    main_c = os.path.join(src_dir, "app", "main.c")
+    for argv, code in [
+        ([main_c, "-b", build_dir, "-b", src_dir], 0),
+        ([os.path.join(src_dir, "lib", "unused.c"), "-b", build_dir], 1),
+        # a failed build ends with the exit code of ninja
+        ([main_c, "-b", build_dir], 2),
+    ]:
+        with pytest.raises(SystemExit) as exit_info:
+            main(["compile", *argv])
+        assert exit_info.value.code == code
+    assert commands == [["ninja", "-C", build_dir, "app/CMakeFiles/app.dir/src/main.c.obj"]] * 2
+
+
+def test_object_table_is_replaced_atomically(tmp_path):
+    path = str(tmp_path / "objects.tsv")
+    assert write_object_table(path, {"/src/a.c": "a.c.obj"})
+    os.chmod(path, 0o640)
+    mode = os.stat(path).st_mode
+
+    assert not write_object_table(path, {"/src/a.c": "a.c.obj"})
+    assert write_object_table(path, {"/src/b.c": "b.c.obj"})
+    assert os.listdir(tmp_path) == ["objects.tsv"] and os.stat(path).st_mode == mode
+    with open(path) as f:
+        assert f.read() == "/src/b.c\tb.c.obj\n"
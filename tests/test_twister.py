@@ -0,0 +1,119 @@
+"""Test the workspace of all the builds of a twister output dir."""
+
+import csv
+import os
+
+import pytest
+
+from tests.conftest import ZephyrBuild, write_ninja_deps, write_ninja_files
+from zephyr2vsc import const
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.twister import TwisterWorkspace, UsageMatrix, find_build_dirs
+from zephyr2vsc.vscode_json import parse_jsonc
+
+
+def make_twister_out(zephyr_build: ZephyrBuild) -> str:
+    """Three builds of the fixture app, one of them also compiling lib/unused.c."""
+    src_dir = zephyr_build.src_dir
+    twister_out = os.path.join(src_dir, "twister-out")
+    for i, board in enumerate(["qemu_x86", "qemu_x86", "native_sim"]):
+        build_dir = os.path.join(twister_out, board, "samples", f"hello{i}")
+        write_ninja_files(build_dir, src_dir)
+        # a nested build.ninja, e.g. of an external project, is not another build
+        write_ninja_files(os.path.join(build_dir, "external"), src_dir)
+    with open(os.path.join(build_dir, "build.ninja"), "a") as f:
+        f.write(f"build lib.c.obj: C_COMPILER__app_Debug {src_dir}/lib/unused.c\n")
+    return twister_out
+
+
+def test_find_build_dirs(zephyr_build: ZephyrBuild):
+    twister_out = make_twister_out(zephyr_build)
+    assert find_build_dirs([twister_out]) == [
+        os.path.join(twister_out, "native_sim", "samples", "hello2"),
+        os.path.join(twister_out, "qemu_x86", "samples", "hello0"),
+        os.path.join(twister_out, "qemu_x86", "samples", "hello1"),
+    ]
+
+
+def test_usage_matrix():
+    matrix = UsageMatrix(["a", "b", "c"])
+    matrix.add(0, ["x.c", "y.c"])
+    matrix.add(2, ["x.c"])
+    matrix.add(1, ["x.c"])
+    assert matrix.union() == {"x.c", "y.c"}
+    assert matrix.intersection() == {"x.c"}
+    assert (matrix.count("x.c"), matrix.count("y.c"), matrix.count("z.c")) == (3, 1, 0)
+    assert matrix.users("y.c") == ["a"]
+
+
+def test_union_and_intersection_workspaces(zephyr_build: ZephyrBuild):
+    src_dir = zephyr_build.src_dir
+    twister_out = make_twister_out(zephyr_build)
+    settings_path = os.path.join(src_dir, ".vscode", "settings.json")
+
+    main([zephyr_build.compiler_path, src_dir, twister_out, "--twister", "union"])
+    with open(settings_path) as f:
+        settings = parse_jsonc(f.read())
+    assert "lib/**" not in settings["files.exclude"]
+    assert "drivers/**" in settings["files.exclude"]
+    assert "twister-out/**" in settings["files.watcherExclude"]
+
+    with open(os.path.join(src_dir, ".vscode", const.USAGE_REPORT_FILE_NAME)) as f:
+        rows = {row["file"]: row for row in csv.DictReader(f)}
+    assert rows["app/main.c"]["builds"] == "3"
+    assert (rows["lib/unused.c"]["builds"], rows["lib/unused.c"]["share"]) == ("1", "0.333")
+    assert rows["drivers/unused/unused.c"]["builds"] == "0"
+
+    main([zephyr_build.compiler_path, src_dir, twister_out, "--twister", "intersection"])
+    with open(settings_path) as f:
+        settings = parse_jsonc(f.read())
+    assert "lib/**" in settings["files.exclude"]
+    assert "app/**" not in settings["files.exclude"]
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(
+            [
+                zephyr_build.compiler_path,
+                src_dir,
+                twister_out,
+                "--twister",
+                "intersection",
+                "--check",
+            ]
+        )
+    assert exit_info.value.code == 0
+
+
+def test_headers_are_hidden_with_the_deps_log_of_every_build(zephyr_build: ZephyrBuild):
+    src_dir = zephyr_build.src_dir
+    twister_out = make_twister_out(zephyr_build)
+    open(os.path.join(src_dir, "include", "unused.h"), "w").close()
+    for build_dir in find_build_dirs([twister_out]):
+        write_ninja_deps(
+            os.path.join(build_dir, ".ninja_deps"),
+            [("app/CMakeFiles/app.dir/src/main.c.obj", [f"{src_dir}/include/kernel.h"])],
+        )
+
+    main([zephyr_build.compiler_path, src_dir, twister_out, "--twister", "union"])
+    with open(os.path.join(src_dir, ".vscode", "settings.json")) as f:
+        files_exclude = parse_jsonc(f.read())["files.exclude"]
+    assert "include/unused.h" in files_exclude and "include/kernel.h" not in files_exclude
+
+
+def test_invalid_twister_runs(zephyr_build: ZephyrBuild, capsys):
+    src_dir, compiler_path = zephyr_build.src_dir, zephyr_build.compiler_path
+    twister_out = make_twister_out(zephyr_build)
+    with pytest.raises(ValueError, match="Unknown twister mode"):
+        TwisterWorkspace(src_dir, twister_out, compiler_path, mode="all")
+
+    empty_dir = os.path.join(src_dir, "empty")
+    os.makedirs(empty_dir)
+    with pytest.raises(SystemExit) as exit_info:
+        main([compiler_path, src_dir, empty_dir, "--twister", "union"])
+    assert exit_info.value.code == 1
+    assert "No build dir found" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit) as exit_info:
+        main([compiler_path, src_dir, twister_out, "--twister", "union", "--west"])
+    assert exit_info.value.code == 2
+    assert "--west and --twister cannot be combined" in capsys.readouterr().err
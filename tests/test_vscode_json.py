@@ -0,0 +1,141 @@
+"""Test merging the generated settings into the VS Code JSON files."""
+
+import json
+import os
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc import const
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.vscode_json import (
+    merge_c_cpp_properties,
+    merge_patterns,
+    parse_jsonc,
+    update_json_file,
+)
+
+
+def test_parse_jsonc():
+    text = """{
+        // a comment
+        "url": "http://example.com/*", /* another
+        comment */ "list": [1, 2,],
+        "text": "a, }",
+    }"""
+    assert parse_jsonc(text) == {"url": "http://example.com/*", "list": [1, 2], "text": "a, }"}
+
+
+def test_update_keeps_the_user_keys_and_skips_unchanged_files(tmp_path):
+    path = str(tmp_path / "settings.json")
+    with open(path, "w") as f:
+        f.write('{\n  // mine\n  "editor.tabSize": 8,\n  "files.exclude": {"a": true},\n}\n')
+    os.chmod(path, 0o640)
+    mode = os.stat(path).st_mode
+
+    assert update_json_file(path, {"files.exclude": {"b": True}})
+    # the rewritten file keeps its mode, it is not private like a temporary file
+    assert os.stat(path).st_mode == mode
+    with open(path) as f:
+        assert json.load(f) == {"editor.tabSize": 8, "files.exclude": {"a": True, "b": True}}
+    assert sorted(os.listdir(tmp_path)) == ["settings.json", const.GENERATED_PATTERNS_FILE_NAME]
+
+    mtime_ns = os.stat(path).st_mtime_ns
+    assert not update_json_file(path, {"files.exclude": {"b": True}})
+    assert os.stat(path).st_mtime_ns == mtime_ns
+
+    # only the pattern generated last time is replaced, the one of the user is kept
+    assert update_json_file(path, {"files.exclude": {"c": True}})
+    with open(path) as f:
+        assert json.load(f)["files.exclude"] == {"a": True, "c": True}
+
+    with open(path, "w") as f:
+        f.write("{ not json")
+    assert update_json_file(path, {"files.exclude": {}})
+    assert "settings.json.bak" in os.listdir(tmp_path)
+
+
+def test_merge_patterns_keeps_the_user_patterns():
+    existing = {"mine/**": True, "old/**": True, "both/**": False}
+    generated = {"new/**": True, "both/**": True}
+    assert merge_patterns(existing, generated, ["old/**"]) == {
+        "mine/**": True,
+        "new/**": True,
+        "both/**": True,
+    }
+    assert merge_patterns(None, generated, []) == generated
+
+
+def test_merge_c_cpp_properties_replaces_the_generated_configurations():
+    existing = {
+        "configurations": [
+            {"name": "Mine", "compileCommands": "out/compile_commands.json"},
+            {"name": "Zephyr", "compileCommands": "old/zephyr_compile_db.json"},
+            {"name": "qemu_x86", "compileCommands": "qemu"},
+        ],
+        "enableConfigurationSquiggles": False,
+        "version": 3,
+    }
+    generated = {"configurations": [{"name": "qemu_x86", "compileCommands": "new"}], "version": 4}
+    assert merge_c_cpp_properties(existing, generated) == {
+        "configurations": [
+            {"name": "qemu_x86", "compileCommands": "new"},
+            {"name": "Mine", "compileCommands": "out/compile_commands.json"},
+        ],
+        "enableConfigurationSquiggles": False,
+        "version": 4,
+    }
+
+
+def test_regeneration_keeps_the_user_settings(zephyr_build: ZephyrBuild, capsys):
+    args = [zephyr_build.compiler_path, zephyr_build.src_dir, zephyr_build.build_dir]
+    settings_path = os.path.join(zephyr_build.src_dir, ".vscode", "settings.json")
+    os.makedirs(os.path.dirname(settings_path), exist_ok=True)
+    with open(settings_path, "w") as f:
+        json.dump({"editor.rulers": [100], "files.watcherExclude": {"out/**": True}}, f)
+
+    main(args)
+    with open(settings_path) as f:
+        settings = json.load(f)
+    assert settings["editor.rulers"] == [100]
+    assert "lib/**" in settings["files.exclude"]
+
+    # a pattern the user adds to a generated glob map survives the regeneration
+    settings["files.exclude"]["notes/**"] = True
+    with open(settings_path, "w") as f:
+        json.dump(settings, f)
+    main([*args, "--force"])
+    with open(settings_path) as f:
+        settings = json.load(f)
+    assert settings["files.exclude"]["notes/**"] and "lib/**" in settings["files.exclude"]
+    assert settings["files.watcherExclude"]["out/**"]
+
+    capsys.readouterr()
+    main([*args, "--force"])
+    assert "VS Code configuration JSON files are unchanged" in capsys.readouterr().out
+
+
+def test_upgrade_drops_the_per_file_excludes_of_the_baseline_tool(zephyr_build: ZephyrBuild):
+    args = [zephyr_build.compiler_path, zephyr_build.src_dir, zephyr_build.build_dir]
+    vscode_dir = os.path.join(zephyr_build.src_dir, ".vscode")
+    os.makedirs(vscode_dir, exist_ok=True)
+    # the baseline listed every unused file, app/main.c was not compiled then, and kept no record
+    files_exclude = dict(const.SETTINGS_JSON_TEMPLATE["files.exclude"])  # type: ignore
+    files_exclude.update(
+        {
+            "**/.github": True,
+            "app/main.c": True,
+            "drivers/unused/unused.c": True,
+            "lib/unused.c": True,
+            "notes/**": True,
+        }
+    )
+    with open(os.path.join(vscode_dir, "settings.json"), "w") as f:
+        json.dump({"files.exclude": files_exclude}, f)
+
+    main(args)
+    with open(os.path.join(vscode_dir, "settings.json")) as f:
+        files_exclude = json.load(f)["files.exclude"]
+    assert "app/main.c" not in files_exclude
+    assert "lib/unused.c" not in files_exclude and "lib/**" in files_exclude
+    assert files_exclude["notes/**"]
+    with open(os.path.join(vscode_dir, const.GENERATED_PATTERNS_FILE_NAME)) as f:
+        assert "lib/**" in json.load(f)["settings.json"]["files.exclude"]
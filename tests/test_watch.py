@@ -0,0 +1,134 @@
+"""Test the watchers the --watch mode waits on."""
+
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List
+
+import pytest
+
+from tests.conftest import ZephyrBuild
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.watch import (
+    InotifyWatcher,
+    PollingWatcher,
+    Watcher,
+    get_build_files,
+    is_ninja_running,
+    wait_for_build,
+)
+
+WATCHERS: List[Callable[[List[str]], Watcher]] = [
+    lambda paths: PollingWatcher(paths, interval=0.01)
+]
+if sys.platform.startswith("linux"):
+    WATCHERS.append(InotifyWatcher)
+
+
+def write_later(path: str, delay: float, count: int = 1):
+    def write():
+        for _ in range(count):
+            time.sleep(delay)
+            with open(path, "a") as f:
+                f.write("x\n")
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize("create_watcher", WATCHERS)
+def test_watcher_sees_changes_of_the_watched_files_only(tmp_path, create_watcher):
+    watched, other = str(tmp_path / ".ninja_log"), str(tmp_path / "other")
+    watcher: Watcher = create_watcher([watched])
+    try:
+        assert not watcher.wait(0.05)
+
+        with open(other, "w") as f:
+            f.write("x\n")
+        assert not watcher.wait(0.05)
+
+        write_later(watched, 0.05).join()
+        assert watcher.wait(1)
+    finally:
+        watcher.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_inotify_watcher_survives_a_pristine_build(tmp_path):
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    watcher = InotifyWatcher(get_build_files([str(build_dir)]))
+    try:
+        shutil.rmtree(build_dir)
+        assert watcher.wait(1)
+
+        build_dir.mkdir()
+        assert watcher.wait(2)
+        write_later(str(build_dir / "build.ninja"), 0.05).join()
+        assert watcher.wait(1)
+    finally:
+        watcher.close()
+
+
+def test_wait_for_build_returns_once_the_build_is_quiet(tmp_path):
+    path = str(tmp_path / ".ninja_log")
+    watcher = PollingWatcher([path], interval=0.01)
+    start = time.monotonic()
+    thread = write_later(path, 0.05, count=4)
+    wait_for_build(watcher, debounce=0.2)
+    assert not thread.is_alive()
+    assert time.monotonic() - start >= 0.4
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_wait_for_build_waits_while_ninja_runs(tmp_path):
+    path = str(tmp_path / ".ninja_log")
+    watcher = PollingWatcher([path], interval=0.01)
+    # a ninja process in the build dir, e.g. linking, which writes nothing for a while
+    ninja = subprocess.Popen(["bash", "-c", "exec -a ninja sleep 0.5"], cwd=str(tmp_path))
+    try:
+        time.sleep(0.1)
+        assert is_ninja_running([str(tmp_path)])
+        assert not is_ninja_running([str(tmp_path / "other")])
+        start = time.monotonic()
+        write_later(path, 0.01).join()
+        wait_for_build(watcher, debounce=0.05, build_dirs=[str(tmp_path)])
+        assert ninja.poll() is not None and time.monotonic() - start >= 0.3
+    finally:
+        ninja.kill()
+        ninja.wait()
+    assert not is_ninja_running([str(tmp_path)])
+
+
+def test_ninja_is_not_found_without_proc(tmp_path, monkeypatch):
+    listdir = os.listdir
+
+    def listdir_without_proc(path):
+        if path == "/proc":
+            raise FileNotFoundError(path)
+        return listdir(path)
+
+    monkeypatch.setattr(os, "listdir", listdir_without_proc)
+    assert not is_ninja_running([str(tmp_path)])
+    # a process which is gone once its files are read
+    monkeypatch.setattr(os, "listdir", lambda path: ["999999999"])
+    assert not is_ninja_running([str(tmp_path)])
+
+
+def test_watch_mode_regenerates_until_interrupted(zephyr_build: ZephyrBuild, capsys, monkeypatch):
+    builds = [None]
+
+    def wait_for_build(*_):
+        if not builds:
+            raise KeyboardInterrupt
+        builds.pop()
+
+    monkeypatch.setattr("zephyr2vsc.watch.wait_for_build", wait_for_build)
+    main([zephyr_build.compiler_path, zephyr_build.src_dir, zephyr_build.build_dir, "--watch"])
+    out = capsys.readouterr().out
+    assert out.count("Finished generating VSCode workspace") == 2
+    assert "Stopped watching." in out
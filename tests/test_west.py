@@ -0,0 +1,256 @@
+"""Test the multi-root workspace of the west projects."""
+
+import json
+import os
+import sys
+
+import pytest
+
+from tests.conftest import ZephyrBuild, write_ninja_deps
+from zephyr2vsc.__main__ import main
+from zephyr2vsc.west import attribute_files, get_west_projects
+
+WEST_YML = """\
+# the manifest of the fixture
+manifest:
+  defaults:
+    remote: upstream
+
+  remotes:
+    - name: upstream
+      url-base: https://github.com/zephyrproject-rtos
+
+  projects:
+    - name: hal_a
+      revision: 'abc#123'  # a quoted revision
+      path: modules/hal/a
+      groups: [hal, "a"]
+    - name: hal_b
+      path: modules/hal/b
+      import: true
+      userdata:
+    - name: lib_missing
+      path: modules/lib/missing
+    - name: bootloader
+      import:
+        file: west.yml
+        name-allowlist:
+        - mcuboot_dep
+        path-prefix: deps
+
+  self:
+    path: zephyr
+    import: submanifests
+"""
+
+
+def write(path: str, text: str = ""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def write_west_workspace(topdir: str):
+    write(os.path.join(topdir, ".west", "config"), "[manifest]\npath = zephyr\nfile = west.yml\n")
+    write(os.path.join(topdir, "zephyr", "west.yml"), WEST_YML)
+    # a project of a submanifest, and one of the manifest taking precedence over it
+    write(
+        os.path.join(topdir, "zephyr", "submanifests", "extra.yml"),
+        "manifest:\n  projects:\n  - name: extra\n  - name: hal_b\n    path: elsewhere\n",
+    )
+    write(
+        os.path.join(topdir, "bootloader", "west.yml"),
+        "manifest:\n  projects:\n    - name: mcuboot_dep\n    - name: not_allowed\n",
+    )
+    for project_dir in ["modules/hal/a", "modules/hal/b", "extra", "bootloader"]:
+        os.makedirs(os.path.join(topdir, project_dir), exist_ok=True)
+    os.makedirs(os.path.join(topdir, "deps", "mcuboot_dep"))
+    os.makedirs(os.path.join(topdir, "not_allowed"))
+
+
+FLOW_WEST_YML = """\
+manifest:
+  remotes: [{name: upstream, url-base: "https://github.com/zephyrproject-rtos"}]
+  projects:
+    - {name: hal_a, path: modules/hal/a, groups: [hal, "a, b"]}
+    - name: bootloader
+      import: {file: west.yml, name-allowlist: [mcuboot_dep], path-prefix: deps}
+    - {
+        name: extra,  # a flow mapping on several lines
+        revision: 'v1.0',
+      }
+  self: {path: zephyr, import: submanifests}
+"""
+
+
+def test_flow_mapping_manifests(tmp_path):
+    topdir = str(tmp_path)
+    write_west_workspace(topdir)
+    write(os.path.join(topdir, "zephyr", "west.yml"), FLOW_WEST_YML)
+    projects = get_west_projects(topdir)
+    assert [name for name, _ in projects] == [
+        "zephyr",
+        "hal_a",
+        "bootloader",
+        "extra",
+        "mcuboot_dep",
+    ]
+
+    write(os.path.join(topdir, "zephyr", "west.yml"), "manifest:\n  projects:\n  - {path: x}\n")
+    with pytest.raises(ValueError, match="a project has no name"):
+        get_west_projects(topdir)
+    write(os.path.join(topdir, "zephyr", "west.yml"), "manifest:\n  projects: [{name: x\n")
+    with pytest.raises(ValueError, match="Invalid west manifest"):
+        get_west_projects(topdir)
+
+
+def test_folded_and_quoted_scalars_are_read_as_yaml(tmp_path):
+    topdir = str(tmp_path)
+    write_west_workspace(topdir)
+    write(
+        os.path.join(topdir, "zephyr", "west.yml"),
+        "manifest:\n  projects:\n  - name: hal_a\n    description: >\n      a folded\n"
+        "      description\n    path: modules/hal/a\n  - name: b\n    path: \"x # y\"\n",
+    )
+    os.makedirs(os.path.join(topdir, "x # y"))
+    assert [(name, os.path.relpath(path, topdir)) for name, path in get_west_projects(topdir)] == [
+        ("zephyr", "zephyr"),
+        ("hal_a", os.path.join("modules", "hal", "a")),
+        ("b", "x # y"),
+    ]
+
+
+def test_west_manifests_need_pyyaml(tmp_path, monkeypatch):
+    topdir = str(tmp_path)
+    write_west_workspace(topdir)
+    # the import of PyYAML fails
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    with pytest.raises(ValueError, match="pip install pyyaml"):
+        get_west_projects(topdir)
+
+
+def test_imports_are_filtered_and_read_once(tmp_path):
+    topdir = str(tmp_path)
+    write(os.path.join(topdir, ".west", "config"), "[manifest]\npath = zephyr\n")
+    write(
+        os.path.join(topdir, "zephyr", "west.yml"),
+        """\
+manifest:
+  projects:
+    - {name: a, import: {file: a.yml, name-allowlist: x}}
+    - {name: b, import: {file: b.yml, name-blocklist: y}}
+    - {name: c, import: c.yml}
+    - {name: d, import: [d.yml]}
+  self:
+    import: west.yml
+""",
+    )
+    write(os.path.join(topdir, "a", "a.yml"), "manifest:\n  projects: [{name: x}, {name: y}]\n")
+    write(os.path.join(topdir, "b", "b.yml"), "manifest:\n  projects: [{name: y}, {name: z}]\n")
+    write(os.path.join(topdir, "c", "c.yml"))
+    for project_dir in ["c", "d", "x", "y", "z"]:
+        os.makedirs(os.path.join(topdir, project_dir), exist_ok=True)
+    projects = get_west_projects(topdir)
+    assert [name for name, _ in projects] == ["zephyr", "a", "b", "c", "d", "x", "z"]
+
+    write(os.path.join(topdir, "c", "c.yml"), "- not a manifest\n")
+    with pytest.raises(ValueError, match="it has no manifest mapping"):
+        get_west_projects(topdir)
+
+
+def test_projects_are_read_from_the_manifests_on_disk(tmp_path):
+    topdir = str(tmp_path)
+    write_west_workspace(topdir)
+    projects = get_west_projects(topdir)
+    assert [(name, os.path.relpath(path, topdir)) for name, path in projects] == [
+        ("zephyr", "zephyr"),
+        ("hal_a", os.path.join("modules", "hal", "a")),
+        ("hal_b", os.path.join("modules", "hal", "b")),
+        ("bootloader", "bootloader"),
+        ("extra", "extra"),
+        ("mcuboot_dep", os.path.join("deps", "mcuboot_dep")),
+    ]
+
+
+def test_files_go_to_the_innermost_project():
+    roots = [os.path.normpath(p) for p in ["/w/zephyr", "/w/modules/hal", "/w/modules/hal/a"]]
+    paths = [os.path.normpath(p) for p in ["/w/zephyr/k.c", "/w/modules/hal/a/x/y.c"]]
+    paths += [os.path.normpath(p) for p in ["/w/modules/hal/b.c", "/w/other/z.c"]]
+    assert attribute_files(paths, roots) == {
+        roots[0]: {"k.c"},
+        roots[1]: {"b.c"},
+        roots[2]: {os.path.join("x", "y.c")},
+    }
+
+
+def test_west_workspace_keeps_the_used_projects(zephyr_build: ZephyrBuild, capsys):
+    src_dir, build_dir = zephyr_build.src_dir, zephyr_build.build_dir
+    topdir = os.path.dirname(src_dir)
+    write_west_workspace(topdir)
+    hal_a = os.path.join(topdir, "modules", "hal", "a")
+    for path in ["src/a.c", "src/a.h", "src/a_unused.c", "src/a_unused.h", "sub/x.c"]:
+        write(os.path.join(hal_a, path))
+    write(os.path.join(topdir, "modules", "hal", "b", "b.c"))
+    with open(os.path.join(build_dir, "build.ninja"), "a") as f:
+        f.write(f"build hal_a.c.obj: C_COMPILER__app_Debug {hal_a}/src/a.c\n")
+
+    main([zephyr_build.compiler_path, src_dir, build_dir, "--west"])
+
+    with open(os.path.join(topdir, "zephyr.code-workspace")) as f:
+        workspace = json.load(f)
+    assert workspace["folders"] == [
+        {"name": "zephyr", "path": "zephyr"},
+        {"name": "hal_a", "path": "modules/hal/a"},
+    ]
+    assert workspace["settings"]["C_Cpp.default.compileCommands"] == (
+        f"{build_dir}/zephyr_compile_db.json"
+    )
+    with open(os.path.join(hal_a, ".vscode", "settings.json")) as f:
+        files_exclude = json.load(f)["files.exclude"]
+    assert {"src/a_unused.c", "sub/**"} <= set(files_exclude)
+    # there is no deps log, the headers stay visible
+    assert "src/a.h" not in files_exclude
+    assert not os.path.exists(os.path.join(topdir, "modules", "hal", "b", ".vscode"))
+    out = capsys.readouterr().out
+    assert "Found [6] west projects" in out
+    assert "Dropped [4] west projects without used files." in out
+
+    # the manifest is only read again once it, or a manifest it imports, changed
+    main([zephyr_build.compiler_path, src_dir, build_dir, "--west"])
+    assert "Stage [projects] is up to date" in capsys.readouterr().out
+    write(os.path.join(topdir, "zephyr", "submanifests", "extra.yml"), "manifest: {}\n")
+    main([zephyr_build.compiler_path, src_dir, build_dir, "--west"])
+    assert "Found [5] west projects" in capsys.readouterr().out
+    write(
+        os.path.join(topdir, "zephyr", "submanifests", "more.yml"),
+        "manifest:\n  projects:\n  - name: extra\n",
+    )
+    main([zephyr_build.compiler_path, src_dir, build_dir, "--west"])
+    assert "Found [6] west projects" in capsys.readouterr().out
+
+    # with a deps log, the headers no file includes are hidden too
+    write_ninja_deps(
+        os.path.join(build_dir, ".ninja_deps"),
+        [("hal_a.c.obj", [f"{hal_a}/src/a.c", f"{hal_a}/src/a.h"])],
+    )
+    main([zephyr_build.compiler_path, src_dir, build_dir, "--west"])
+    with open(os.path.join(hal_a, ".vscode", "settings.json")) as f:
+        files_exclude = json.load(f)["files.exclude"]
+    assert "src/a_unused.h" in files_exclude and "src/a.h" not in files_exclude
+
+
+def test_west_needs_a_west_workspace(zephyr_build: ZephyrBuild, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main([zephyr_build.compiler_path, zephyr_build.src_dir, zephyr_build.build_dir, "--west"])
+    assert exit_info.value.code == 1
+    assert "not in a west workspace" in capsys.readouterr().out
+
+
+def test_an_invalid_manifest_is_reported(zephyr_build: ZephyrBuild, capsys):
+    topdir = os.path.dirname(zephyr_build.src_dir)
+    write_west_workspace(topdir)
+    write(os.path.join(topdir, "zephyr", "west.yml"), "manifest:\n  projects:\n  - {path: x}\n")
+    with pytest.raises(SystemExit) as exit_info:
+        main([zephyr_build.compiler_path, zephyr_build.src_dir, zephyr_build.build_dir, "--west"])
+    assert exit_info.value.code == 1
+    assert "Invalid west manifest, a project has no name" in capsys.readouterr().out
@@ -0,0 +1,109 @@
+"""Test the reusable, memoized workspace stages."""
+
+import json
+import os
+
+from tests.conftest import ZephyrBuild, write_ninja_files
+from tests.test_main import touch
+from zephyr2vsc import instrument
+from zephyr2vsc.cache import BuildCache
+from zephyr2vsc.ninja import NinjaManifest
+from zephyr2vsc.workspace import Workspace, process_build
+
+
+def make_workspace(zephyr_build: ZephyrBuild) -> Workspace:
+    return Workspace(zephyr_build.src_dir, zephyr_build.build_dir, zephyr_build.compiler_path)
+
+
+def read_settings(workspace: Workspace) -> dict:
+    with open(workspace.config_jsons[0]) as f:
+        return json.load(f)
+
+
+def test_regeneration_reuses_the_results_in_memory(zephyr_build: ZephyrBuild, capsys, monkeypatch):
+    workspace = make_workspace(zephyr_build)
+    workspace.generate()
+    assert set(workspace.caches) == {zephyr_build.build_dir, workspace.vscode_dir}
+    settings = read_settings(workspace)
+
+    def load(*_):
+        raise AssertionError("the cache is read from the disk again")
+
+    monkeypatch.setattr(BuildCache, "load", load)
+    capsys.readouterr()
+    workspace.generate()
+    assert capsys.readouterr().out.count("is up to date") == 8
+
+    # a second workspace in the same process starts from the same templates
+    monkeypatch.undo()
+    other = make_workspace(zephyr_build)
+    other.invalidate()
+    other.generate()
+    assert read_settings(other) == settings
+
+
+def test_stages_are_computed_on_demand_and_memoized(zephyr_build: ZephyrBuild, capsys):
+    workspace = make_workspace(zephyr_build)
+    assert "C_COMPILER__app_Debug" in workspace.rules()
+    out = capsys.readouterr().out
+    assert "Found [4] ninja build rules" in out and "C source files" not in out
+
+    assert workspace.compdb() == os.path.join(zephyr_build.build_dir, "zephyr_compile_db.json")
+    assert "Stage [rules] is up to date" in capsys.readouterr().out
+
+    workspace.invalidate("rules")
+    workspace.compdb()
+    out = capsys.readouterr().out
+    assert "Found [4] ninja build rules" in out and "Stage [compdb] is up to date" not in out
+
+    # there is no deps log, the headers are not known
+    assert workspace.used_h_files() is None
+    assert os.path.join("lib", "unused.c") in workspace.all_files()
+
+
+def test_configs_follow_the_build_stages_across_calls(zephyr_build: ZephyrBuild, capsys):
+    workspace = make_workspace(zephyr_build)
+    workspace.configs()
+    assert "lib/**" in read_settings(workspace)["files.exclude"]
+
+    with open(os.path.join(zephyr_build.build_dir, "build.ninja"), "a") as f:
+        f.write(f"build lib.c.obj: C_COMPILER__app_Debug {zephyr_build.src_dir}/lib/unused.c\n")
+    touch(os.path.join(zephyr_build.build_dir, "build.ninja"))
+    workspace.used_files()
+    stale = workspace.stale_stages()
+    assert f"compdb [{zephyr_build.build_dir}]" in stale and "configs" in stale
+
+    workspace.configs()
+    assert "lib/**" not in read_settings(workspace)["files.exclude"]
+    assert workspace.stale_stages() == []
+
+
+def test_kept_workers_keep_the_manifests_of_their_builds(zephyr_build: ZephyrBuild):
+    src_dir = zephyr_build.src_dir
+    build_dirs = [zephyr_build.build_dir, os.path.join(src_dir, "build_other")]
+    write_ninja_files(build_dirs[1], src_dir)
+    workspace = Workspace(src_dir, build_dirs, zephyr_build.compiler_path, keep_workers=True)
+
+    def count_parsed_manifests() -> int:
+        with instrument.use(instrument.Profiler()) as profiler:
+            workspace.generate()
+        return [record.name for record in profiler.records].count("NinjaManifest.load")
+
+    try:
+        assert count_parsed_manifests() == 2
+        workspace.invalidate("rules")
+        assert count_parsed_manifests() == 0
+    finally:
+        workspace.close()
+
+
+def test_worker_runs_the_build_stages_it_is_given(zephyr_build: ZephyrBuild, tmp_path):
+    build_dir = zephyr_build.build_dir
+    cache = BuildCache(str(tmp_path), {})
+    results, _, records = process_build(
+        build_dir, zephyr_build.src_dir, False, cache, 1, ["rules", "compdb"]
+    )
+    assert set(results) == {"rules", "compdb"}
+    assert {"rules", "compdb"} <= {record.name for record in records}
+    # the worker does not keep the manifest of a build it may not get again
+    assert os.path.abspath(build_dir) not in NinjaManifest._loaded
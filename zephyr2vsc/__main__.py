@@ -1,60 +1,342 @@
 """The CLI entrypoint of zephyr2vsc."""
 
+import argparse
+import json
 import os
+import shlex
 import sys
+from typing import Any, Dict, List, Optional, Tuple, Type
 
-from zephyr2vsc.helpers import (
-    generate_compilation_db,
-    generate_vscode_config_jsons,
-    get_all_c_files_relative_path,
-    get_ninja_rules,
-    get_relevant_c_files_relative_path,
-)
+from zephyr2vsc import const, instrument
+from zephyr2vsc.languages import update_languages
+from zephyr2vsc.workspace import Workspace
 
-USAGE = f"""
-{os.linesep}
+# the modules of the subcommands and modes are imported when used, so that e.g. --check starts fast
+
+DESCRIPTION = """
 zephyr2vsc ver 0.11
 By ming.shao@intel.com
 [Description]:
   This tool imports Zephyr source code into Visual Studio Code in the context of a Zephyr build.
 [Pre-condition]:
   A Zephyr build must be made before using this tool because some build-generated files are needed.
-[usage]:
-  zephyr2vsc <compilerPath> <srcDir> <bldDir>
-  <compilerPath>: the fullpath of the compiler
-  <srcDir>: the Zephyr source code folder to open in VS Code.
-  <bldDir>: the Zephyr build folder where build.ninja file is located.
 """
 
-if len(sys.argv) != 4:
-    print(USAGE)
-else:
+
+def positive_int(text: str) -> int:
+    """Parse a count which must be at least 1, e.g. of `--jobs`."""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got [{text}]") from None
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got [{text}]")
+    return value
+
+
+def parse_language(text: str) -> Tuple[str, Tuple[str, ...]]:
+    """Parse a `NAME=SUFFIX,...` language of the `--language` option."""
+    name, equals, suffixes = text.partition("=")
+    if not name or not equals:
+        raise argparse.ArgumentTypeError(f"expected NAME=SUFFIX,..., got [{text}]")
+    parsed = tuple(s.strip() for s in suffixes.split(",") if s.strip())
+    if any(not s.startswith(".") or "." in s[1:] for s in parsed):
+        raise argparse.ArgumentTypeError(f"suffixes are file extensions like .c, got [{text}]")
+    return name.strip(), parsed
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="zephyr2vsc",
+        description=DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("compiler_path", help="the fullpath of the compiler")
+    parser.add_argument("src_dir", help="the Zephyr source code folder to open in VS Code.")
+    parser.add_argument(
+        "build_dirs",
+        nargs="+",
+        metavar="build_dir",
+        help="the Zephyr build folder where build.ninja file is located. "
+        "Several build folders, e.g. one per board, become one configuration each.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only check whether the generated files are up to date, exit with 1 if not.",
+    )
+    parser.add_argument(
+        "--scan-ignore",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="do not scan the source dirs whose name or relative path matches GLOB, "
+        f"in addition to {', '.join(const.SCAN_IGNORE_GLOBS)} and the build folder.",
+    )
+    parser.add_argument(
+        "--compact-compdb",
+        action="store_true",
+        help="write the compile commands as argument arrays without the output, dependency file "
+        "and warning flags and with deduplicated include dirs.",
+    )
+    parser.add_argument(
+        "--compdb-index",
+        action="store_true",
+        help=f"also write the compile commands to {const.COMPILE_INDEX_FILE_NAME} in the build "
+        "folder, for the query subcommand.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="ignore the cache in the build folder and regenerate everything.",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=positive_int,
+        metavar="N",
+        help="run up to N stages, build folders and source dir scans at once "
+        "(default: depends on the CPU count).",
+    )
+    parser.add_argument(
+        "--git-index",
+        action="store_true",
+        help="read the source files from the git index instead of scanning the source dir, "
+        "untracked files are not found.",
+    )
+    parser.add_argument(
+        "--language",
+        action="append",
+        default=[],
+        type=parse_language,
+        metavar="NAME=SUFFIX,...",
+        help="add a language of source files or replace its suffixes, e.g. C++=.cpp,.cc,.cxx, "
+        "without suffixes the files of the language are not excluded. The languages are "
+        + ", ".join(f"{n}={','.join(s)}" for n, s in const.SOURCE_LANGUAGES.items())
+        + ".",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="trace the memory of each stage and save the timings to FILE in the Chrome trace "
+        "event format, for chrome://tracing or https://ui.perfetto.dev.",
+    )
+    parser.add_argument(
+        "--west",
+        action="store_true",
+        help="also add the west projects the builds use, e.g. modules/hal/*, as folders of a "
+        f"{const.CODE_WORKSPACE_FILE_NAME} multi-root workspace in the west workspace folder.",
+    )
+    parser.add_argument(
+        "--twister",
+        choices=const.TWISTER_MODES,
+        help="treat the build folders as twister output folders, e.g. twister-out, and hide the "
+        "files which no build (union) or not every build (intersection) found in them uses. "
+        f"How many builds use each file is saved to .vscode/{const.USAGE_REPORT_FILE_NAME}.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and regenerate the workspace after each build.",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="with --watch, wait until the build files did not change for SECONDS (default: 2).",
+    )
+
+    if not argv:
+        parser.print_help()
+        sys.exit(0)
+    args = parser.parse_args(argv)
+    if args.west and args.twister:
+        parser.error("--west and --twister cannot be combined")
+    return args
+
+
+def parse_query_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="zephyr2vsc query",
+        description="Look up compile commands in the index zephyr2vsc writes to each build dir, "
+        "without loading the compilation DB.",
+    )
+    parser.add_argument("file", nargs="?", help="print the compile commands of this source file.")
+    parser.add_argument(
+        "--build-dir",
+        "-b",
+        action="append",
+        dest="build_dirs",
+        metavar="DIR",
+        help="the build folder to look in, can be given several times (default: build).",
+    )
+    parser.add_argument(
+        "--define", metavar="NAME", help="list the source files compiled with -DNAME."
+    )
+    parser.add_argument(
+        "--include-dir", metavar="DIR", help="list the source files compiled with -IDIR."
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="print the file, directory, output, arguments, include dirs and defines as JSON.",
+    )
+
+    args = parser.parse_args(argv)
+    if args.file is None and args.define is None and args.include_dir is None:
+        parser.error("give a file, --define or --include-dir")
+    return args
+
+
+def query(argv: List[str]):
+    """Print what the compile command indexes of the build dirs hold, exit with 1 if nothing."""
+    from zephyr2vsc.compdb_index import CompileIndex
+
+    args = parse_query_args(argv)
+
+    found: List[Any] = []
+    for build_dir in args.build_dirs or ["build"]:
+        try:
+            index = CompileIndex(os.path.join(build_dir, const.COMPILE_INDEX_FILE_NAME))
+        except FileNotFoundError as e:
+            print(f"{e}\nGenerate it with --compdb-index.", file=sys.stderr)
+            continue
+        with index:
+            if args.file is not None:
+                found.extend(index.lookup(args.file))
+            if args.define is not None:
+                found.extend(index.files_defining(args.define))
+            if args.include_dir is not None:
+                found.extend(index.files_including(args.include_dir))
+
+    for item in found:
+        if isinstance(item, str):
+            print(item)
+        elif args.json:
+            print(json.dumps(item._asdict()))
+        else:
+            print(shlex.join(item.arguments))
+    sys.exit(0 if found else 1)
+
+
+def compile_command(argv: List[str]):
+    """Build the object file of one source, for the task in tasks.json."""
+    parser = argparse.ArgumentParser(
+        prog="zephyr2vsc compile",
+        description="Compile only one source file, by building its object file with ninja.",
+    )
+    parser.add_argument("file", help="the source file to compile.")
+    parser.add_argument(
+        "--build-dir",
+        "-b",
+        action="append",
+        dest="build_dirs",
+        metavar="DIR",
+        help="the build folder to compile in, can be given several times (default: build). "
+        "The file is compiled in each of them which compiles it.",
+    )
+    parser.add_argument("--ninja", default="ninja", help="the ninja executable (default: ninja).")
+    args = parser.parse_args(argv)
+
+    from zephyr2vsc.tasks import compile_file
+
+    sys.exit(compile_file(args.file, args.build_dirs or ["build"], args.ninja))
+
+
+def generate(workspace: Workspace, profile: Optional[str] = None):
+    """Bring the workspace up to date and print the timings of the stages."""
     print("zephyr2vsc ver 0.0.2")
     print("By ming.shao@intel.com")
+    print(f"Start generating VSCode workspace for:\n[{workspace.src_dir}]\n")
+
+    print("step 1")
 
-    compiler_path = os.path.abspath(
-        os.path.normpath(sys.argv[1])
-    )  # this is the fullpath of the compiler.
-    src_dir = os.path.abspath(
-        os.path.normpath(sys.argv[2])
-    )  # this is the folder to open in VS Code.
-    build_dir = os.path.abspath(
-        os.path.normpath(sys.argv[3])
-    )  # this is the folder where build.ninja file is located.
+    with instrument.use(instrument.Profiler(trace_memory=profile is not None)) as profiler:
+        workspace.generate()
 
-    print(f"Start generating VSCode workspace for:\n[{src_dir}]\n")
+    print(profiler.format_table())
+    if profile is not None:
+        profiler.write_trace(profile)
+        print(f"Profile saved as:\n[{profile}]\n")
 
-    print("step 1")
+    print(f"Finished generating VSCode workspace for:\n[{workspace.src_dir}]\n")
+
+
+def watch(workspace: Workspace, debounce: float, profile: Optional[str] = None):
+    """Regenerate after each build until interrupted, keeping the stage results in memory."""
+    from zephyr2vsc.watch import create_watcher, get_build_files, wait_for_build
+
+    watcher = create_watcher(get_build_files(workspace.build_dirs))
+    print(f"Watching [{len(workspace.build_dirs)}] build dirs, press Ctrl+C to stop.\n")
+    try:
+        while True:
+            wait_for_build(watcher, debounce, workspace.build_dirs)
+            generate(workspace, profile)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        watcher.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["query"]:
+        query(argv[1:])
+    if argv[:1] == ["compile"]:
+        compile_command(argv[1:])
+    args = parse_args(argv)
+
+    kwargs: Dict[str, Any] = {}
+    workspace_class: Type[Workspace] = Workspace
+    if args.west:
+        from zephyr2vsc.west import WestWorkspace
+
+        workspace_class = WestWorkspace
+    elif args.twister:
+        from zephyr2vsc.twister import TwisterWorkspace
 
-    ninja_rules = get_ninja_rules(build_dir)
-    used_c_files = get_relevant_c_files_relative_path(src_dir, build_dir)
-    all_c_files = get_all_c_files_relative_path(src_dir)
+        workspace_class, kwargs = TwisterWorkspace, {"mode": args.twister}
+    try:
+        workspace = workspace_class(
+            args.src_dir,  # this is the folder to open in VS Code.
+            args.build_dirs,  # these are the folders where build.ninja file is located.
+            args.compiler_path,  # this is the fullpath of the compiler.
+            args.scan_ignore,
+            args.compact_compdb,
+            args.jobs,
+            args.git_index,
+            update_languages(const.SOURCE_LANGUAGES, args.language),
+            compdb_index=args.compdb_index,
+            # the workers keep the ninja manifests of their builds for the next regeneration
+            keep_workers=args.watch,
+            **kwargs,
+        )
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
 
-    unused_c_files = all_c_files - used_c_files
-    print(f"Exclude [{len(unused_c_files)}] unused C source files.\n")
+    if args.check:
+        stale = workspace.stale_stages()
+        if stale:
+            print(f"VS Code workspace is out of date, stale stages: {', '.join(stale)}")
+            sys.exit(1)
+        print("VS Code workspace is up to date.")
+        sys.exit(0)
 
-    db_full_path = generate_compilation_db(build_dir, ninja_rules)
+    if args.force:
+        workspace.invalidate()
+    try:
+        generate(workspace, args.profile)
+        if args.watch:
+            watch(workspace, args.debounce, args.profile)
+    except ValueError as e:
+        # e.g. an invalid west manifest
+        print(e)
+        sys.exit(1)
+    finally:
+        workspace.close()
 
-    generate_vscode_config_jsons(unused_c_files, used_c_files, compiler_path, db_full_path, src_dir)
 
-    print(f"Finished generating VSCode workspace for:\n[{src_dir}]\n")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Replace the output files atomically, with the mode a plain `open` would give them."""
+
+import contextlib
+import os
+import stat
+import tempfile
+from typing import IO, Any, Iterator
+
+# os.umask can only be read by setting it, this is done once while only the main thread runs
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def make_temp_file(path: str) -> str:
+    """Create an empty temporary file next to `path`, on the same file system."""
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    os.close(fd)
+    return temp_path
+
+
+def replace_file(temp_path: str, path: str):
+    """Replace `path` with `temp_path`, which gets the mode of `path` or of a new file.
+
+    `tempfile.mkstemp` creates private files, the outputs are shared with other users and tools.
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, path)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "w", **kwargs: Any) -> Iterator[IO[Any]]:
+    """Open a temporary file which replaces `path` once it is completely written.
+
+    A reader, e.g. the C/C++ extension, never sees a half written file, and an interrupted write
+    leaves the previous file in place.
+    """
+    temp_path = make_temp_file(path)
+    try:
+        with open(temp_path, mode, **kwargs) as f:
+            yield f
+        replace_file(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,68 @@
+"""Derive the `browse.path` of a configuration from the dirs a build actually reads."""
+
+import os
+from typing import Iterable, List, Set
+
+
+def get_minimal_roots(dirs: Iterable[str]) -> List[str]:
+    """Drop the dirs below another one, `browse.path` dirs are searched recursively.
+
+    Sorted by their components a dir comes right after its parent dir and the dirs below it, so
+    a single sweep keeping the last root finds them.
+    """
+    roots: List[str] = []
+    for path in sorted({os.path.normpath(d) for d in dirs}, key=lambda d: d.split(os.sep)):
+        if not roots or not is_below(path, roots[-1]):
+            roots.append(path)
+    return roots
+
+
+def is_below(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def get_browse_paths(
+    src_dir: str,
+    used_files: Iterable[str],
+    include_dirs: Iterable[str] = (),
+    include_files: Iterable[str] = (),
+) -> List[str]:
+    """Return the fewest `browse.path` entries covering the build.
+
+    These are the dirs of the used files, relative to `src_dir`, and the existing include dirs of
+    the compile commands. The dir of an existing forced include file, e.g. `autoconf.h`, is only
+    added without its sub dirs, with the `/*` suffix, if no other entry covers it. The paths below
+    `src_dir` stay relative to it like the used files, the others are absolute.
+    """
+    src_dir = os.path.normpath(src_dir)
+    # many used files share a dir, it is joined with `src_dir` once
+    dirs = {
+        os.path.normpath(os.path.join(src_dir, d)) for d in {os.path.dirname(f) for f in used_files}
+    }
+    dirs.update(d for d in include_dirs if os.path.isdir(d))
+    roots = get_minimal_roots(dirs)
+
+    root_set = set(roots)
+    file_dirs: Set[str] = set()
+    for include_file in include_files:
+        file_dir = os.path.dirname(os.path.normpath(include_file))
+        # the dir and its parents, one of them is a root if the dir is covered
+        parent, parents = file_dir, [file_dir]
+        while os.path.dirname(parent) != parent:
+            parent = os.path.dirname(parent)
+            parents.append(parent)
+        if os.path.isfile(include_file) and root_set.isdisjoint(parents):
+            file_dirs.add(file_dir)
+
+    src_prefix = src_dir.rstrip(os.sep) + os.sep
+
+    def to_browse_path(path: str) -> str:
+        if path == src_dir:
+            path = os.curdir
+        elif path.startswith(src_prefix):
+            path = path[len(src_prefix) :]
+        return path.replace("\\", "/")
+
+    return [to_browse_path(d) for d in roots] + [
+        to_browse_path(d) + "/*" for d in sorted(file_dirs)
+    ]
@@ -0,0 +1,126 @@
+"""Remember the inputs and results of each stage so unchanged stages are not recomputed."""
+
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from zephyr2vsc import const, instrument
+
+Fingerprint = Optional[List[int]]
+
+
+def fingerprint(path: str) -> Fingerprint:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def fingerprints(paths: Iterable[str]) -> Dict[str, Fingerprint]:
+    return {path: fingerprint(path) for path in paths}
+
+
+class BuildCache:
+    """The stage cache saved as `zephyr2vsc_cache.json`.
+
+    Each build dir holds the cache of its own stages, the .vscode dir the cache of the stages
+    shared by all the build dirs.
+
+    A stage is current when the fingerprints of its input and output files are the same as when
+    it was last computed and the stages it depends on have the same revision as then. Each
+    computation gives a stage a new random revision, so revisions are unique across caches.
+    `external` holds the revisions of the stages kept in other caches, e.g. in the build dirs.
+    `key` holds the arguments the results depend on, the whole cache is dropped when they change.
+    A stage may find more input files while it is computed, like the headers in a depfile, see
+    `add_inputs`.
+    """
+
+    def __init__(self, cache_dir: str, key: Dict[str, Any]):
+        self.path = os.path.join(cache_dir, const.CACHE_FILE_NAME)
+        self.key = key
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.external: Dict[str, Any] = {}
+        self._found_inputs: Dict[str, List[str]] = {}
+
+    @classmethod
+    def load(cls, cache_dir: str, key: Dict[str, Any]) -> "BuildCache":
+        cache = cls(cache_dir, key)
+        try:
+            with open(cache.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cache
+
+        if data.get("version") == const.CACHE_VERSION and data.get("key") == key:
+            cache.stages = data["stages"]
+        return cache
+
+    def revision(self, stage: str) -> Any:
+        if stage in self.external:
+            return self.external[stage]
+        entry = self.stages.get(stage)
+        return None if entry is None else entry["revision"]
+
+    def revisions(self, stages: Iterable[str]) -> Dict[str, Any]:
+        return {stage: self.revision(stage) for stage in stages}
+
+    def is_current(
+        self,
+        stage: str,
+        inputs: Iterable[str] = (),
+        outputs: Iterable[str] = (),
+        depends: Iterable[str] = (),
+    ) -> bool:
+        entry = self.stages.get(stage)
+        if entry is None or entry["depends"] != self.revisions(depends):
+            return False
+        found_inputs = entry.get("found_inputs", {})
+        return (
+            entry["inputs"] == fingerprints(inputs)
+            and entry["outputs"] == fingerprints(outputs)
+            and found_inputs == fingerprints(found_inputs)
+        )
+
+    def add_inputs(self, stage: str, paths: Iterable[str]):
+        """Add input files `stage` found while it is computed, e.g. the manifests it imported."""
+        self._found_inputs.setdefault(stage, []).extend(paths)
+
+    def invalidate(self, stages: Iterable[str] = ()):
+        """Forget the given stages, or all of them, the stages depending on them follow."""
+        for stage in list(stages) or list(self.stages):
+            self.stages.pop(stage, None)
+
+    def run(
+        self,
+        stage: str,
+        compute: Callable[[], Any],
+        inputs: Iterable[str] = (),
+        outputs: Iterable[str] = (),
+        depends: Iterable[str] = (),
+    ) -> Any:
+        """Return the cached result of `stage`, or compute and remember it if it is stale."""
+        inputs, outputs, depends = list(inputs), list(outputs), list(depends)
+        if self.is_current(stage, inputs, outputs, depends):
+            print(f"Stage [{stage}] is up to date.\n")
+            return self.stages[stage]["result"]
+
+        # fingerprint the inputs before computing so changes made meanwhile are seen next time
+        input_fingerprints = fingerprints(inputs)
+        self._found_inputs.pop(stage, None)
+        with instrument.stage(stage):
+            result = compute()
+        self.stages[stage] = {
+            "revision": os.urandom(16).hex(),
+            "depends": self.revisions(depends),
+            "inputs": input_fingerprints,
+            "found_inputs": fingerprints(self._found_inputs.pop(stage, [])),
+            "outputs": fingerprints(outputs),
+            "result": result,
+        }
+        return result
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"version": const.CACHE_VERSION, "key": self.key, "stages": self.stages}, f)
@@ -0,0 +1,214 @@
+"""Write compilation databases and compact their entries."""
+
+import functools
+import json
+import os
+import re
+import shlex
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from zephyr2vsc.atomic import atomic_write
+
+CompileCommand = Dict[str, Any]
+
+# the include dir follows these flags either joined or as the next argument
+INCLUDE_DIR_FLAGS = ("-isystem", "-idirafter", "-iquote", "-I")
+
+# workaround for https://github.com/Microsoft/vscode-cpptools/issues/2417
+# -imacros is not understood by the C/C++ extension, -include defines the same macros
+IMACROS_FLAGS = ("--imacros=", "-imacros")
+# the literal "-" first lets the pattern skip ahead, the look-behind checks what is before it
+_IMACROS_ARGUMENT = re.compile(r"-(?<!\S-)(?:-imacros=|imacros)")
+
+# the file follows these flags either joined or as the next argument
+INCLUDE_FILE_FLAGS = ("-include", *IMACROS_FLAGS)
+
+# an include dir or file flag and its path, which may be quoted
+_INCLUDE_ARGUMENT = re.compile(
+    r"(?<!\S)(-isystem|-idirafter|-iquote|-I|-include|--imacros=|-imacros)"
+    r"\s*(\"[^\"]*\"|'[^']*'|\S+)"
+)
+
+
+# the flags which do not change how a file is parsed, the outputs, dependency files and warnings,
+# and the ones of them followed by a separate argument
+_BUILD_ONLY_FLAGS = ("-c", "-MD", "-MMD", "-MP", "-o", "-MF", "-MT", "-MQ")
+_BUILD_ONLY_FLAGS_WITH_ARGUMENT = ("-o", "-MF", "-MT", "-MQ")
+_BUILD_ONLY_FLAG_PREFIXES = ("-o", "-MF", "-MT", "-MQ", "-W")
+_DROP = "drop"
+_DROP_WITH_ARGUMENT = "drop with argument"
+
+# the characters which make shlex do more than split on whitespace
+_SHELL_QUOTING = re.compile(r"[\"'\\]" if os.name != "nt" else r"[\"']")
+
+# what json.dumps writes for a string, e.g. a path
+_encode_string = json.encoder.encode_basestring_ascii
+
+# an entry of `ninja -t compdb` as ninja lays it out, with its strings encoded
+_NINJA_ENTRY_KEYS = ["directory", "command", "file", "output"]
+_NINJA_ENTRY = '{\n  "directory": %s,\n  "command": %s,\n  "file": %s,\n  "output": %s\n}'
+
+
+def split_command(command: str) -> List[str]:
+    # shlex reads one character at a time, most compile commands have nothing to unquote
+    if not _SHELL_QUOTING.search(command):
+        return command.split()
+    return shlex.split(command, posix=os.name != "nt")
+
+
+def rewrite_imacros_arguments(arguments: List[str]) -> List[str]:
+    """Turn `-imacros` and `--imacros=` into `-include`, only where they start an argument."""
+    for i, argument in enumerate(arguments):
+        if argument.startswith(IMACROS_FLAGS):
+            flag = next(f for f in IMACROS_FLAGS if argument.startswith(f))
+            arguments[i] = "-include" + argument[len(flag) :]
+    return arguments
+
+
+def rewrite_imacros_command(command: str) -> str:
+    """Like `rewrite_imacros_arguments`, without splitting the command into its arguments."""
+    # the flags usually follow a space, the pattern only checks the commands where they do not
+    rewritten = command.replace(" -imacros", " -include").replace(" --imacros=", " -include")
+    if "imacros" not in rewritten:
+        return rewritten
+    return _IMACROS_ARGUMENT.sub("-include", command)
+
+
+def get_include_paths(entry: CompileCommand) -> Tuple[Set[str], Set[str]]:
+    """Return the include dirs and the forced include files of an entry, as absolute paths.
+
+    The paths of a `command` are found without splitting it into its arguments.
+    """
+    paths: List[Tuple[str, str]] = []
+    if "arguments" in entry:
+        arguments = entry["arguments"]
+        for i, argument in enumerate(arguments):
+            flag = next(
+                (f for f in INCLUDE_DIR_FLAGS + INCLUDE_FILE_FLAGS if argument.startswith(f)), None
+            )
+            if flag is None:
+                continue
+            if argument == flag:
+                if i + 1 < len(arguments):
+                    paths.append((flag, arguments[i + 1]))
+            else:
+                paths.append((flag, argument[len(flag) :]))
+    else:
+        paths = [
+            (flag, path.strip("\"'"))
+            for flag, path in _INCLUDE_ARGUMENT.findall(str(entry["command"]))
+        ]
+
+    directory = str(entry["directory"])
+    include_dirs: Set[str] = set()
+    include_files: Set[str] = set()
+    for flag, path in paths:
+        path = os.path.normpath(os.path.join(directory, path))
+        (include_files if flag in INCLUDE_FILE_FLAGS else include_dirs).add(path)
+    return include_dirs, include_files
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_include_dir(directory: str, include_dir: str) -> Tuple[str, str]:
+    # the commands of a build share most of their include dirs
+    include_dir = os.path.normpath(include_dir)
+    return include_dir, os.path.normpath(os.path.join(directory, include_dir))
+
+
+@functools.lru_cache(maxsize=16384)
+def _get_flag_kind(argument: str) -> str:
+    # the include dir flag of `argument`, _DROP, _DROP_WITH_ARGUMENT or "" to keep it, the
+    # commands of a build share most of their flags so they are only classified once
+    if argument in _BUILD_ONLY_FLAGS_WITH_ARGUMENT:
+        return _DROP_WITH_ARGUMENT
+    # -Wp, passes flags like -D to the preprocessor
+    if argument in _BUILD_ONLY_FLAGS or (
+        argument.startswith(_BUILD_ONLY_FLAG_PREFIXES) and not argument.startswith("-Wp,")
+    ):
+        return _DROP
+    return next((f for f in INCLUDE_DIR_FLAGS if argument.startswith(f)), "")
+
+
+def compact_arguments(arguments: List[str], directory: str) -> List[str]:
+    """Drop the flags IntelliSense does not need and the repeated include dirs.
+
+    The outputs, dependency files and warnings do not change how a file is parsed. An include dir
+    is normalized but stays relative to `directory` if it was, it is only compared as an absolute
+    path.
+    """
+    compacted: List[str] = []
+    seen: Set[Tuple[str, str]] = set()
+    remaining = iter(arguments)
+    for argument in remaining:
+        flag = _get_flag_kind(argument) if argument[:1] == "-" else ""
+        if not flag:
+            compacted.append(argument)
+            continue
+        if flag == _DROP_WITH_ARGUMENT:
+            next(remaining, None)
+        if flag in (_DROP, _DROP_WITH_ARGUMENT):
+            continue
+
+        include_dir = argument[len(flag) :] if argument != flag else next(remaining, None)
+        if include_dir is None:
+            compacted.append(argument)
+            continue
+        include_dir, absolute_include_dir = _normalize_include_dir(directory, include_dir)
+        if (flag, absolute_include_dir) not in seen:
+            seen.add((flag, absolute_include_dir))
+            compacted.extend([flag, include_dir] if argument == flag else [flag + include_dir])
+    return compacted
+
+
+def compact_entry(entry: CompileCommand) -> CompileCommand:
+    """Turn the shell command of a ninja compdb entry into a compacted `arguments` array."""
+    directory = str(entry["directory"])
+    return {
+        "directory": directory,
+        "arguments": compact_arguments(split_command(str(entry["command"])), directory),
+        "file": entry["file"],
+        "output": entry["output"],
+    }
+
+
+def _dump_entry(entry: CompileCommand, indent: Optional[int]) -> str:
+    if indent is None:
+        # without indentation every entry goes on a line of its own
+        return json.dumps(entry, separators=(",", ":"))
+    # json.dumps only uses its C encoder without indentation, a flat entry is laid out here
+    pad = "\n" + " " * indent
+    try:
+        if indent == 2 and list(entry) == _NINJA_ENTRY_KEYS:
+            return _NINJA_ENTRY % tuple(map(_encode_string, entry.values()))
+        items = [f"{pad}{_encode_string(k)}: {_encode_string(v)}" for k, v in entry.items()]
+    except TypeError:
+        # an `arguments` array
+        return json.dumps(entry, indent=indent)
+    return "{" + ",".join(items) + "\n}"
+
+
+def get_full_entry_size(entry: CompileCommand) -> int:
+    """Return the bytes a ninja compdb `entry` takes in a full DB, with the line break before it."""
+    command = str(entry["command"])
+    if "--imacros=" in command:
+        # -imacros and -include have the same length, only --imacros= gets shorter
+        entry = dict(entry, command=rewrite_imacros_command(command))
+    return len(_dump_entry(entry, 2)) + 1
+
+
+def write_compile_db(
+    db_full_path: str, entries: Iterable[CompileCommand], indent: Optional[int] = 2
+) -> Tuple[int, int]:
+    """Write the entries one by one, return the number of entries and the file size.
+
+    The entries go to a temporary file which then replaces the DB, so the C/C++ extension never
+    reads a half written DB.
+    """
+    count = 0
+    with atomic_write(db_full_path) as f:
+        f.write("[")
+        for entry in entries:
+            f.write((",\n" if count else "\n") + _dump_entry(entry, indent))
+            count += 1
+        f.write("\n]\n")
+    return count, os.path.getsize(db_full_path)
@@ -0,0 +1,252 @@
+"""Index the compile commands in SQLite, to look up the flags of one file without the JSON DB."""
+
+import functools
+import os
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from zephyr2vsc.atomic import make_temp_file, replace_file
+from zephyr2vsc.compdb import INCLUDE_DIR_FLAGS, CompileCommand, split_command
+
+SCHEMA = """
+CREATE TABLE commands (
+    id INTEGER PRIMARY KEY, file_key TEXT, file TEXT, directory TEXT, output TEXT
+);
+CREATE INDEX commands_file ON commands (file_key);
+CREATE TABLE arguments (command_id INTEGER PRIMARY KEY, arguments TEXT);
+CREATE TABLE include_dirs (id INTEGER PRIMARY KEY, path TEXT UNIQUE);
+CREATE TABLE command_include_dirs (
+    command_id INTEGER, position INTEGER, include_dir_id INTEGER, PRIMARY KEY (command_id, position)
+) WITHOUT ROWID;
+CREATE INDEX command_include_dirs_dir ON command_include_dirs (include_dir_id);
+CREATE TABLE defines (id INTEGER PRIMARY KEY, name TEXT, value TEXT, UNIQUE (name, value));
+CREATE TABLE command_defines (
+    command_id INTEGER, define_id INTEGER, PRIMARY KEY (command_id, define_id)
+) WITHOUT ROWID;
+CREATE INDEX command_defines_define ON command_defines (define_id);
+"""
+
+# the rows of this many commands are inserted at once, not one command at a time
+_BATCH_COMMANDS = 1024
+
+
+def get_file_uri_path(path: str) -> str:
+    """Return the path part of the `file:` URI of `path`, for a read-only SQLite connection."""
+    path = os.path.abspath(path).replace("\\", "/")
+    # a Windows path gets the leading slash of file:///C:/...
+    return quote(path if path.startswith("/") else "/" + path, safe="/:")
+
+
+class CompileFlags(NamedTuple):
+    """The compile command of a file split into its flags, as the index holds it."""
+
+    file: str
+    directory: str
+    output: str
+    arguments: List[str]
+    include_dirs: List[str]
+    defines: Dict[str, Optional[str]]
+
+
+def get_file_key(path: str, directory: str = "") -> str:
+    """Return the key of a source file in the index: its normalized absolute path."""
+    return os.path.normcase(os.path.normpath(os.path.join(directory, path)))
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_absolute_path(directory: str, path: str) -> str:
+    # the commands of a build share most of their include dirs
+    return os.path.normpath(os.path.join(directory, path))
+
+
+def get_compile_flags(entry: CompileCommand) -> CompileFlags:
+    """Split a compile DB entry into its arguments, include dirs and defines."""
+    directory = str(entry["directory"])
+    arguments = (
+        list(entry["arguments"]) if "arguments" in entry else split_command(str(entry["command"]))
+    )
+    include_dirs: List[str] = []
+    defines: Dict[str, Optional[str]] = {}
+    for i, argument in enumerate(arguments):
+        if not argument.startswith(("-I", "-i", "-D")):
+            continue
+        # -I is by far the most common flag, the others are only searched for the rest
+        include_flag = (
+            "-I"
+            if argument.startswith("-I")
+            else next((f for f in INCLUDE_DIR_FLAGS if argument.startswith(f)), None)
+        )
+        if include_flag is not None:
+            path = argument[len(include_flag) :] or (
+                arguments[i + 1] if i + 1 < len(arguments) else ""
+            )
+            include_dirs.append(_get_absolute_path(directory, path))
+        elif argument.startswith("-D"):
+            define = argument[2:] or (arguments[i + 1] if i + 1 < len(arguments) else "")
+            name, equals, value = define.partition("=")
+            defines[name] = value if equals else None
+    return CompileFlags(
+        os.path.normpath(os.path.join(directory, str(entry["file"]))),
+        directory,
+        str(entry.get("output", "")),
+        arguments,
+        include_dirs,
+        defines,
+    )
+
+
+class CompileIndexWriter:
+    """Add compile DB entries to a new index, which replaces `index_path` on `commit`.
+
+    The entries are added while they stream to the JSON DB, so the manifest is read once.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = os.path.abspath(index_path)
+        self.temp_path = make_temp_file(self.index_path)
+        self.connection = sqlite3.connect(self.temp_path)
+        # the file is only renamed into place once complete, it needs no journal
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.executescript(SCHEMA)
+        self.include_dir_ids: Dict[str, int] = {}
+        self.define_ids: Dict[Tuple[str, Optional[str]], int] = {}
+        self.count = 0
+        # the rows of each table, inserted in batches
+        self.rows: Dict[str, List[Tuple[Any, ...]]] = {
+            "commands": [],
+            "arguments": [],
+            "include_dirs": [],
+            "command_include_dirs": [],
+            "defines": [],
+            "command_defines": [],
+        }
+
+    def _include_dir_id(self, path: str) -> int:
+        if path not in self.include_dir_ids:
+            self.include_dir_ids[path] = len(self.include_dir_ids) + 1
+            self.rows["include_dirs"].append((self.include_dir_ids[path], path))
+        return self.include_dir_ids[path]
+
+    def _define_id(self, define: Tuple[str, Optional[str]]) -> int:
+        if define not in self.define_ids:
+            self.define_ids[define] = len(self.define_ids) + 1
+            self.rows["defines"].append((self.define_ids[define], *define))
+        return self.define_ids[define]
+
+    def add(self, entry: CompileCommand):
+        flags = get_compile_flags(entry)
+        self.count += 1
+        command_id = self.count
+        rows = self.rows
+        rows["commands"].append(
+            (command_id, get_file_key(flags.file), flags.file, flags.directory, flags.output)
+        )
+        # the arguments are only ever read all at once, in order
+        rows["arguments"].append((command_id, "\0".join(flags.arguments)))
+        # an include dir given twice keeps its first position, like the compiler does
+        include_dir_ids = dict.fromkeys(map(self._include_dir_id, flags.include_dirs))
+        rows["command_include_dirs"].extend(
+            (command_id, i, dir_id) for i, dir_id in enumerate(include_dir_ids)
+        )
+        rows["command_defines"].extend(
+            (command_id, self._define_id(define)) for define in flags.defines.items()
+        )
+        if len(rows["commands"]) >= _BATCH_COMMANDS:
+            self._flush()
+
+    def _flush(self):
+        for table, rows in self.rows.items():
+            if rows:
+                values = ", ".join("?" * len(rows[0]))
+                self.connection.executemany(f"INSERT INTO {table} VALUES ({values})", rows)
+                rows.clear()
+
+    def adding(self, entries: Iterable[CompileCommand]) -> Iterator[CompileCommand]:
+        """Add each entry to the index as it passes through."""
+        for entry in entries:
+            self.add(entry)
+            yield entry
+
+    def commit(self):
+        self._flush()
+        self.connection.commit()
+        self.connection.close()
+        replace_file(self.temp_path, self.index_path)
+
+    def abort(self):
+        self.connection.close()
+        os.remove(self.temp_path)
+
+
+class CompileIndex:
+    """Queries on the compile command index of a build dir."""
+
+    def __init__(self, index_path: str):
+        if not os.path.isfile(index_path):
+            raise FileNotFoundError(f"No compile command index at:\n[{index_path}]")
+        self.index_path = index_path
+        self.connection = sqlite3.connect(f"file:{get_file_uri_path(index_path)}?mode=ro", uri=True)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "CompileIndex":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
+
+    def lookup(self, path: str) -> List[CompileFlags]:
+        """Return the compile commands of the source file at `path`, one per object file."""
+        commands = self.connection.execute(
+            "SELECT id, file, directory, output FROM commands WHERE file_key = ? ORDER BY id",
+            (get_file_key(os.path.abspath(path)),),
+        ).fetchall()
+        return [self._flags(*command) for command in commands]
+
+    def _flags(self, command_id: int, file: str, directory: str, output: str) -> CompileFlags:
+        execute = self.connection.execute
+        (arguments,) = execute(
+            "SELECT arguments FROM arguments WHERE command_id = ?", (command_id,)
+        ).fetchone()
+        include_dirs = [
+            row[0]
+            for row in execute(
+                "SELECT path FROM command_include_dirs JOIN include_dirs ON include_dir_id = id"
+                " WHERE command_id = ? ORDER BY position",
+                (command_id,),
+            )
+        ]
+        defines = dict(
+            execute(
+                "SELECT name, value FROM command_defines JOIN defines ON define_id = id"
+                " WHERE command_id = ? ORDER BY define_id",
+                (command_id,),
+            ).fetchall()
+        )
+        return CompileFlags(file, directory, output, arguments.split("\0"), include_dirs, defines)
+
+    def files_defining(self, name: str) -> List[str]:
+        """Return the source files compiled with the macro `name` defined on the command line."""
+        return [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT DISTINCT file FROM defines JOIN command_defines ON define_id = defines.id"
+                " JOIN commands ON command_id = commands.id WHERE name = ? ORDER BY file",
+                (name,),
+            )
+        ]
+
+    def files_including(self, include_dir: str) -> List[str]:
+        """Return the source files compiled with `include_dir` in their include dirs."""
+        return [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT DISTINCT file FROM include_dirs"
+                " JOIN command_include_dirs ON include_dir_id = include_dirs.id"
+                " JOIN commands ON command_id = commands.id WHERE path = ? ORDER BY file",
+                (os.path.normpath(os.path.abspath(include_dir)),),
+            )
+        ]
@@ -1,5 +1,52 @@
 """Define the constants for zephyr2vsc."""
 
+# CMake names the ninja rules that compile a single source file "<LANG>_COMPILER__<target>_<cfg>"
+COMPILE_RULE_PREFIXES = ("C_COMPILER__", "CXX_COMPILER__", "ASM_COMPILER__")
+
+# the languages of the source files and their suffixes, the used and unused files of each one are
+# found in one scan of the source dir and one pass over each build
+SOURCE_LANGUAGES = {
+    "C": (".c",),
+    "C++": (".cpp", ".cc", ".cxx"),
+    "assembly": (".S", ".s"),
+    "linker script": (".ld",),
+    "header": (".h", ".hpp"),
+}
+# the files of these languages are mostly found in the ninja deps log, not in build.ninja, they
+# are only excluded when every build has a deps log
+DEPS_LANGUAGES = ("linker script", "header")
+# the dirs of the used sources of these languages are the browse paths of the C/C++ extension
+BROWSE_LANGUAGES = ("C", "C++")
+
+# the files zephyr2vsc saves in the build dir, the cache also in the .vscode dir
+COMPILE_DB_FILE_NAME = "zephyr_compile_db.json"
+COMPILE_INDEX_FILE_NAME = "zephyr_compile_db.sqlite"
+OBJECT_TABLE_FILE_NAME = "zephyr2vsc_objects.tsv"
+CACHE_FILE_NAME = "zephyr2vsc_cache.json"
+# the glob patterns zephyr2vsc wrote to each JSON file of a dir last time, saved in that dir
+GENERATED_PATTERNS_FILE_NAME = "zephyr2vsc_patterns.json"
+CACHE_VERSION = 6
+# the mtimes and listings of the scanned source dirs, saved in the .vscode dir
+SOURCE_INDEX_FILE_NAME = "zephyr2vsc_index.sqlite"
+
+# the multi-root workspace of the west projects, saved in the west workspace dir
+CODE_WORKSPACE_FILE_NAME = "zephyr.code-workspace"
+
+# how many twister builds use each source file, saved in the .vscode dir
+USAGE_REPORT_FILE_NAME = "zephyr2vsc_usage.csv"
+# the files used by any build or by every build of a twister run are kept visible
+TWISTER_MODES = ("union", "intersection")
+
+# dirs which never hold sources of a build, they are not scanned at all
+SCAN_IGNORE_GLOBS = (".git", ".svn", ".hg", "CVS", "__pycache__")
+
+# VS Code matches every watched path against each files.watcherExclude glob, only the unused dirs
+# with the most files are added
+MAX_WATCHER_EXCLUDE_DIRS = 500
+
+# the settings mapping glob patterns to true, shared with the patterns of the user
+GLOB_MAP_SETTINGS = ("files.exclude", "files.watcherExclude", "search.exclude")
+
 SETTINGS_JSON_TEMPLATE = {
     "files.exclude": {
         "**/.git": True,
@@ -9,6 +56,11 @@ SETTINGS_JSON_TEMPLATE = {
         "**/.DS_Store": True,
         "**/test*": True,
     },
+    "files.watcherExclude": {
+        "**/.git/objects/**": True,
+        "**/.git/subtree-cache/**": True,
+    },
+    "search.exclude": {},
     "C_Cpp.exclusionPolicy": "checkFilesAndFolders",
     "C_Cpp.intelliSenseEngine": "Default",
     "cmake.configureOnOpen": False,
@@ -0,0 +1,81 @@
+"""Read the binary `.ninja_deps` log ninja keeps with the headers each object depends on."""
+
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, Iterator, List, Set
+
+from zephyr2vsc import instrument
+
+DEPS_LOG_SIGNATURE = b"# ninjadeps\n"
+DEPS_LOG_VERSIONS = (3, 4)
+
+_UINT32 = struct.Struct("=I")
+_INT32 = struct.Struct("=i")
+
+
+class DepsLog:
+    """The path table and the dependencies of each output recorded in a deps log.
+
+    Paths are kept as bytes in a list indexed by their ID and the dependencies as arrays of path
+    IDs, so logs with millions of records stay small in memory. Like ninja, a later record for
+    the same output replaces the earlier one.
+    """
+
+    def __init__(self) -> None:
+        self.paths: List[bytes] = []
+        self.deps: Dict[int, array] = {}
+
+    @classmethod
+    @instrument.instrumented(
+        "DepsLog.load", lambda log: {"paths": len(log.paths), "outputs": len(log.deps)}
+    )
+    def load(cls, path: str) -> "DepsLog":
+        log = cls()
+        if os.path.getsize(path) == 0:
+            return log
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            log._parse(data, path)
+        return log
+
+    def _parse(self, data: mmap.mmap, path: str):
+        signature_size = len(DEPS_LOG_SIGNATURE)
+        if data[:signature_size] != DEPS_LOG_SIGNATURE:
+            raise ValueError(f"Not a ninja deps log:\n[{path}]")
+        (version,) = _INT32.unpack_from(data, signature_size)
+        if version not in DEPS_LOG_VERSIONS:
+            raise ValueError(f"Unsupported ninja deps log version [{version}]:\n[{path}]")
+        mtime_size = 8 if version == 4 else 4
+
+        offset = signature_size + 4
+        end = len(data)
+        while offset + 4 <= end:
+            (header,) = _UINT32.unpack_from(data, offset)
+            offset += 4
+            size = header & 0x7FFFFFFF
+            if offset + size > end:
+                # ninja drops a record truncated by an interrupted build as well
+                break
+
+            if header & 0x80000000:
+                (out_id,) = _INT32.unpack_from(data, offset)
+                inputs = array("i")
+                inputs.frombytes(data[offset + 4 + mtime_size : offset + size])
+                self.deps[out_id] = inputs
+            else:
+                # the path is padded with NULs to 4 bytes and followed by the checksum ~ID
+                (checksum,) = _UINT32.unpack_from(data, offset + size - 4)
+                if checksum != ~len(self.paths) & 0xFFFFFFFF:
+                    break
+                self.paths.append(data[offset : offset + size - 4].rstrip(b"\0"))
+            offset += size
+
+    def dependency_paths(self) -> Iterator[str]:
+        """Yield every path any output depends on, once."""
+        ids: Set[int] = set()
+        for inputs in self.deps.values():
+            ids.update(inputs)
+        for path_id in ids:
+            if 0 <= path_id < len(self.paths):
+                yield os.fsdecode(self.paths[path_id])
@@ -0,0 +1,105 @@
+"""Collapse the unused files into as few VS Code exclude globs as possible."""
+
+import os
+from itertools import compress
+from typing import Counter, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class PathTrie:
+    """The dirs of the source tree with any used file below them, and the unused files.
+
+    The trie is kept flat: a dir is a "/" separated path, "" is the root, and each used dir is in
+    `used_dirs` with all its parents. The unused files are counted per dir and only listed in the
+    used dirs, so each file costs a lookup, not a walk down the trie.
+    """
+
+    __slots__ = ("used_dirs", "unused_file_counts", "listed_files")
+
+    def __init__(self) -> None:
+        # the root is never hidden as a whole, not even without any used file
+        self.used_dirs: Set[str] = {""}
+        self.unused_file_counts: Counter[str] = Counter()
+        self.listed_files: List[str] = []
+
+    def add_used(self, paths: Iterable[str]):
+        """Add used files, the parents of each of their dirs are only walked up once."""
+        used_dirs = self.used_dirs
+        # build generated or out of tree files can not hide anything in the tree
+        dirs = {
+            _get_dir(path)
+            for path in map(_to_posix, paths)
+            if not path.startswith(("/", "../")) and not os.path.isabs(path)
+        }
+        for directory in dirs - used_dirs:
+            while directory not in used_dirs:
+                used_dirs.add(directory)
+                directory = _get_dir(directory)
+
+    def add_unused(self, paths: Iterable[str]):
+        """Add unused files, after all the used ones."""
+        paths = [_to_posix(path) for path in paths] if os.sep != "/" else list(paths)
+        dirs = [path.rpartition("/")[0] for path in paths]
+        self.unused_file_counts.update(dirs)
+        self.listed_files.extend(compress(paths, map(self.used_dirs.__contains__, dirs)))
+
+    def exclude_patterns(self, unused_dirs: Optional[List[Tuple[str, int]]] = None) -> List[str]:
+        """Return one `dir/**` glob per topmost dir without used files, and the other files.
+
+        The `unused_dirs` are found again unless they are passed.
+        """
+        if unused_dirs is None:
+            unused_dirs = self.unused_dirs()
+        return sorted([*self.listed_files, *(f"{d}/**" for d, _ in unused_dirs)])
+
+    def unused_dirs(self) -> List[Tuple[str, int]]:
+        """Return the topmost dirs without used files, each with the number of files below it."""
+        used_dirs = self.used_dirs
+        # each dir without used files and its topmost parent without used files
+        topmost: Dict[str, str] = {}
+        counts: Dict[str, int] = {}
+        for directory, count in self.unused_file_counts.items():
+            if directory in used_dirs:
+                continue
+            top = topmost.get(directory)
+            if top is None:
+                # up to the first parent which is used or whose topmost dir is known
+                chain = [directory]
+                parent = directory.rpartition("/")[0]
+                while parent not in used_dirs:
+                    if parent in topmost:
+                        top = topmost[parent]
+                        break
+                    chain.append(parent)
+                    parent = parent.rpartition("/")[0]
+                else:
+                    top = chain[-1]
+                topmost.update(dict.fromkeys(chain, top))
+            counts[top] = counts.get(top, 0) + count
+        return list(counts.items())
+
+
+def _to_posix(path: str) -> str:
+    return path.replace(os.sep, "/")
+
+
+def _get_dir(path: str) -> str:
+    return path.rpartition("/")[0]
+
+
+def build_path_trie(used_files: Iterable[str], unused_files: Iterable[str]) -> PathTrie:
+    trie = PathTrie()
+    trie.add_used(used_files)
+    trie.add_unused(unused_files)
+    return trie
+
+
+def collapse_exclude_patterns(used_files: Iterable[str], unused_files: Iterable[str]) -> List[str]:
+    return build_path_trie(used_files, unused_files).exclude_patterns()
+
+
+def get_largest_unused_dirs(
+    unused_dirs: Iterable[Tuple[str, int]], max_dirs: int
+) -> List[Tuple[str, int]]:
+    """Return at most `max_dirs` of the topmost unused dirs, those with the most files first."""
+    dirs = sorted(unused_dirs, key=lambda item: (-item[1], item[0]))
+    return dirs[:max_dirs]
@@ -1,99 +1,314 @@
 """Define the helper functions for zephyr2vsc."""
 
+import copy
+import functools
 import json
 import os
 import re
-import subprocess
-from typing import Set
-
-from zephyr2vsc import const
-
-
+from typing import AbstractSet, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from zephyr2vsc import const, instrument
+from zephyr2vsc.browse import get_browse_paths
+from zephyr2vsc.compdb import (
+    CompileCommand,
+    compact_entry,
+    get_full_entry_size,
+    get_include_paths,
+    rewrite_imacros_arguments,
+    rewrite_imacros_command,
+    write_compile_db,
+)
+from zephyr2vsc.deps import DepsLog
+from zephyr2vsc.exclude import build_path_trie, get_largest_unused_dirs
+from zephyr2vsc.ninja import NinjaManifest
+from zephyr2vsc.scan import scan_git_checkout, scan_source_tree
+from zephyr2vsc.tasks import get_object_table_path, write_object_table
+from zephyr2vsc.vscode_json import merge_c_cpp_properties, merge_settings, update_json_file
+
+_RULE = re.compile(r"^rule\s+(\S+)", re.MULTILINE)
+
+
+@instrument.instrumented("get_ninja_rules", lambda rules: {"rules": len(rules)})
 def get_ninja_rules(build_dir: str) -> Set[str]:
     ninja_rules_file = os.path.join(build_dir, "CMakeFiles", "rules.ninja")
 
+    # CMake writes every rule to rules.ninja, the compile rules are only looked up by their
+    # CMake names, so the big build.ninja is not parsed for them
     with open(ninja_rules_file, "r") as f:
         print(f"Ninja rules file found:\n[{ninja_rules_file}]\n")
-
-        rules = set()
-        for line in f.readlines():
-            if m := re.match(r"^rule\s([^\n]*)$", line):
-                rules.add(m.group(1))
+        rules = set(_RULE.findall(f.read()))
 
     print(f"Found [{len(rules)}] ninja build rules in:\n[{ninja_rules_file}]\n")
     return rules
 
 
-def get_all_c_files_relative_path(src_dir: str) -> Set[str]:
-    all_c_files = set()
-    for dir, _, files in os.walk(src_dir):
-        for file in files:
-            if file.endswith(".c"):
-                # get the relative path to the src_dir
-                c_file = os.path.join(dir, file)
-                all_c_files.add(os.path.relpath(c_file, src_dir))
+@instrument.instrumented(
+    "get_all_c_files_relative_path", lambda files: {"scanned files": len(files)}
+)
+def get_all_c_files_relative_path(
+    src_dir: str,
+    ignore_globs: Iterable[str] = const.SCAN_IGNORE_GLOBS,
+    exclude_dirs: Iterable[str] = (),
+    jobs: Optional[int] = None,
+) -> Set[str]:
+    all_c_files = scan_source_tree(src_dir, (".c",), ignore_globs, exclude_dirs, jobs)
 
     print(f"Found [{len(all_c_files)}] C source files in source dir:\n[{src_dir}]\n")
     return all_c_files
 
 
-def get_relevant_c_files_relative_path(src_dir: str, build_dir: str) -> Set[str]:
+@instrument.instrumented(
+    "get_all_source_files_relative_path", lambda files: {"scanned files": len(files)}
+)
+def get_all_source_files_relative_path(
+    src_dir: str,
+    suffixes: Tuple[str, ...] = (".c", ".h"),
+    ignore_globs: Iterable[str] = const.SCAN_IGNORE_GLOBS,
+    exclude_dirs: Iterable[str] = (),
+    jobs: Optional[int] = None,
+    index_path: Optional[str] = None,
+    use_git_index: bool = False,
+) -> Set[str]:
+    all_files = (
+        scan_git_checkout(src_dir, suffixes, ignore_globs, exclude_dirs) if use_git_index else None
+    )
+    if all_files is None:
+        all_files = scan_source_tree(
+            src_dir, suffixes, ignore_globs, exclude_dirs, jobs, index_path
+        )
+
+    print(f"Found [{len(all_files)}] {'/'.join(suffixes)} files in source dir:\n[{src_dir}]\n")
+    return all_files
+
+
+@functools.lru_cache(maxsize=16)
+def _get_dir_prefix(directory: str) -> str:
+    return os.path.join(os.path.abspath(directory), "")
+
+
+def get_source_path(path: str, src_dir: str, build_dir: str) -> str:
+    path = os.path.normpath(path)
+    if not os.path.isabs(path):
+        # this must be a build generated file
+        return os.path.normpath(os.path.join(build_dir, path))
+    # get the relative path to the src_dir, most sources are below it
+    src_prefix = _get_dir_prefix(src_dir)
+    if path.startswith(src_prefix):
+        return path[len(src_prefix) :]
+    return os.path.relpath(path, src_dir)
+
+
+@instrument.instrumented(
+    "get_relevant_source_files_relative_path", lambda files: {"relevant files": len(files)}
+)
+def get_relevant_source_files_relative_path(
+    src_dir: str, build_dir: str, suffixes: Tuple[str, ...] = (".c",)
+) -> Set[str]:
     ninja_build_file = os.path.join(build_dir, "build.ninja")
+    print(f"Ninja build file found:\n[{ninja_build_file}]\n")
+
+    source_files = {
+        get_source_path(path, src_dir, build_dir)
+        for path in NinjaManifest.load(build_dir).input_files(suffixes)
+    }
+
+    print(f"Found [{len(source_files)}] relevant {'/'.join(suffixes)} files.\n")
+    return source_files
+
+
+def get_relevant_c_files_relative_path(src_dir: str, build_dir: str) -> Set[str]:
+    return get_relevant_source_files_relative_path(src_dir, build_dir, (".c",))
+
+
+@instrument.instrumented(
+    "get_relevant_header_files_relative_path",
+    lambda files: {"relevant headers": len(files or ())},
+)
+def get_relevant_header_files_relative_path(
+    src_dir: str, build_dir: str, suffixes: Tuple[str, ...] = (".h",)
+) -> Optional[Set[str]]:
+    """Return the headers, or the files with other `suffixes`, any output depends on.
+
+    None is returned if there is no deps log yet.
+    """
+    ninja_deps_file = os.path.join(build_dir, ".ninja_deps")
+    if not os.path.isfile(ninja_deps_file):
+        print(f"Ninja deps log not found, headers will not be excluded:\n[{ninja_deps_file}]\n")
+        return None
+
+    print(f"Ninja deps log found:\n[{ninja_deps_file}]\n")
+    deps_log = DepsLog.load(ninja_deps_file)
+    header_files = {
+        get_source_path(path, src_dir, build_dir)
+        for path in deps_log.dependency_paths()
+        if path.endswith(suffixes)
+    }
 
-    with open(ninja_build_file, "r") as f:
-        print(f"Ninja build file found:\n[{ninja_build_file}]\n")
+    print(f"Found [{len(header_files)}] relevant {'/'.join(suffixes)} files in the deps log.\n")
+    return header_files
 
-        c_files = set()
-        for line in f.readlines():
-            if m := re.match(r"^build\s.*\s([^\s|]+\.c)\s", line):
-                c_file = os.path.normpath(m.group(1).replace("$", ""))
-                if not os.path.isabs(c_file):
-                    # this must be a build generated file
-                    c_files.add(os.path.normpath(os.path.join(build_dir, c_file)))
-                else:
-                    # get the relative path to the src_dir
-                    c_files.add(os.path.relpath(c_file, src_dir))
 
-    print(f"Found [{len(c_files)}] relevant C source files.\n")
-    return c_files
+def get_compile_rules(ninja_rules: Set[str]) -> Set[str]:
+    return {rule for rule in ninja_rules if rule.startswith(const.COMPILE_RULE_PREFIXES)}
 
 
-def generate_compilation_db(build_dir: str, ninja_rules: Set[str]) -> str:
+@instrument.instrumented("generate_compilation_db")
+def generate_compilation_db(
+    build_dir: str,
+    ninja_rules: Set[str],
+    src_dir: str = "",
+    relevant_files: Optional[AbstractSet[str]] = None,
+    compact: bool = False,
+    write_index: bool = False,
+) -> str:
+    """Write the compile commands of `ninja_rules` to the compilation DB in the build dir.
+
+    With `relevant_files`, only the entries of those files are kept. `compact` writes `arguments`
+    arrays without the build-only flags, see `compact_arguments`, one entry per line.
+    `write_index` also writes the same entries to the SQLite index next to the DB, see
+    `CompileIndex`.
+    """
     # compDB will be saved in the build dir
-    db_full_path = os.path.abspath(os.path.join(build_dir, "zephyr_compile_db.json"))
+    db_full_path = os.path.abspath(os.path.join(build_dir, const.COMPILE_DB_FILE_NAME))
     print(f"Zephyr compilation DB will be saved as:\n[{db_full_path}]\n")
 
-    rules = " ".join(ninja_rules)
-    ninja_build_command = rf"ninja -C {build_dir} -t compdb {rules}"
-    out = (
-        subprocess.run(ninja_build_command, stdout=subprocess.PIPE, shell=True)
-        .stdout.decode(encoding="utf-8")
-        .splitlines()
-    )
+    # only the compile edges have a source file to look up, linking and custom commands do not
+    compile_rules = get_compile_rules(ninja_rules)
+    manifest = NinjaManifest.load(build_dir)
 
-    # workaround for https://github.com/Microsoft/vscode-cpptools/issues/2417
-    replace = {
-        re.escape("--imacros="): "-include",
-        re.escape("-imacros"): "-include",
-    }
-    pattern = re.compile("|".join(replace.keys()))
-    fixed = map(lambda line: pattern.sub(lambda m: replace[re.escape(m.group(0))], line), out)
+    # the size of the full DB is summed up from the entries, "[" and "\n]\n" and the commas
+    full_count = 0
+    full_size = 4
 
-    with open(db_full_path, "w") as f:
-        f.writelines(fixed)
+    def counted_entries() -> Iterator[Dict[str, str]]:
+        nonlocal full_count, full_size
+        for entry in manifest.iter_compile_commands(compile_rules):
+            full_size += get_full_entry_size(entry) + (1 if full_count else 0)
+            full_count += 1
+            yield entry
 
+    # the entries are generated, filtered and rewritten one at a time while the DB is written
+    entries: Iterable[CompileCommand] = (
+        counted_entries() if compact else manifest.iter_compile_commands(compile_rules)
+    )
+    if relevant_files is not None:
+        entries = (
+            entry
+            for entry in entries
+            if get_source_path(str(entry["file"]), src_dir, build_dir) in relevant_files
+        )
+    # the index holds the commands as ninja runs them, without the rewrites for the C/C++ extension
+    index_writer = None
+    if write_index:
+        # sqlite3 is only imported by the stages writing or querying the index
+        from zephyr2vsc.compdb_index import CompileIndexWriter
+
+        index_writer = CompileIndexWriter(os.path.join(build_dir, const.COMPILE_INDEX_FILE_NAME))
+        entries = index_writer.adding(entries)
+    if compact:
+        entries = (
+            dict(entry, arguments=rewrite_imacros_arguments(entry["arguments"]))
+            for entry in map(compact_entry, entries)
+        )
+    else:
+        entries = (
+            dict(entry, command=rewrite_imacros_command(str(entry["command"]))) for entry in entries
+        )
+
+    try:
+        count, size = write_compile_db(db_full_path, entries, indent=None if compact else 2)
+    except BaseException:
+        if index_writer is not None:
+            index_writer.abort()
+        raise
+    if index_writer is not None:
+        index_writer.commit()
+    instrument.count("compile commands", count)
+
+    print(f"Found [{count}] compile commands for [{len(compile_rules)}] compile rules.\n")
+    if compact:
+        print(
+            f"Compacted the compilation DB from [{full_count}] entries, [{full_size}] bytes to "
+            f"[{count}] entries, [{size}] bytes.\n"
+        )
     print(f"Zephyr compilation DB is saved as:\n[{db_full_path}]\n")
+    if index_writer is not None:
+        print(f"Compile command index is saved as:\n[{index_writer.index_path}]\n")
     return db_full_path
 
 
-def generate_vscode_config_jsons(
-    unused_c_files: Set[str],
-    used_c_files: Set[str],
-    compiler_path: str,
-    db_full_path: str,
+@instrument.instrumented("generate_object_table")
+def generate_object_table(build_dir: str, ninja_rules: Set[str]) -> str:
+    """Write the table of the sources the build compiles and their objects, see `tasks`."""
+    table_path = get_object_table_path(build_dir)
+    targets = NinjaManifest.load(build_dir).object_targets(get_compile_rules(ninja_rules))
+    instrument.count("object files", len(targets))
+    if write_object_table(table_path, targets):
+        print(f"Table of [{len(targets)}] object files saved as:\n[{table_path}]\n")
+    else:
+        print(f"Table of [{len(targets)}] object files is unchanged:\n[{table_path}]\n")
+    return table_path
+
+
+@instrument.instrumented(
+    "get_compile_db_include_paths",
+    lambda paths: {"include dirs": len(paths[0]), "include files": len(paths[1])},
+)
+def get_compile_db_include_paths(db_full_path: str) -> Tuple[Set[str], Set[str]]:
+    """Return the include dirs and forced include files of all the commands of a compile DB."""
+    with open(db_full_path, "r") as f:
+        entries = json.load(f)
+
+    include_dirs: Set[str] = set()
+    include_files: Set[str] = set()
+    for entry in entries:
+        entry_dirs, entry_files = get_include_paths(entry)
+        include_dirs |= entry_dirs
+        include_files |= entry_files
+
+    print(
+        f"Found [{len(include_dirs)}] include dirs and [{len(include_files)}] forced include "
+        f"files in:\n[{db_full_path}]\n"
+    )
+    return include_dirs, include_files
+
+
+def get_board_name(build_dir: str) -> str:
+    """Return the board a build dir was configured for, or the build dir name if unknown."""
+    cmake_cache_file = os.path.join(build_dir, "CMakeCache.txt")
+    if os.path.isfile(cmake_cache_file):
+        with open(cmake_cache_file, "r") as f:
+            for line in f:
+                if m := re.match(r"^(?:CACHED_BOARD|BOARD):STRING=(.+)$", line):
+                    return m.group(1).strip()
+    return os.path.basename(os.path.normpath(build_dir))
+
+
+def make_c_cpp_configuration(
+    name: str, compiler_path: str, db_full_path: str, browse_paths: List[str]
+) -> Dict[str, Any]:
+    configuration: Dict[str, Any] = copy.deepcopy(
+        const.C_CPP_PROPERTIES_JSON_TEMPLATE["configurations"][0]  # type: ignore
+    )
+    configuration["name"] = name
+    configuration["compileCommands"] = db_full_path.replace("\\", "/")
+    configuration["compilerPath"] = compiler_path.replace("\\", "/")
+
+    # Below line is related to to https://github.com/microsoft/vscode-cpptools/issues/4095
+    # VS Code c_cpp_extension has fixed it. Please use c_cpp_extension > 0.25.1
+    configuration["browse"]["path"].extend(browse_paths)
+    return configuration
+
+
+def make_settings(
+    used_files: AbstractSet[str],
+    unused_files: AbstractSet[str],
     src_dir: str,
-):
-    settings = const.SETTINGS_JSON_TEMPLATE
+    build_dirs: Iterable[str] = (),
+    max_watcher_exclude_dirs: int = const.MAX_WATCHER_EXCLUDE_DIRS,
+) -> Dict[str, Any]:
+    """Return the settings.json of `src_dir` hiding the unused files, relative to `src_dir`."""
+    settings = copy.deepcopy(const.SETTINGS_JSON_TEMPLATE)
     settings["files.exclude"]["**/.github"] = True  # type: ignore
     settings["files.exclude"]["**/.known-issues"] = True  # type: ignore
 
@@ -106,25 +321,71 @@ def generate_vscode_config_jsons(
     # It seems "**/[.]*" can work around this issue.
     # settingsDecoded["files.exclude"]["**/[.]*"] = True
 
-    for unused_c_file in unused_c_files:
-        settings["files.exclude"][unused_c_file.replace("\\", "/")] = True  # type: ignore
-
-    c_properties = const.C_CPP_PROPERTIES_JSON_TEMPLATE
-
-    c_properties["configurations"][0]["compileCommands"] = db_full_path.replace(  # type: ignore
-        "\\", "/"
+    # a dir without any used file is hidden by a single glob instead of one entry per file
+    trie = build_path_trie(used_files, unused_files)
+    unused_dirs = trie.unused_dirs()
+    exclude_patterns = trie.exclude_patterns(unused_dirs)
+    settings["files.exclude"].update(dict.fromkeys(exclude_patterns, True))  # type: ignore
+    instrument.count("exclude patterns", len(exclude_patterns))
+    print(
+        f"Collapsed [{len(unused_files)}] unused source files into "
+        f"[{len(exclude_patterns)}] files.exclude patterns.\n"
     )
-    c_properties["configurations"][0]["compilerPath"] = compiler_path.replace(  # type: ignore
-        "\\", "/"
+
+    # the file watcher and the search still crawl what files.exclude hides, search.exclude
+    # inherits files.exclude though
+    for build_dir in build_dirs:
+        relative_build_dir = os.path.relpath(build_dir, src_dir)
+        if not relative_build_dir.startswith(".."):
+            build_pattern = relative_build_dir.replace("\\", "/") + "/**"
+            settings["files.watcherExclude"][build_pattern] = True  # type: ignore
+            settings["search.exclude"][build_pattern] = True  # type: ignore
+
+    watcher_exclude_dirs = get_largest_unused_dirs(unused_dirs, max_watcher_exclude_dirs)
+    for unused_dir, _ in watcher_exclude_dirs:
+        settings["files.watcherExclude"][unused_dir + "/**"] = True  # type: ignore
+    instrument.count("watcher exclude dirs", len(watcher_exclude_dirs))
+    print(
+        f"Excluded [{len(watcher_exclude_dirs)}] of [{len(unused_dirs)}] unused dirs with "
+        f"[{sum(count for _, count in watcher_exclude_dirs)}] of [{len(unused_files)}] unused "
+        "source files from the file watcher.\n"
     )
 
-    # Below line is related to to https://github.com/microsoft/vscode-cpptools/issues/4095
-    # VS Code c_cpp_extension has fixed it. Please use c_cpp_extension > 0.25.1
-    used_c_folders = {os.path.dirname(f) for f in used_c_files}
-    c_properties["configurations"][0]["browse"]["path"].extend(  # type: ignore
-        [f.replace("\\", "/") for f in used_c_folders]
+    return settings
+
+
+@instrument.instrumented("generate_vscode_config_jsons")
+def generate_vscode_config_jsons(
+    unused_c_files: Set[str],
+    used_c_files: Set[str],
+    compiler_path: str,
+    db_full_path: str,
+    src_dir: str,
+    unused_header_files: AbstractSet[str] = frozenset(),
+    used_header_files: AbstractSet[str] = frozenset(),
+    configurations: Optional[List[Dict[str, Any]]] = None,
+    build_dirs: Iterable[str] = (),
+    max_watcher_exclude_dirs: int = const.MAX_WATCHER_EXCLUDE_DIRS,
+):
+    used_files = used_c_files | used_header_files
+    # most builds list no header files, the unused C files are not copied then
+    unused_files = unused_c_files | unused_header_files if unused_header_files else unused_c_files
+    settings = make_settings(
+        used_files, unused_files, src_dir, build_dirs, max_watcher_exclude_dirs
     )
 
+    c_properties = copy.deepcopy(const.C_CPP_PROPERTIES_JSON_TEMPLATE)
+    if configurations is None:
+        configurations = [
+            make_c_cpp_configuration(
+                c_properties["configurations"][0]["name"],  # type: ignore
+                compiler_path,
+                db_full_path,
+                get_browse_paths(src_dir, used_c_files),
+            )
+        ]
+    c_properties["configurations"] = configurations
+
     vscode_dir = os.path.join(src_dir, ".vscode")
     if os.path.exists(vscode_dir):
         print(f".vscode folder already exists source dir:\n[{src_dir}]\n")
@@ -135,13 +396,19 @@ def generate_vscode_config_jsons(
     settings_path = os.path.join(vscode_dir, "settings.json")
     c_properties_path = os.path.join(vscode_dir, "c_cpp_properties.json")
 
-    with open(settings_path, "w") as f:
-        json.dump(settings, f)
-
-    with open(c_properties_path, "w") as f:
-        json.dump(c_properties, f)
-
-    print(
-        f"VS Code configuration JSON files generated:\n[{settings_path}]\n[{c_properties_path}]\n"
-    )
+    with instrument.stage("write JSON files"):
+        written = [
+            path
+            for path, generated, merge, source_files in [
+                (settings_path, settings, merge_settings, used_files | unused_files),
+                (c_properties_path, c_properties, merge_c_cpp_properties, frozenset()),
+            ]
+            if update_json_file(path, generated, merge, source_files)
+        ]
+        instrument.count("written files", len(written))
+
+    if written:
+        print("VS Code configuration JSON files updated:\n" + "".join(f"[{p}]\n" for p in written))
+    else:
+        print(f"VS Code configuration JSON files are unchanged in:\n[{vscode_dir}]\n")
     return
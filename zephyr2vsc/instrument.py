@@ -0,0 +1,214 @@
+"""Record the wall time, CPU time, peak memory and item counts of each stage of a run."""
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class StageRecord:
+    """One finished stage, with the counts of the items it handled, e.g. `rules`."""
+
+    __slots__ = (
+        "name",
+        "depth",
+        "start_ns",
+        "order",
+        "wall_ns",
+        "cpu_ns",
+        "peak_bytes",
+        "counts",
+        "pid",
+        "tid",
+    )
+
+    def __init__(self, name: str, parents: List["StageRecord"], start_ns: int) -> None:
+        self.name = name
+        self.depth = len(parents)
+        self.start_ns = start_ns
+        # the start times of the enclosing stages, sorting by them lists the stages as a tree
+        self.order = tuple(parent.start_ns for parent in parents) + (start_ns,)
+        self.wall_ns = 0
+        self.cpu_ns = 0
+        self.peak_bytes: Optional[int] = None
+        self.counts: Dict[str, int] = {}
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+
+
+class Profiler:
+    """Collects the records of the stages run while it is the active profiler.
+
+    Stages nest. Peak memory is only traced with `trace_memory`, since tracemalloc slows every
+    allocation down. tracemalloc has a single peak for the whole process, so the stages then run
+    one at a time, see `traces_memory`. The CPU time is the one of the whole process, including
+    the threads a stage starts.
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        self.origin_ns = time.perf_counter_ns()
+        self.records: List[StageRecord] = []
+        self._local = threading.local()
+
+    def _active(self) -> List[StageRecord]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _update_peaks(self, active: List[StageRecord]):
+        # the peak is reset on each stage boundary, the enclosing stages keep the highest one
+        _, peak = tracemalloc.get_traced_memory()
+        for record in active:
+            record.peak_bytes = max(record.peak_bytes or 0, peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        active = self._active()
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            self._update_peaks(active)
+        record = StageRecord(name, active, time.perf_counter_ns())
+        cpu_start = time.process_time_ns()
+        active.append(record)
+        try:
+            yield record
+        finally:
+            if self.trace_memory:
+                self._update_peaks(active)
+                if started_tracing:
+                    tracemalloc.stop()
+            active.pop()
+            record.cpu_ns = time.process_time_ns() - cpu_start
+            record.wall_ns = time.perf_counter_ns() - record.start_ns
+            self.records.append(record)
+
+    def bind(self, function: F) -> F:
+        """Make the stages `function` runs on another thread nest in the running ones."""
+        parents = list(self._active())
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self._local.stack = list(parents)
+            return function(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    def count(self, name: str, value: int):
+        """Add `value` to the count `name` of the innermost running stage."""
+        active = self._active()
+        if active:
+            counts = active[-1].counts
+            counts[name] = counts.get(name, 0) + value
+
+    def sorted_records(self) -> List[StageRecord]:
+        # a stage is recorded when it ends, after the stages it encloses
+        return sorted(self.records, key=lambda record: record.order)
+
+    def trace_events(self) -> Dict[str, Any]:
+        """Return the records in the Chrome trace event format, for chrome://tracing or Perfetto."""
+        events = []
+        for record in self.sorted_records():
+            args: Dict[str, Any] = dict(record.counts)
+            args["cpu_ms"] = record.cpu_ns / 1e6
+            if record.peak_bytes is not None:
+                args["peak_bytes"] = record.peak_bytes
+            events.append(
+                {
+                    "name": record.name,
+                    "cat": "zephyr2vsc",
+                    "ph": "X",
+                    "ts": (record.start_ns - self.origin_ns) / 1000,
+                    "dur": record.wall_ns / 1000,
+                    "pid": record.pid,
+                    "tid": record.tid,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.trace_events(), f, indent=1)
+
+    def format_table(self) -> str:
+        lines = [f"{'Stage':<48}{'Wall s':>9}{'CPU s':>9}{'Peak MB':>9}  Counts"]
+        for record in self.sorted_records():
+            name = "  " * record.depth + record.name
+            peak = "-" if record.peak_bytes is None else f"{record.peak_bytes / 1e6:.1f}"
+            counts = ", ".join(f"{key}={value}" for key, value in record.counts.items())
+            lines.append(
+                f"{name:<48}{record.wall_ns / 1e9:>9.3f}{record.cpu_ns / 1e9:>9.3f}{peak:>9}  "
+                + counts
+            )
+        return "\n".join(lines) + "\n"
+
+
+# stages run outside of `use` are not recorded
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def traces_memory() -> bool:
+    """Whether the active profiler traces the peak memory, the stages must not overlap then."""
+    return _profiler is not None and _profiler.trace_memory
+
+
+@contextmanager
+def use(profiler: Profiler) -> Iterator[Profiler]:
+    """Make `profiler` the active one, e.g. for one run of the stages."""
+    global _profiler
+    previous, _profiler = _profiler, profiler
+    try:
+        yield profiler
+    finally:
+        _profiler = previous
+
+
+@contextmanager
+def _unrecorded_stage(name: str) -> Iterator[StageRecord]:
+    yield StageRecord(name, [], 0)
+
+
+def stage(name: str) -> ContextManager[StageRecord]:
+    return _unrecorded_stage(name) if _profiler is None else _profiler.stage(name)
+
+
+def count(name: str, value: int):
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+
+def bind(function: F) -> F:
+    return function if _profiler is None else _profiler.bind(function)
+
+
+def instrumented(name: str, counts: Optional[Callable[[Any], Dict[str, int]]] = None):
+    """Run the decorated function as the stage `name`, `counts` gets the counts of its result."""
+
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                result = function(*args, **kwargs)
+                if counts is not None:
+                    record.counts.update(counts(result))
+            return result
+
+        return wrapper  # type: ignore
+
+    return decorator
@@ -0,0 +1,53 @@
+"""Tell the source files of each language apart by their suffixes, see `const.SOURCE_LANGUAGES`."""
+
+import os
+from typing import Dict, Iterable, Mapping, Optional, Set, Tuple
+
+from zephyr2vsc import const
+
+# the suffixes of each language, e.g. {"C": (".c",)}
+Languages = Mapping[str, Tuple[str, ...]]
+
+
+def update_languages(
+    languages: Languages, updates: Iterable[Tuple[str, Tuple[str, ...]]]
+) -> Dict[str, Tuple[str, ...]]:
+    """Return the `languages` with the suffixes of each updated language replaced.
+
+    A suffix belongs to one language only, it is taken from the language which had it before. A
+    language without suffixes is removed.
+    """
+    updated = dict(languages)
+    for name, suffixes in updates:
+        updated = {
+            other: tuple(s for s in other_suffixes if s not in suffixes)
+            for other, other_suffixes in updated.items()
+        }
+        updated[name] = suffixes
+    return {name: suffixes for name, suffixes in updated.items() if suffixes}
+
+
+def get_suffixes(languages: Languages, deps: Optional[bool] = None) -> Tuple[str, ...]:
+    """Return the suffixes of the `languages`.
+
+    With `deps` True or False, only or none of the suffixes of `const.DEPS_LANGUAGES`.
+    """
+    return tuple(
+        suffix
+        for name, suffixes in languages.items()
+        if deps is None or deps == (name in const.DEPS_LANGUAGES)
+        for suffix in suffixes
+    )
+
+
+def split_by_language(files: Iterable[str], languages: Languages) -> Dict[str, Set[str]]:
+    """Return the files of each language, the files of no language are left out."""
+    language_of_suffix = {
+        suffix: name for name, suffixes in languages.items() for suffix in suffixes
+    }
+    split: Dict[str, Set[str]] = {name: set() for name in languages}
+    for f in files:
+        name = language_of_suffix.get(os.path.splitext(f)[1])
+        if name is not None:
+            split[name].add(f)
+    return split
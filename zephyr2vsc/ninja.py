@@ -0,0 +1,389 @@
+"""Evaluate the ninja build manifest of a Zephyr build in-process."""
+
+import os
+import posixpath
+import re
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from zephyr2vsc import instrument
+from zephyr2vsc.cache import Fingerprint, fingerprints
+
+# A ninja value that is not evaluated yet: a sequence of (is_variable, text) parts.
+EvalString = List[Tuple[bool, str]]
+
+# "$\n" joins a line with the next one, leading whitespace of the next line is dropped.
+_CONTINUATION = re.compile(r"(?<!\$)((?:\$\$)*)\$\r?\n[ \t]*")
+_VALUE_TOKEN = re.compile(r"\$\{([A-Za-z0-9_.-]+)\}|\$([A-Za-z0-9_-]+)|\$(.)|([^$]+)", re.S)
+_PATH_TOKEN = re.compile(
+    r"((?:\$(?:\{[A-Za-z0-9_.-]+\}|[A-Za-z0-9_-]+|.)|[^$\s:|])+)|(\|\||\|@|\||:)", re.S
+)
+_ASSIGNMENT = re.compile(r"^([A-Za-z0-9_.-]+)\s*=\s*(.*)$", re.S)
+_BINDING = re.compile(r"^[ \t]*([A-Za-z0-9_.-]+)[ \t]*=[ \t]*(\S(?:.*\S)?)?", re.M)
+_SHELL_SAFE = re.compile(r"^[A-Za-z0-9_+\-./]+$")
+
+# A statement starts with every line that is not indented: its keyword or variable name, the
+# rest of its line, then its indented bindings.
+_STATEMENT_START = re.compile(r"\n(?![ \t])")
+_HEAD = re.compile(r"([^\s#=]+)[ \t]*(.*)", re.S)
+
+
+class Rule:
+    """A ninja `rule` with its unevaluated bindings, e.g. `command`."""
+
+    __slots__ = ("name", "bindings")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.bindings: Dict[str, EvalString] = {}
+
+
+class Scope:
+    """A ninja variable and rule scope; `subninja` opens a child scope."""
+
+    __slots__ = ("parent", "variables", "rules")
+
+    def __init__(self, parent: Optional["Scope"] = None):
+        self.parent = parent
+        self.variables: Dict[str, str] = {}
+        self.rules: Dict[str, Rule] = {}
+
+    def lookup_variable(self, name: str) -> str:
+        scope: Optional[Scope] = self
+        while scope is not None:
+            if name in scope.variables:
+                return scope.variables[name]
+            scope = scope.parent
+        return ""
+
+    def lookup_rule(self, name: str) -> Optional[Rule]:
+        scope: Optional[Scope] = self
+        while scope is not None:
+            if name in scope.rules:
+                return scope.rules[name]
+            scope = scope.parent
+        return None
+
+
+class Edge:
+    """A ninja `build` statement."""
+
+    __slots__ = (
+        "rule",
+        "outputs",
+        "inputs",
+        "implicit_inputs",
+        "order_only",
+        "block",
+        "_bindings",
+        "scope",
+    )
+
+    def __init__(
+        self,
+        rule: Rule,
+        scope: Scope,
+        block: str,
+        outputs: List[str],
+        inputs: List[str],
+        implicit_inputs: List[str],
+        order_only: List[str],
+    ):
+        self.rule = rule
+        self.scope = scope
+        self.block = block
+        self.outputs = outputs
+        self.inputs = inputs
+        self.implicit_inputs = implicit_inputs
+        self.order_only = order_only
+        self._bindings: Optional[Dict[str, str]] = None
+
+    @property
+    def bindings(self) -> Dict[str, str]:
+        # only the compile commands read the bindings, a block without variables is parsed then
+        if self._bindings is None:
+            self._bindings = {}
+            for line in self.block.split("\n"):
+                name, equals, value = line.partition("=")
+                if equals:
+                    self._bindings[name.strip()] = value.strip()
+        return self._bindings
+
+
+class EdgeVariables(dict):
+    """The variables of an edge: its paths, then its bindings, the rule's and the scope's.
+
+    The paths and the bindings are looked up as dict items, the others are evaluated when missing.
+    """
+
+    __slots__ = ("edge",)
+
+    def __init__(self, edge: Edge):
+        # the paths are set after the bindings, which cannot override them
+        super().__init__(edge.bindings, out=shell_join(edge.outputs))
+        self["in"] = shell_join(edge.inputs)
+        self.edge = edge
+        self.pop("in_newline", None)
+
+    def __missing__(self, name: str) -> str:
+        edge = self.edge
+        if name == "in_newline":
+            return shell_join(edge.inputs, "\n")
+        if name in edge.rule.bindings:
+            return evaluate(edge.rule.bindings[name], self.__getitem__)
+        return edge.scope.lookup_variable(name)
+
+
+def parse_value(text: str) -> EvalString:
+    value: EvalString = []
+    for m in _VALUE_TOKEN.finditer(text):
+        variable = m.group(1) or m.group(2)
+        if variable:
+            value.append((True, variable))
+        else:
+            value.append((False, m.group(3) or m.group(4)))
+    return value
+
+
+def evaluate(value: EvalString, lookup: Callable[[str], str]) -> str:
+    return "".join([lookup(text) if is_variable else text for is_variable, text in value])
+
+
+def canonicalize_path(path: str) -> str:
+    # ninja collapses "." and ".." components but keeps the slashes as written
+    if "./" in path or "//" in path:
+        return posixpath.normpath(path)
+    return path
+
+
+def shell_escape(path: str) -> str:
+    if os.name == "nt":  # pragma: no cover
+        return f'"{path}"' if " " in path or '"' in path else path
+    if _SHELL_SAFE.match(path):
+        return path
+    return "'" + path.replace("'", "'\\''") + "'"
+
+
+def shell_join(paths: List[str], separator: str = " ") -> str:
+    if len(paths) == 1:
+        return shell_escape(paths[0])
+    # most paths need no quoting, they are all checked at once
+    if _SHELL_SAFE.match("".join(paths)) and os.name != "nt":
+        return separator.join(paths)
+    return separator.join([shell_escape(p) for p in paths])
+
+
+def join_continuations(text: str) -> str:
+    return _CONTINUATION.sub(r"\1", text) if "$" in text else text
+
+
+def continues(line: str) -> bool:
+    # an odd number of "$" at the end escapes the newline
+    return line.endswith("$") and (len(line) - len(line.rstrip("$"))) % 2 == 1
+
+
+def split_statements(text: str) -> List[Tuple[str, str]]:
+    """Split a manifest into the first line and the indented block of each statement."""
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    chunks = _STATEMENT_START.split(text)
+    if "$\n" not in text:
+        return [chunk.partition("\n")[::2] for chunk in chunks if chunk and chunk[0] not in "#= \t"]
+
+    # an escaped newline before a line that is not indented splits a statement
+    statements = []
+    for chunk in join_lines(chunks):
+        if chunk and chunk[0] not in "#= \t":
+            lines = join_lines(chunk.split("\n"))
+            statements.append((lines[0], "\n".join(lines[1:])))
+    return statements
+
+
+def join_lines(lines: List[str]) -> List[str]:
+    """Join each line ending with an escaped newline with the next one."""
+    joined: List[str] = []
+    for line in lines:
+        if joined and continues(joined[-1]):
+            joined[-1] += "\n" + line
+        else:
+            joined.append(line)
+    return joined
+
+
+class NinjaManifest:
+    """The rules and build edges of a build.ninja file and everything it includes.
+
+    Every file is scanned once with a single precompiled pattern. The stages reading the same
+    build share one manifest: `load` returns the last one loaded as long as none of its files
+    changed.
+    """
+
+    _loaded: Dict[str, Tuple[Dict[str, Fingerprint], "NinjaManifest"]] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, build_dir: str):
+        self.build_dir = build_dir
+        self.scope = Scope()
+        self.scopes = [self.scope]
+        self.edges: List[Edge] = []
+        self.files: List[str] = []
+
+    @classmethod
+    def load(cls, build_dir: str, reuse: bool = True) -> "NinjaManifest":
+        key = os.path.abspath(build_dir)
+        with cls._lock:
+            if reuse and key in cls._loaded:
+                loaded_fingerprints, manifest = cls._loaded[key]
+                if fingerprints(loaded_fingerprints) == loaded_fingerprints:
+                    return manifest
+            manifest = cls._parse(build_dir)
+            cls._loaded[key] = (fingerprints(manifest.files), manifest)
+        return manifest
+
+    @classmethod
+    def unload(cls, build_dir: str):
+        """Forget the manifest of `build_dir`, e.g. once a worker is done with that build."""
+        with cls._lock:
+            cls._loaded.pop(os.path.abspath(build_dir), None)
+
+    @classmethod
+    @instrument.instrumented("NinjaManifest.load", lambda manifest: {"edges": len(manifest.edges)})
+    def _parse(cls, build_dir: str) -> "NinjaManifest":
+        manifest = cls(build_dir)
+        manifest._parse_file("build.ninja", manifest.scope)
+        return manifest
+
+    def _parse_file(self, path: str, scope: Scope):
+        path = os.path.join(self.build_dir, path)
+        self.files.append(path)
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        for head, block in split_statements(text):
+            if head.startswith("build "):
+                # most statements are edges, they go straight to their parser
+                self._parse_edge(head[6:], block, scope)
+            elif m := _HEAD.match(head):
+                keyword, rest = m.groups()
+                self._parse_statement(keyword, join_continuations(rest).strip(), block, scope)
+
+    def _parse_statement(self, keyword: str, rest: str, block: str, scope: Scope):
+        bindings: List[Tuple[str, str]] = (
+            _BINDING.findall(join_continuations(block)) if block else []
+        )
+        if keyword == "rule":
+            rule = Rule(rest)
+            rule.bindings = {key: parse_value(value) for key, value in bindings}
+            scope.rules[rule.name] = rule
+        elif keyword in ("include", "subninja"):
+            included = evaluate(parse_value(rest), scope.lookup_variable)
+            if keyword == "subninja":
+                scope = Scope(scope)
+                self.scopes.append(scope)
+            self._parse_file(included, scope)
+        elif keyword in ("default", "pool"):
+            return
+        elif m := _ASSIGNMENT.match(keyword + " " + rest):
+            scope.variables[m.group(1)] = evaluate(parse_value(m.group(2)), scope.lookup_variable)
+
+    def _parse_edge(self, text: str, block: str, scope: Scope):
+        if "$" in text:
+            text = join_continuations(text)
+            tokens = [m.group(1) or m.group(2) for m in _PATH_TOKEN.finditer(text)]
+        else:
+            # without escapes the first ":" ends the outputs and the paths are separated by spaces
+            tokens = text.replace(":", " : ", 1).split()
+        try:
+            colon = tokens.index(":")
+            name = tokens[colon + 1]
+        except (ValueError, IndexError):
+            # no ":" or no rule after it
+            return
+        # most edges use a rule of their own scope
+        rule = scope.rules.get(name) or scope.lookup_rule(name)
+        if rule is None:
+            # "phony" and unknown rules never produce a compile command
+            return
+
+        # outputs [| implicit outputs] : rule inputs [| implicit] [|| order-only] [|@ validations]
+        outputs, inputs = tokens[:colon], tokens[colon + 2 :]
+        implicit: List[str] = []
+        order_only: List[str] = []
+        if "|" in text:
+            if "|" in outputs:
+                outputs = outputs[: outputs.index("|")]
+            if "|@" in inputs:
+                inputs = inputs[: inputs.index("|@")]
+            if "||" in inputs:
+                i = inputs.index("||")
+                inputs, order_only = inputs[:i], inputs[i + 1 :]
+            if "|" in inputs:
+                i = inputs.index("|")
+                inputs, implicit = inputs[:i], inputs[i + 1 :]
+
+        edge = Edge(rule, scope, block, outputs, inputs, implicit, order_only)
+        if "$" in block:
+            # the variables are evaluated with the scope as it is at the edge
+            edge._bindings = {
+                key: evaluate(parse_value(value), scope.lookup_variable) if "$" in value else value
+                for key, value in _BINDING.findall(join_continuations(block))
+            }
+
+        # the paths without variables and relative components are kept as written
+        if "$" in text or "./" in text or "//" in text:
+
+            def lookup(name: str) -> str:
+                return edge.bindings[name] if name in edge.bindings else scope.lookup_variable(name)
+
+            def resolve(tokens: List[str]) -> List[str]:
+                return [
+                    canonicalize_path(evaluate(parse_value(t), lookup) if "$" in t else t)
+                    for t in tokens
+                ]
+
+            edge.outputs, edge.inputs, edge.implicit_inputs, edge.order_only = [
+                resolve(paths) for paths in (outputs, inputs, implicit, order_only)
+            ]
+        self.edges.append(edge)
+
+    def rule_names(self) -> Set[str]:
+        """The rules of every scope, ninja's built-in `phony` rule excluded."""
+        return {name for scope in self.scopes for name in scope.rules}
+
+    def input_files(self, suffixes: Tuple[str, ...]) -> Set[str]:
+        """The explicit and implicit inputs ending with one of the `suffixes`.
+
+        The custom commands list what they read as implicit inputs, e.g. the linker scripts.
+        """
+        return {
+            path
+            for edge in self.edges
+            for paths in (edge.inputs, edge.implicit_inputs)
+            for path in paths
+            if path.endswith(suffixes)
+        }
+
+    def object_targets(self, rules: Set[str]) -> Dict[str, str]:
+        """Map the absolute path of each source the `rules` compile to its first object file."""
+        build_dir = os.path.abspath(self.build_dir)
+        targets: Dict[str, str] = {}
+        for edge in self.edges:
+            if edge.rule.name in rules and edge.inputs and edge.outputs:
+                source = os.path.normpath(os.path.join(build_dir, edge.inputs[0]))
+                targets.setdefault(source, edge.outputs[0])
+        return targets
+
+    def lookup_edge_variable(self, edge: Edge, name: str) -> str:
+        return EdgeVariables(edge)[name]
+
+    def iter_compile_commands(self, rules: Set[str]) -> Iterator[Dict[str, str]]:
+        """Yield the entries `ninja -t compdb <rules>` would print, in manifest order."""
+        directory = os.path.abspath(self.build_dir)
+        for edge in self.edges:
+            if edge.rule.name not in rules or not edge.inputs:
+                continue
+            yield {
+                "directory": directory,
+                "command": EdgeVariables(edge)["command"],
+                "file": edge.inputs[0],
+                "output": edge.outputs[0] if edge.outputs else "",
+            }
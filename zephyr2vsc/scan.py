@@ -0,0 +1,298 @@
+"""Scan the source tree for source files with a parallel, pruning directory walker."""
+
+import fnmatch
+import os
+import re
+import sqlite3
+import struct
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple
+
+# the mtime, the names of the files with one of the suffixes and of the subdirs of a dir
+DirEntry = Tuple[int, str, str]
+
+# a dir changed this close to its listing may change again without a new mtime, it is relisted
+_RACY_NS = 2_000_000_000
+
+_GIT_INDEX_HEADER = struct.Struct(">4sII")
+_GIT_FLAGS = struct.Struct(">H")
+# ctime, mtime, dev, ino, mode, uid, gid, size, object id and flags of a git index entry
+_GIT_ENTRY_SIZE = 62
+_GIT_EXTENDED_FLAG = 0x4000
+_GIT_NAME_MASK = 0xFFF
+
+
+def compile_ignore_globs(ignore_globs: Iterable[str]) -> Optional[Pattern[str]]:
+    """Combine the globs into one pattern, matched against a dir name or its relative path."""
+    globs = list(ignore_globs)
+    if not globs:
+        return None
+    return re.compile("|".join(fnmatch.translate(os.path.normcase(g)) for g in globs))
+
+
+def _is_ignored(ignore: Optional[Pattern[str]], name: str, rel_path: str) -> bool:
+    return ignore is not None and bool(
+        ignore.match(os.path.normcase(name))
+        or ignore.match(os.path.normcase(rel_path).replace(os.sep, "/"))
+    )
+
+
+def _list_dir(path: str, rel_dir: str, suffixes: Tuple[str, ...]) -> Tuple[str, DirEntry]:
+    files = []
+    subdirs = []
+    try:
+        # the mtime is taken first, a change while listing makes the next run list the dir again
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # like os.walk, symlinked dirs are neither listed as files nor followed
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                elif entry.name.endswith(suffixes):
+                    files.append(entry.name)
+    except OSError:  # pragma: no cover
+        # unreadable dirs are skipped, like os.walk does
+        return rel_dir, (-1, "", "")
+    return rel_dir, (mtime, "\0".join(files), "\0".join(subdirs))
+
+
+class DirIndex:
+    """The listing of every dir of a source tree with its mtime, saved in a SQLite file.
+
+    A dir with the same mtime as when it was listed still has the same files and subdirs, so
+    only the changed dirs are listed again. One file holds the index of several trees.
+    """
+
+    def __init__(self, path: str, root: str, suffixes: Tuple[str, ...]):
+        self.path = path
+        self.key = (os.path.abspath(root), "\0".join(sorted(suffixes)))
+        self.entries: Dict[str, DirEntry] = {}
+        self.updated: Dict[str, DirEntry] = {}
+        self.started_ns = time.time_ns()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS dirs (root TEXT, suffixes TEXT, dir TEXT, mtime INTEGER,"
+            " files TEXT, subdirs TEXT, PRIMARY KEY (root, suffixes, dir)) WITHOUT ROWID"
+        )
+        return connection
+
+    @classmethod
+    def load(cls, path: str, root: str, suffixes: Tuple[str, ...]) -> "DirIndex":
+        index = cls(path, root, suffixes)
+        if not os.path.isfile(path):
+            return index
+        try:
+            connection = index._connect()
+            try:
+                rows = connection.execute(
+                    "SELECT dir, mtime, files, subdirs FROM dirs WHERE root = ? AND suffixes = ?",
+                    index.key,
+                )
+                index.entries = {row[0]: row[1:] for row in rows}
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            # a broken index is rebuilt, it only saves listing the dirs again
+            index.entries = {}
+            os.remove(path)
+        return index
+
+    def get(self, path: str, rel_dir: str) -> Optional[DirEntry]:
+        """Return the listing of the dir if it did not change since it was indexed."""
+        entry = self.entries.get(rel_dir)
+        if entry is None:
+            return None
+        try:
+            return entry if os.stat(path).st_mtime_ns == entry[0] else None
+        except OSError:
+            return None
+
+    def update(self, rel_dir: str, entry: DirEntry):
+        if entry[0] >= self.started_ns - _RACY_NS:
+            entry = (-1, entry[1], entry[2])
+        if self.entries.get(rel_dir) != entry:
+            self.updated[rel_dir] = entry
+
+    def save(self, visited: Set[str]):
+        """Save the updated dirs and drop the ones which are gone, if anything changed."""
+        removed = [rel_dir for rel_dir in self.entries if rel_dir not in visited]
+        if not self.updated and not removed:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "DELETE FROM dirs WHERE root = ? AND suffixes = ? AND dir = ?",
+                    ((*self.key, rel_dir) for rel_dir in removed),
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?)",
+                    ((*self.key, rel_dir, *entry) for rel_dir, entry in self.updated.items()),
+                )
+        finally:
+            connection.close()
+
+
+def scan_source_tree(
+    src_dir: str,
+    suffixes: Tuple[str, ...] = (".c",),
+    ignore_globs: Iterable[str] = (),
+    exclude_dirs: Iterable[str] = (),
+    jobs: Optional[int] = None,
+    index_path: Optional[str] = None,
+) -> Set[str]:
+    """Return the paths relative to `src_dir` of all the files ending with one of `suffixes`.
+
+    Dirs matching `ignore_globs` and the `exclude_dirs` (e.g. a build dir nested in the source
+    tree) are pruned before they are listed. Dirs are listed on a pool of `jobs` threads since
+    the walk mostly waits on the file system. With an `index_path`, only the dirs which changed
+    since the last scan are listed, see `DirIndex`.
+    """
+    ignore = compile_ignore_globs(ignore_globs)
+    excluded = {os.path.normcase(os.path.abspath(d)) for d in exclude_dirs}
+    index = DirIndex.load(index_path, src_dir, suffixes) if index_path is not None else None
+
+    found: Set[str] = set()
+    visited: Set[str] = set()
+    stack = [(src_dir, "")]
+
+    def add(path: str, rel_dir: str, entry: DirEntry):
+        visited.add(rel_dir)
+        if entry[1]:
+            found.update(rel_dir + name for name in entry[1].split("\0"))
+        if not entry[2]:
+            return
+        for name in entry[2].split("\0"):
+            # build the relative path by hand, os.path.relpath is slow on big trees
+            rel_path = rel_dir + name
+            subdir = os.path.join(path, name)
+            if os.path.normcase(subdir) in excluded or _is_ignored(ignore, name, rel_path):
+                continue
+            stack.append((subdir, rel_path + os.sep))
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending: Set[Future] = set()
+        paths: Dict[str, str] = {}
+        while stack or pending:
+            while stack:
+                path, rel_dir = stack.pop()
+                entry = index.get(path, rel_dir) if index is not None else None
+                if entry is not None:
+                    add(path, rel_dir, entry)
+                else:
+                    paths[rel_dir] = path
+                    pending.add(pool.submit(_list_dir, path, rel_dir, suffixes))
+            if pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel_dir, entry = future.result()
+                    if index is not None:
+                        index.update(rel_dir, entry)
+                    add(paths.pop(rel_dir), rel_dir, entry)
+
+    if index is not None:
+        index.save(visited)
+    return found
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, offset
+
+
+def read_git_index(index_file: str) -> List[str]:
+    """Return the paths of the files tracked in a git index, versions 2 to 4."""
+    with open(index_file, "rb") as f:
+        data = f.read()
+    signature, version, count = _GIT_INDEX_HEADER.unpack_from(data)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"Unsupported git index:\n[{index_file}]")
+
+    paths: List[str] = []
+    offset = _GIT_INDEX_HEADER.size
+    previous = b""
+    unpack_flags = _GIT_FLAGS.unpack_from
+    for _ in range(count):
+        start = offset
+        (flags,) = unpack_flags(data, offset + _GIT_ENTRY_SIZE - 2)
+        offset += _GIT_ENTRY_SIZE + (2 if version >= 3 and flags & _GIT_EXTENDED_FLAG else 0)
+        if version == 4:
+            # the path replaces the end of the previous path
+            strip, offset = _read_varint(data, offset)
+            end = data.index(b"\0", offset)
+            path = previous[: len(previous) - strip] + data[offset:end]
+            previous = path
+            offset = end + 1
+        else:
+            # the flags hold the length of the path, unless it is too long for them
+            length = flags & _GIT_NAME_MASK
+            end = offset + length if length < _GIT_NAME_MASK else data.index(b"\0", offset)
+            path = data[offset:end]
+            # the entries are padded with 1 to 8 NUL bytes to a multiple of 8 bytes
+            offset = start + ((end - start + 8) & ~7)
+        paths.append(path.decode("utf-8", "surrogateescape"))
+    return paths
+
+
+def get_git_index_file(src_dir: str) -> Optional[str]:
+    """Return the index of the git checkout at `src_dir`, also of worktrees and submodules."""
+    git = os.path.join(src_dir, ".git")
+    if os.path.isfile(git):
+        with open(git, "r") as f:
+            line = f.readline().strip()
+        if not line.startswith("gitdir:"):
+            return None
+        git = os.path.join(src_dir, line[len("gitdir:") :].strip())
+    index_file = os.path.join(git, "index")
+    return index_file if os.path.isfile(index_file) else None
+
+
+def scan_git_checkout(
+    src_dir: str,
+    suffixes: Tuple[str, ...] = (".c",),
+    ignore_globs: Iterable[str] = (),
+    exclude_dirs: Iterable[str] = (),
+) -> Optional[Set[str]]:
+    """Like `scan_source_tree`, but read the tracked files from the git index like `git ls-files`.
+
+    Untracked files are not found. Returns None if `src_dir` is not the top of a git checkout.
+    """
+    index_file = get_git_index_file(src_dir)
+    if index_file is None:
+        return None
+
+    ignore = compile_ignore_globs(ignore_globs)
+    src_dir = os.path.abspath(src_dir)
+    excluded = {os.path.normcase(os.path.abspath(d)) for d in exclude_dirs}
+    # whether each dir is pruned, decided once per dir
+    pruned: Dict[str, bool] = {"": False}
+
+    def is_pruned(rel_dir: str) -> bool:
+        if rel_dir not in pruned:
+            parent, _, name = rel_dir.rpartition("/")
+            pruned[rel_dir] = (
+                is_pruned(parent)
+                or _is_ignored(ignore, name, rel_dir)
+                or os.path.normcase(os.path.join(src_dir, rel_dir)) in excluded
+            )
+        return pruned[rel_dir]
+
+    found = set()
+    for path in read_git_index(index_file):
+        if path.endswith(suffixes):
+            rel_dir = path.rpartition("/")[0]
+            if not (pruned[rel_dir] if rel_dir in pruned else is_pruned(rel_dir)):
+                found.add(path)
+    # git always separates the dirs with a slash
+    return found if os.sep == "/" else {path.replace("/", os.sep) for path in found}
@@ -0,0 +1,41 @@
+"""Run stages as a DAG on a thread pool, each one as soon as the stages it depends on are done."""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from zephyr2vsc import instrument
+from zephyr2vsc.cache import BuildCache
+
+# stage name: (compute, input files, output files, stages it depends on)
+Stages = Dict[str, Tuple[Callable[[], Any], List[str], List[str], List[str]]]
+
+
+def run_stages(
+    cache: BuildCache, stages: Stages, results: Dict[str, Any], jobs: Optional[int] = None
+) -> Dict[str, Any]:
+    """Run the stages through `cache` on `jobs` threads and put their results in `results`.
+
+    The computations read the results of the stages they depend on from `results`. Dependencies
+    which are not in `stages` are taken as done, e.g. stages run by another process. The stages
+    mostly wait on the file system, so they overlap well despite the GIL. While the peak memory of
+    each stage is traced, the stages run one at a time.
+    """
+    if instrument.traces_memory():
+        jobs = 1
+    pending = dict(stages)
+    running: Dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name, (compute, inputs, outputs, depends) in list(pending.items()):
+                if all(depend in results or depend not in stages for depend in depends):
+                    del pending[name]
+                    run = instrument.bind(cache.run)
+                    future = pool.submit(run, name, compute, inputs, outputs, depends)
+                    running[future] = name
+            if not running:
+                raise ValueError(f"The stages depend on each other: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
@@ -0,0 +1,98 @@
+"""Compile only the file open in VS Code, through the object file ninja builds from it.
+
+Each build dir gets a table of the sources it compiles and their object files, one sorted
+`source<TAB>object` line per source. The `tasks.json` task passes `${file}` to
+`zephyr2vsc compile`, which looks the object up in the tables and runs `ninja -C <bld> <obj>`.
+"""
+
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from zephyr2vsc import const
+from zephyr2vsc.atomic import atomic_write
+
+COMPILE_TASK_LABEL = "zephyr2vsc: compile current file"
+
+# the dir `python -m zephyr2vsc` runs from, it works without installing zephyr2vsc
+PACKAGE_PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_object_table_path(build_dir: str) -> str:
+    return os.path.join(build_dir, const.OBJECT_TABLE_FILE_NAME)
+
+
+def write_object_table(path: str, targets: Dict[str, str]) -> bool:
+    """Write the sources and their objects to `path` unless it holds them, return if it did.
+
+    The table is replaced atomically, a compile task running meanwhile reads the old or new one.
+    """
+    content = "".join(f"{source}\t{targets[source]}\n" for source in sorted(targets))
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    with atomic_write(path, encoding="utf-8", newline="") as f:
+        f.write(content)
+    return True
+
+
+def find_object(build_dir: str, source: str) -> Optional[str]:
+    """Return the object file `build_dir` compiles `source` to, or None if it does not."""
+    key = os.path.normcase(os.path.normpath(os.path.abspath(source)))
+    try:
+        with open(get_object_table_path(build_dir), "r", encoding="utf-8", newline="") as f:
+            for line in f:
+                table_source, _, target = line.rstrip("\n").partition("\t")
+                if os.path.normcase(table_source) == key:
+                    return target
+    except OSError:
+        pass
+    return None
+
+
+def compile_file(source: str, build_dirs: Iterable[str], ninja: str = "ninja") -> int:
+    """Build the object of `source` in each build dir compiling it, return the exit code."""
+    import subprocess
+
+    targets: List[Tuple[str, str]] = [
+        (build_dir, target)
+        for build_dir in build_dirs
+        if (target := find_object(build_dir, source)) is not None
+    ]
+    if not targets:
+        print(f"No build compiles:\n[{source}]", file=sys.stderr)
+        return 1
+    for build_dir, target in targets:
+        print(f"Compiling [{target}] in:\n[{build_dir}]\n", flush=True)
+        returncode = subprocess.run([ninja, "-C", build_dir, target]).returncode
+        if returncode:
+            return returncode
+    return 0
+
+
+def make_tasks(build_dirs: List[str]) -> Dict[str, Any]:
+    """Return the tasks.json with the task compiling `${file}` in the given build dirs."""
+    args = ["-m", "zephyr2vsc", "compile", "${file}"]
+    for build_dir in build_dirs:
+        args += ["--build-dir", build_dir.replace("\\", "/")]
+    return {
+        "version": "2.0.0",
+        "tasks": [
+            {
+                "label": COMPILE_TASK_LABEL,
+                "type": "process",
+                "command": sys.executable.replace("\\", "/"),
+                "args": args,
+                "options": {"cwd": PACKAGE_PARENT_DIR.replace("\\", "/")},
+                "group": "build",
+                "presentation": {"reveal": "always", "clear": True},
+                "problemMatcher": {
+                    "base": "$gcc",
+                    "fileLocation": ["autoDetect", build_dirs[0].replace("\\", "/")],
+                },
+            }
+        ],
+    }
@@ -0,0 +1,144 @@
+"""Generate one workspace for all the builds twister leaves in its output dir.
+
+Only the used files of each build are extracted, on a pool of processes, while the source tree is
+walked once. Which builds use each file is kept in a bitmap, the workspace shows the files any
+build uses, or the ones every build uses, and a CSV report lists how many builds use each file.
+"""
+
+import csv
+import os
+from typing import Any, Dict, Iterable, List, Set
+
+from zephyr2vsc import const
+from zephyr2vsc.helpers import make_settings
+from zephyr2vsc.languages import get_suffixes
+from zephyr2vsc.schedule import Stages
+from zephyr2vsc.vscode_json import update_json_file
+from zephyr2vsc.workspace import Workspace
+
+USAGE_STAGES = ("used_files", "used_h_files")
+MODES = const.TWISTER_MODES
+
+
+def find_build_dirs(roots: Iterable[str]) -> List[str]:
+    """Return the dirs holding a build.ninja under `roots`, without looking into build dirs."""
+    build_dirs = []
+    stack = [os.path.abspath(root) for root in roots]
+    while stack:
+        path = stack.pop()
+        if os.path.isfile(os.path.join(path, "build.ninja")):
+            build_dirs.append(path)
+            continue
+        try:
+            with os.scandir(path) as entries:
+                stack.extend(e.path for e in entries if e.is_dir() and not e.is_symlink())
+        except OSError:  # pragma: no cover
+            continue
+    return sorted(build_dirs)
+
+
+class UsageMatrix:
+    """Which builds use each file: one int per file, with the bit of each build using it."""
+
+    def __init__(self, builds: List[str]):
+        self.builds = builds
+        self.bits: Dict[str, int] = {}
+
+    def add(self, build_index: int, files: Iterable[str]):
+        bit = 1 << build_index
+        bits = self.bits
+        for f in files:
+            bits[f] = bits.get(f, 0) | bit
+
+    def union(self) -> Set[str]:
+        return set(self.bits)
+
+    def intersection(self) -> Set[str]:
+        every_build = (1 << len(self.builds)) - 1
+        return {f for f, bits in self.bits.items() if bits == every_build}
+
+    def count(self, file: str) -> int:
+        return bin(self.bits.get(file, 0)).count("1")
+
+    def users(self, file: str) -> List[str]:
+        bits = self.bits.get(file, 0)
+        return [build for i, build in enumerate(self.builds) if bits >> i & 1]
+
+
+def write_usage_report(path: str, matrix: UsageMatrix, files: Iterable[str]):
+    """Write how many builds use each of `files` and of the used files, and their share."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "builds", "share"])
+        for file in sorted(set(files) | matrix.union()):
+            count = matrix.count(file)
+            writer.writerow([file.replace("\\", "/"), count, f"{count / len(matrix.builds):.3f}"])
+
+
+class TwisterWorkspace(Workspace):
+    """A workspace for every build found under the `build_dirs`, e.g. `twister-out`.
+
+    Only the used files are extracted from each build, no compile DB is generated, so the
+    `settings.json` hiding the unused files and the usage report are the only outputs. In the
+    `union` mode the files any build uses are shown, in the `intersection` mode the ones every
+    build uses.
+    """
+
+    configs_build_stages = USAGE_STAGES
+    build_stage_names = USAGE_STAGES
+
+    def __init__(self, *args: Any, mode: str = "union", **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        if mode not in MODES:
+            raise ValueError(f"Unknown twister mode [{mode}], use one of: {', '.join(MODES)}")
+        self.mode = mode
+        self.roots = self.build_dirs
+        self.build_dirs = find_build_dirs(self.roots)
+        if not self.build_dirs:
+            raise ValueError(
+                "No build dir found under:\n" + "".join(f"[{root}]\n" for root in self.roots)
+            )
+        print(f"Found [{len(self.build_dirs)}] build dirs.\n")
+        self.report_path = os.path.join(self.vscode_dir, const.USAGE_REPORT_FILE_NAME)
+        self.config_jsons = [self.config_jsons[0], self.report_path]
+
+    def _cache_key(self, cache_dir: str) -> Dict[str, Any]:
+        key = super()._cache_key(cache_dir)
+        if cache_dir == self.vscode_dir:
+            key.update(twister_mode=self.mode)
+        return key
+
+    def _workspace_stages(self, results: Dict[str, Any]) -> Stages:
+        stages = super()._workspace_stages(results)
+        _, inputs, _, depends = stages["configs"]
+
+        def generate_usage_configs() -> List[str]:
+            builds = [self.results[build_dir] for build_dir in self.build_dirs]
+            matrix = UsageMatrix(self.build_dirs)
+            for i, build in enumerate(builds):
+                matrix.add(i, build["used_files"])
+            # the files of the deps languages are only hidden when every build has a deps log
+            with_deps = all(build["used_h_files"] is not None for build in builds)
+            if with_deps:
+                for i, build in enumerate(builds):
+                    matrix.add(i, build["used_h_files"])
+
+            used_files = matrix.union() if self.mode == "union" else matrix.intersection()
+            all_files = results["all_files"]
+            excluded_suffixes = get_suffixes(self.languages, None if with_deps else False)
+            unused_files = {f for f in all_files if f.endswith(excluded_suffixes)} - used_files
+            which = "any" if self.mode == "union" else "every"
+            print(
+                f"[{len(used_files)}] files are used by {which} one of [{len(builds)}] builds, "
+                f"exclude [{len(unused_files)}] files.\n"
+            )
+
+            os.makedirs(self.vscode_dir, exist_ok=True)
+            settings = make_settings(used_files, unused_files, self.src_dir, self.roots)
+            update_json_file(self.config_jsons[0], settings, source_files=used_files | unused_files)
+            write_usage_report(self.report_path, matrix, all_files)
+            print(f"Usage report saved as:\n[{self.report_path}]\n")
+            return self.config_jsons
+
+        stages["configs"] = (generate_usage_configs, inputs, self.config_jsons, depends)
+        return stages
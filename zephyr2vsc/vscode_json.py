@@ -0,0 +1,163 @@
+"""Merge the generated settings into the VS Code JSON files and only write the changed ones."""
+
+import contextlib
+import json
+import os
+import re
+from typing import AbstractSet, Any, Callable, Dict, Iterable, List, Optional, Set
+
+from zephyr2vsc import const
+from zephyr2vsc.atomic import atomic_write
+
+# the strings are matched first, so that the comments and commas in them are kept
+_COMMENT = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*[\s\S]*?\*/')
+_TRAILING_COMMA = re.compile(r'("(?:\\.|[^"\\])*")|,(?=\s*[}\]])')
+
+
+def parse_jsonc(text: str) -> Any:
+    """Parse JSON with comments and trailing commas, like VS Code accepts in its files."""
+    # the files zephyr2vsc wrote are plain JSON, which the regexes would take a while to scan
+    with contextlib.suppress(ValueError):
+        return json.loads(text)
+    text = _COMMENT.sub(lambda m: m.group(1) or "", text)
+    return json.loads(_TRAILING_COMMA.sub(lambda m: m.group(1) or "", text))
+
+
+def merge_settings(existing: Any, generated: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the keys zephyr2vsc generates and keep all the other ones, in their order."""
+    merged = dict(existing) if isinstance(existing, dict) else {}
+    merged.update(generated)
+    return merged
+
+
+def merge_patterns(
+    existing: Any, generated: Dict[str, Any], previous: Iterable[str]
+) -> Dict[str, Any]:
+    """Replace the glob patterns zephyr2vsc generated `previous`ly and keep the ones of the user."""
+    dropped = set(previous) | set(generated)
+    kept = existing.items() if isinstance(existing, dict) else ()
+    return {**{p: v for p, v in kept if p not in dropped}, **generated}
+
+
+def _is_generated_configuration(configuration: Any, names: Set[str]) -> bool:
+    # also the configurations of builds which are gone, they use the compile DB of zephyr2vsc
+    return isinstance(configuration, dict) and (
+        configuration.get("name") in names
+        or str(configuration.get("compileCommands", "")).endswith(const.COMPILE_DB_FILE_NAME)
+    )
+
+
+def merge_c_cpp_properties(existing: Any, generated: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the configurations zephyr2vsc generates and keep the other ones after them."""
+    merged = merge_settings(existing, generated)
+    configurations: List[Dict[str, Any]] = generated["configurations"]
+    names = {configuration["name"] for configuration in configurations}
+    kept = existing.get("configurations") if isinstance(existing, dict) else None
+    if isinstance(kept, list):
+        merged["configurations"] = [
+            *configurations,
+            *(c for c in kept if not _is_generated_configuration(c, names)),
+        ]
+    return merged
+
+
+def merge_tasks(existing: Any, generated: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the tasks zephyr2vsc generates, matched by label, and keep the other ones."""
+    merged = merge_settings(existing, generated)
+    labels = {task["label"] for task in generated["tasks"]}
+    kept = existing.get("tasks") if isinstance(existing, dict) else None
+    if isinstance(kept, list):
+        merged["tasks"] = [
+            *(t for t in kept if not (isinstance(t, dict) and t.get("label") in labels)),
+            *generated["tasks"],
+        ]
+    return merged
+
+
+def merge_code_workspace(existing: Any, generated: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the folders and merge the settings of a .code-workspace file."""
+    merged = merge_settings(existing, generated)
+    settings = existing.get("settings") if isinstance(existing, dict) else None
+    merged["settings"] = merge_settings(settings, generated["settings"])
+    return merged
+
+
+def write_json_if_changed(path: str, data: Any, existing: Optional[Any]) -> bool:
+    """Write `data` to `path` unless it equals the `existing` content, return whether it did.
+
+    The data goes to a temporary file which then replaces `path`, so VS Code never reads a half
+    written file. The file keeps its mode, see `atomic.replace_file`.
+    """
+    if existing == data:
+        return False
+
+    with atomic_write(path, encoding="utf-8") as f:
+        # the text is written at once, json.dump writes each token on its own
+        f.write(json.dumps(data, indent=4) + "\n")
+    return True
+
+
+def _load_generated_patterns(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _get_unrecorded_patterns(existing: Any, key: str, source_files: AbstractSet[str]) -> List[str]:
+    # the template globs and the per-file excludes an older version wrote, which kept no record
+    template: Dict[str, Any] = const.SETTINGS_JSON_TEMPLATE.get(key, {})  # type: ignore
+    patterns = existing.get(key) if isinstance(existing, dict) else None
+    if not isinstance(patterns, dict):
+        return []
+    return [p for p in patterns if p in template or p.replace("/", os.sep) in source_files]
+
+
+def update_json_file(
+    path: str,
+    generated: Dict[str, Any],
+    merge: Callable[[Any, Dict[str, Any]], Dict[str, Any]] = merge_settings,
+    source_files: AbstractSet[str] = frozenset(),
+) -> bool:
+    """Merge the generated keys into the JSON file at `path`, return whether it was written.
+
+    Every write of settings.json or c_cpp_properties.json makes the C/C++ extension reset its
+    IntelliSense state, so a file already holding the merged content is not touched. The
+    comments of a rewritten file are lost, a file which is not valid JSON is kept as `.bak`.
+
+    The glob maps of `const.GLOB_MAP_SETTINGS`, e.g. files.exclude, are merged pattern by
+    pattern. The generated patterns are recorded in `const.GENERATED_PATTERNS_FILE_NAME`, so the
+    next run replaces only those and keeps the patterns the user added. Without a record, the
+    template globs and the paths of the `source_files` relative to the dir the settings apply to
+    are taken as generated, they are what the versions before the record wrote.
+    """
+    existing = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            existing = parse_jsonc(f.read())
+    except FileNotFoundError:
+        pass
+    except ValueError:
+        os.replace(path, path + ".bak")
+        print(f"Invalid JSON file saved as:\n[{path}.bak]\n")
+    merged = merge(existing, generated)
+
+    glob_maps = [key for key in const.GLOB_MAP_SETTINGS if key in generated]
+    if glob_maps:
+        directory, name = os.path.split(path)
+        record_path = os.path.join(directory, const.GENERATED_PATTERNS_FILE_NAME)
+        record = _load_generated_patterns(record_path)
+        previous = record.get(name)
+        if not isinstance(previous, dict):
+            previous = {
+                key: _get_unrecorded_patterns(existing, key, source_files) for key in glob_maps
+            }
+        for key in glob_maps:
+            existing_patterns = existing.get(key) if isinstance(existing, dict) else None
+            merged[key] = merge_patterns(existing_patterns, generated[key], previous.get(key, ()))
+        patterns = {key: sorted(generated[key]) for key in glob_maps}
+        write_json_if_changed(record_path, {**record, name: patterns}, record)
+
+    return write_json_if_changed(path, merged, existing)
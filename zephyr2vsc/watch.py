@@ -0,0 +1,192 @@
+"""Wait for the files a build writes to change, with inotify on Linux or by polling."""
+
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from zephyr2vsc.cache import Fingerprint, fingerprints
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_IGNORED = 0x00008000
+_IN_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_IN_EVENT = struct.Struct("iIII")
+
+
+class Watcher(abc.ABC):
+    """Watches a set of files, `wait` returns True as soon as one of them changed."""
+
+    def __init__(self, paths: Iterable[str]):
+        self.paths = [os.path.abspath(path) for path in paths]
+
+    @abc.abstractmethod
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until a file changed, return False if none did within `timeout` seconds."""
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """Compares the mtime and size of the files every `interval` seconds."""
+
+    def __init__(self, paths: Iterable[str], interval: float = 0.5):
+        super().__init__(paths)
+        self.interval = interval
+        self.last: Dict[str, Fingerprint] = fingerprints(self.paths)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = fingerprints(self.paths)
+            if current != self.last:
+                self.last = current
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            remaining = self.interval if deadline is None else deadline - time.monotonic()
+            time.sleep(max(0.0, min(self.interval, remaining)))
+
+
+class InotifyWatcher(Watcher):
+    """Watches the dirs of the files, ninja and CMake replace some files instead of writing them.
+
+    A pristine build deletes the build dir, its watch is added again once it is recreated.
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        super().__init__(paths)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:  # pragma: no cover
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._names_by_dir: Dict[str, Set[bytes]] = {}
+        for path in self.paths:
+            self._names_by_dir.setdefault(os.path.dirname(path), set()).add(
+                os.fsencode(os.path.basename(path))
+            )
+        self._dirs_by_wd: Dict[int, str] = {}
+        self._add_watches()
+
+    def _add_watches(self) -> bool:
+        """Watch the dirs which are not watched yet, return True if any was added."""
+        watched = set(self._dirs_by_wd.values())
+        added = False
+        for watched_dir in self._names_by_dir:
+            if watched_dir not in watched:
+                wd = self._libc.inotify_add_watch(self._fd, os.fsencode(watched_dir), _IN_MASK)
+                if wd >= 0:
+                    self._dirs_by_wd[wd] = watched_dir
+                    added = True
+        return added
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # look for recreated dirs at least every second
+            select_timeout = 1.0
+            if deadline is not None:
+                select_timeout = max(0.0, min(select_timeout, deadline - time.monotonic()))
+            readable, _, _ = select.select([self._fd], [], [], select_timeout)
+            if readable and self._read_events():
+                return True
+            if self._add_watches():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def _read_events(self) -> bool:
+        changed = False
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset + _IN_EVENT.size <= len(data):
+            wd, mask, _, name_size = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            name = data[offset : offset + name_size].rstrip(b"\0")
+            offset += name_size
+            if mask & _IN_IGNORED:
+                # the watched dir is gone
+                self._dirs_by_wd.pop(wd, None)
+                changed = True
+            elif wd in self._dirs_by_wd:
+                changed = changed or name in self._names_by_dir[self._dirs_by_wd[wd]]
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(paths: Iterable[str]) -> Watcher:
+    paths = list(paths)
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError, TypeError):  # pragma: no cover
+            print("inotify is not available, polling the build files instead.\n")
+    return PollingWatcher(paths)  # pragma: no cover
+
+
+def is_ninja_running(build_dirs: Iterable[str]) -> bool:
+    """Return whether a ninja process runs in one of the `build_dirs`, as far as /proc tells.
+
+    ninja changes into the dir given with -C, so its working dir is the build dir. Without /proc,
+    e.g. on Windows and macOS, False is returned.
+    """
+    dirs = {os.path.realpath(build_dir) for build_dir in build_dirs}
+    try:
+        pids = [pid for pid in os.listdir("/proc") if pid.isdigit()]
+    except OSError:
+        return False
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                program = os.path.basename(f.read().split(b"\0", 1)[0])
+            if program in (b"ninja", b"ninja-build") and (
+                os.path.realpath(os.readlink(f"/proc/{pid}/cwd")) in dirs
+            ):
+                return True
+        except OSError:
+            # the process is gone or belongs to another user
+            continue
+    return False
+
+
+def wait_for_build(watcher: Watcher, debounce: float, build_dirs: Iterable[str] = ()):
+    """Block until the watched files changed and then the build of `build_dirs` is over.
+
+    ninja appends to .ninja_log and .ninja_deps as each edge finishes, a long compile or link
+    writes nothing though. So the build is only taken as over when the files stayed unchanged for
+    `debounce` seconds and no ninja process runs in a build dir. Where that cannot be told, see
+    `is_ninja_running`, a step taking longer than `debounce` starts a regeneration amid the build,
+    which is then repeated after it.
+    """
+    build_dirs = list(build_dirs)
+    watcher.wait()
+    while watcher.wait(debounce) or is_ninja_running(build_dirs):
+        pass
+
+
+def get_build_files(build_dirs: Iterable[str]) -> List[str]:
+    """The files in the build dirs the stages read."""
+    return [
+        os.path.join(build_dir, *path)
+        for build_dir in build_dirs
+        for path in [
+            ("build.ninja",),
+            ("CMakeFiles", "rules.ninja"),
+            (".ninja_log",),
+            (".ninja_deps",),
+        ]
+    ]
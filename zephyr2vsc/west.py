@@ -0,0 +1,313 @@
+"""Generate a multi-root VS Code workspace of the west projects a build uses.
+
+The projects are read from `.west/config` and the manifest files on disk, west itself is not
+needed and nothing is fetched.
+"""
+
+import configparser
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AbstractSet, Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from zephyr2vsc import const, instrument
+from zephyr2vsc.helpers import make_settings
+from zephyr2vsc.languages import get_suffixes
+from zephyr2vsc.scan import scan_git_checkout, scan_source_tree
+from zephyr2vsc.schedule import Stages
+from zephyr2vsc.vscode_json import merge_code_workspace, update_json_file
+from zephyr2vsc.workspace import Workspace
+
+
+class WestProject(NamedTuple):
+    name: str
+    path: str
+
+
+def find_west_topdir(start: str) -> Optional[str]:
+    """Return the west workspace dir `start` is in, the one holding `.west/config`."""
+    path = os.path.abspath(start)
+    while True:
+        if os.path.isfile(os.path.join(path, ".west", "config")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def load_manifest_file(path: str) -> Dict[str, Any]:
+    """Return the `manifest` mapping of a west manifest file, raise ValueError if invalid."""
+    # PyYAML is only imported in west mode, it slows down every start otherwise
+    try:
+        import yaml  # type: ignore
+    except ImportError as e:
+        raise ValueError(
+            "Reading the west manifests needs PyYAML, which is installed along with west:\n"
+            "pip install pyyaml"
+        ) from e
+
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise ValueError(f"Invalid west manifest, {e}:\n[{path}]") from e
+    if data is None:
+        return {}
+    manifest = data.get("manifest") if isinstance(data, dict) else None
+    if not isinstance(manifest, dict):
+        raise ValueError(f"Invalid west manifest, it has no manifest mapping:\n[{path}]")
+    return manifest
+
+
+def _get_import_files(
+    path: str, import_value: Any, read_paths: List[str]
+) -> Tuple[List[str], Dict[str, Any]]:
+    """The manifest files an `import` of the project at `path` reads and its filters.
+
+    The imported path is added to `read_paths`, a file added to an imported dir or a missing
+    imported file created later changes the projects.
+    """
+    filters: Dict[str, Any] = {}
+    if import_value is True:
+        import_value = "west.yml"
+    elif isinstance(import_value, dict):
+        filters = import_value
+        import_value = import_value.get("file", "west.yml")
+    if not isinstance(import_value, str):
+        return [], filters
+
+    import_path = os.path.join(path, import_value)
+    read_paths.append(import_path)
+    if os.path.isdir(import_path):
+        return sorted(glob.glob(os.path.join(import_path, "*.yml"))), filters
+    return ([import_path] if os.path.isfile(import_path) else []), filters
+
+
+def _is_imported(name: str, filters: Dict[str, Any]) -> bool:
+    allowlist = filters.get("name-allowlist")
+    if isinstance(allowlist, str):
+        allowlist = [allowlist]
+    blocklist = filters.get("name-blocklist")
+    if isinstance(blocklist, str):
+        blocklist = [blocklist]
+    return (allowlist is None or name in allowlist) and name not in (blocklist or [])
+
+
+def get_manifest_path(topdir: str) -> Tuple[str, str]:
+    """Return the dir of the manifest project and the manifest file from `.west/config`."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(topdir, ".west", "config"))
+    manifest_dir = os.path.join(topdir, config.get("manifest", "path", fallback="zephyr"))
+    manifest_file = config.get("manifest", "file", fallback="west.yml")
+    return os.path.normpath(manifest_dir), os.path.join(manifest_dir, manifest_file)
+
+
+def get_west_projects(topdir: str, read_paths: Optional[List[str]] = None) -> List[WestProject]:
+    """Return the manifest project and the projects checked out in the west workspace.
+
+    The imports of the manifest and of its projects are resolved from disk. As with west, a
+    project defined earlier, e.g. by the manifest itself, wins over an imported one. The manifest
+    files read and the import dirs listed are added to `read_paths`.
+    """
+    read_paths = [] if read_paths is None else read_paths
+    manifest_dir, manifest_file = get_manifest_path(topdir)
+    projects: Dict[str, WestProject] = {}
+    projects["manifest"] = WestProject(os.path.basename(manifest_dir), manifest_dir)
+
+    def load(path: str, filters: Dict[str, Any], seen: Set[str]):
+        if path in seen:
+            return
+        seen.add(path)
+        read_paths.append(path)
+        manifest = load_manifest_file(path)
+        imports: List[Tuple[str, Any, Dict[str, Any]]] = []
+        self_import = (manifest.get("self") or {}).get("import")
+        if self_import:
+            imports.append((manifest_dir, self_import, filters))
+
+        prefix = filters.get("path-prefix", "")
+        for project in manifest.get("projects") or []:
+            if not isinstance(project, dict) or not project.get("name"):
+                raise ValueError(f"Invalid west manifest, a project has no name:\n[{path}]")
+            name = project["name"]
+            project_path = os.path.normpath(
+                os.path.join(topdir, prefix, project.get("path") or name)
+            )
+            if name in projects or not _is_imported(name, filters):
+                continue
+            projects[name] = WestProject(name, project_path)
+            if project.get("import"):
+                imports.append((project_path, project["import"], {}))
+
+        for import_dir, import_value, import_filters in imports:
+            files, nested_filters = _get_import_files(import_dir, import_value, read_paths)
+            for file in files:
+                load(file, {**import_filters, **nested_filters}, seen)
+
+    load(manifest_file, {}, set())
+    # the projects which are not checked out, e.g. of inactive groups, are left out
+    return [project for project in projects.values() if os.path.isdir(project.path)]
+
+
+def attribute_files(paths: Iterable[str], roots: Iterable[str]) -> Dict[str, Set[str]]:
+    """Return the paths below each root dir relative to it, the innermost root wins."""
+    root_set = set(roots)
+    root_by_dir: Dict[str, Optional[str]] = {}
+    attributed: Dict[str, Set[str]] = {}
+    for path in paths:
+        path_dir = os.path.dirname(path)
+        if path_dir not in root_by_dir:
+            parent = path_dir
+            while parent not in root_set and os.path.dirname(parent) != parent:
+                parent = os.path.dirname(parent)
+            root_by_dir[path_dir] = parent if parent in root_set else None
+        root = root_by_dir[path_dir]
+        if root is not None:
+            attributed.setdefault(root, set()).add(os.path.relpath(path, root))
+    return attributed
+
+
+class WestWorkspace(Workspace):
+    """A workspace with a folder for each west project holding files the builds use.
+
+    `src_dir` is a folder of its own, it keeps its `c_cpp_properties.json`. Every other project
+    gets a `.vscode/settings.json` hiding its unused files, the `.code-workspace` file in the west
+    workspace dir lists the folders.
+    """
+
+    def __init__(self, *args: Any, topdir: Optional[str] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        found_topdir = topdir or find_west_topdir(self.src_dir)
+        if found_topdir is None:
+            raise ValueError(f"The source dir is not in a west workspace:\n[{self.src_dir}]")
+        self.topdir = os.path.abspath(found_topdir)
+        self.workspace_file = os.path.join(self.topdir, const.CODE_WORKSPACE_FILE_NAME)
+        self.config_jsons = [*self.config_jsons, self.workspace_file]
+
+    def _cache_key(self, cache_dir: str) -> Dict[str, Any]:
+        key = super()._cache_key(cache_dir)
+        if cache_dir == self.vscode_dir:
+            key.update(west_topdir=self.topdir)
+        return key
+
+    def _workspace_stages(self, results: Dict[str, Any]) -> Stages:
+        stages = super()._workspace_stages(results)
+        generate_configs, _, outputs, depends = stages["configs"]
+
+        def get_projects() -> List[List[str]]:
+            read_paths: List[str] = []
+            projects = get_west_projects(self.topdir, read_paths)
+            # the imported manifests are inputs as well, the top one is one already
+            self.cache(self.vscode_dir).add_inputs("projects", read_paths)
+            print(f"Found [{len(projects)}] west projects in:\n[{self.topdir}]\n")
+            return [list(project) for project in projects]
+
+        def scan_projects() -> Dict[str, List[str]]:
+            projects = [WestProject(*p) for p in results["projects"] if p[1] != self.src_dir]
+            roots = [self.src_dir, *(project.path for project in projects)]
+
+            def scan(project: WestProject) -> List[str]:
+                # the projects nested in this one are scanned on their own
+                nested = [r for r in roots if r != project.path and r.startswith(project.path)]
+                args = (
+                    project.path,
+                    get_suffixes(self.languages),
+                    self.scan_ignore_globs,
+                    [*self.build_dirs, *nested],
+                )
+                files = scan_git_checkout(*args) if self.git_index else None
+                if files is None:
+                    files = scan_source_tree(*args, self.jobs, self.index_path)
+                return sorted(files)
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                files = pool.map(instrument.bind(scan), projects)
+                return {
+                    project.path: project_files for project, project_files in zip(projects, files)
+                }
+
+        def generate_west_configs() -> List[str]:
+            generate_configs()
+            builds = [self.results[build_dir] for build_dir in self.build_dirs]
+            used_files = {f for build in builds for f in build["used_files"]}
+            # the files of the deps languages are only hidden when every build has a deps log
+            with_deps = all(build["used_h_files"] is not None for build in builds)
+            if with_deps:
+                used_files.update(f for build in builds for f in build["used_h_files"])
+            excluded_suffixes = get_suffixes(self.languages, None if with_deps else False)
+
+            project_files = results["project_files"]
+            attributed = attribute_files(
+                (os.path.normpath(os.path.join(self.src_dir, f)) for f in used_files),
+                [self.src_dir, *project_files],
+            )
+            folders = [{"name": os.path.basename(self.src_dir), "path": self.src_dir}]
+            dropped = 0
+            for name, path in results["projects"]:
+                project_used_files = attributed.get(path, set())
+                if path == self.src_dir:
+                    continue
+                if not project_used_files:
+                    dropped += 1
+                    continue
+                print(f"West project [{name}] uses [{len(project_used_files)}] files.\n")
+                unused_files = {
+                    f
+                    for f in project_files[path]
+                    if f not in project_used_files and f.endswith(excluded_suffixes)
+                }
+                self._write_project_settings(
+                    path,
+                    make_settings(project_used_files, unused_files, path),
+                    project_used_files | unused_files,
+                )
+                folders.append({"name": name, "path": path})
+
+            print(f"Dropped [{dropped}] west projects without used files.\n")
+            self._write_workspace_file(folders)
+            return self.config_jsons
+
+        stages.update(
+            projects=(
+                get_projects,
+                [os.path.join(self.topdir, ".west", "config"), get_manifest_path(self.topdir)[1]],
+                [],
+                [],
+            ),
+            project_files=(scan_projects, self._scan_inputs(), [], ["projects"]),
+            configs=(generate_west_configs, [], outputs, [*depends, "project_files"]),
+        )
+        return stages
+
+    def _write_project_settings(
+        self, path: str, settings: Dict[str, Any], source_files: AbstractSet[str]
+    ):
+        vscode_dir = os.path.join(path, ".vscode")
+        os.makedirs(vscode_dir, exist_ok=True)
+        update_json_file(
+            os.path.join(vscode_dir, "settings.json"), settings, source_files=source_files
+        )
+
+    def _write_workspace_file(self, folders: List[Dict[str, str]]):
+        workspace = {
+            "folders": [
+                {
+                    "name": folder["name"],
+                    "path": os.path.relpath(folder["path"], self.topdir).replace("\\", "/"),
+                }
+                for folder in folders
+            ],
+            # the IntelliSense of the files out of the source dir
+            "settings": {
+                "C_Cpp.default.compileCommands": self.results[self.build_dirs[0]]["compdb"].replace(
+                    "\\", "/"
+                ),
+                "C_Cpp.default.compilerPath": self.compiler_path.replace("\\", "/"),
+            },
+        }
+        update_json_file(self.workspace_file, workspace, merge_code_workspace)
+        print(
+            f"VS Code workspace with [{len(folders)}] folders generated:\n[{self.workspace_file}]\n"
+        )
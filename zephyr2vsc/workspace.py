@@ -0,0 +1,481 @@
+"""The VS Code workspace of a Zephyr source dir and its builds, reusable within one process."""
+
+import os
+import sys
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from zephyr2vsc import const, instrument
+from zephyr2vsc.browse import get_browse_paths
+from zephyr2vsc.cache import BuildCache
+from zephyr2vsc.helpers import (
+    generate_compilation_db,
+    generate_object_table,
+    generate_vscode_config_jsons,
+    get_all_source_files_relative_path,
+    get_board_name,
+    get_compile_db_include_paths,
+    get_ninja_rules,
+    get_relevant_header_files_relative_path,
+    get_relevant_source_files_relative_path,
+    make_c_cpp_configuration,
+)
+from zephyr2vsc.languages import Languages, get_suffixes, split_by_language
+from zephyr2vsc.ninja import NinjaManifest
+from zephyr2vsc.scan import get_git_index_file
+from zephyr2vsc.schedule import Stages, run_stages
+from zephyr2vsc.tasks import PACKAGE_PARENT_DIR, get_object_table_path, make_tasks
+from zephyr2vsc.vscode_json import merge_tasks, update_json_file
+
+# the results of the builds the configs are made of
+CONFIGS_BUILD_STAGES = ("used_files", "used_h_files", "compdb", "include_paths", "objects")
+
+
+def get_build_stages(
+    build_dir: str,
+    src_dir: str,
+    compact_compdb: bool,
+    results: Dict[str, Any],
+    languages: Languages = const.SOURCE_LANGUAGES,
+    compdb_index: bool = False,
+) -> Stages:
+    """The stages which only depend on one build dir, their results go to `results`.
+
+    The used files of all the `languages` are found in one pass over build.ninja and one over the
+    deps log. With `compdb_index`, the compdb stage also writes the SQLite index of the commands.
+    """
+    rules_file = os.path.join(build_dir, "CMakeFiles", "rules.ninja")
+    build_file = os.path.join(build_dir, "build.ninja")
+    deps_file = os.path.join(build_dir, ".ninja_deps")
+    db_full_path = os.path.join(build_dir, const.COMPILE_DB_FILE_NAME)
+    index_path = os.path.join(build_dir, const.COMPILE_INDEX_FILE_NAME)
+
+    def generate_compdb() -> str:
+        # every compiled source is a used file, the compact DB needs no filter by them
+        return generate_compilation_db(
+            build_dir, set(results["rules"]), compact=compact_compdb, write_index=compdb_index
+        )
+
+    def get_used_h_files() -> Optional[List[str]]:
+        used_h_files = get_relevant_header_files_relative_path(
+            src_dir, build_dir, get_suffixes(languages, deps=True)
+        )
+        return None if used_h_files is None else sorted(used_h_files)
+
+    def get_include_paths() -> List[List[str]]:
+        return [sorted(paths) for paths in get_compile_db_include_paths(results["compdb"])]
+
+    return {
+        "rules": (lambda: sorted(get_ninja_rules(build_dir)), [build_file, rules_file], [], []),
+        "used_files": (
+            lambda: sorted(
+                get_relevant_source_files_relative_path(src_dir, build_dir, get_suffixes(languages))
+            ),
+            [build_file, rules_file],
+            [],
+            [],
+        ),
+        "used_h_files": (get_used_h_files, [deps_file], [], []),
+        "compdb": (
+            generate_compdb,
+            [build_file, rules_file],
+            [db_full_path, index_path] if compdb_index else [db_full_path],
+            ["rules"],
+        ),
+        "include_paths": (get_include_paths, [], [], ["compdb"]),
+        "objects": (
+            lambda: generate_object_table(build_dir, set(results["rules"])),
+            [build_file, rules_file],
+            [get_object_table_path(build_dir)],
+            ["rules"],
+        ),
+    }
+
+
+def run_build(
+    build_dir: str,
+    src_dir: str,
+    compact_compdb: bool,
+    cache: BuildCache,
+    jobs: Optional[int] = None,
+    stage_names: Optional[Iterable[str]] = None,
+    languages: Languages = const.SOURCE_LANGUAGES,
+    compdb_index: bool = False,
+) -> Tuple[Dict[str, Any], BuildCache]:
+    """Run the stages of one build dir, or only `stage_names`, return their results and cache."""
+    with instrument.stage(f"build {os.path.basename(build_dir)}"):
+        results: Dict[str, Any] = {}
+        stages = get_build_stages(
+            build_dir, src_dir, compact_compdb, results, languages, compdb_index
+        )
+        if stage_names is not None:
+            stages = {name: stages[name] for name in stage_names}
+        run_stages(cache, stages, results, jobs)
+        cache.save()
+    return results, cache
+
+
+def process_build(
+    *args: Any, trace_memory: bool = False, keep_manifest: bool = False
+) -> Tuple[Dict[str, Any], BuildCache, List[instrument.StageRecord]]:
+    """Run `run_build` in a worker process, also return the records of its stages."""
+    with instrument.use(instrument.Profiler(trace_memory)) as profiler:
+        results, cache = run_build(*args)
+    # a worker may process many builds, it only keeps their manifests if it gets them again
+    if not keep_manifest:
+        NinjaManifest.unload(args[0])
+    return results, cache, profiler.records
+
+
+def get_configuration_names(build_dirs: List[str]) -> List[str]:
+    if len(build_dirs) == 1:
+        return [const.C_CPP_PROPERTIES_JSON_TEMPLATE["configurations"][0]["name"]]  # type: ignore
+    names = [get_board_name(build_dir) for build_dir in build_dirs]
+    # the same board built twice is told apart by the build dir
+    return [
+        f"{name} ({os.path.basename(build_dir)})" if names.count(name) > 1 else name
+        for name, build_dir in zip(names, build_dirs)
+    ]
+
+
+class Workspace:
+    """The stages generating the VS Code workspace of `src_dir` for one or more build dirs.
+
+    Each stage is computed when it is first needed and memoized, in memory and in the cache
+    files. A memoized result is reused as long as the files it was computed from are unchanged,
+    `invalidate` forces stages to be recomputed. One workspace can be regenerated any number of
+    times in the same process, e.g. by a west extension or in watch mode.
+
+    Several builds are processed in worker processes. With `keep_workers` they are kept until
+    `close`, each build always goes to the same worker, which keeps its ninja manifest for the
+    next regeneration.
+    """
+
+    # the stages of each build dir the configs are made of, and the ones which are run at all
+    configs_build_stages: Tuple[str, ...] = CONFIGS_BUILD_STAGES
+    build_stage_names: Optional[Tuple[str, ...]] = None
+
+    def __init__(
+        self,
+        src_dir: str,
+        build_dirs: Union[str, Iterable[str]],
+        compiler_path: str,
+        scan_ignore: Iterable[str] = (),
+        compact_compdb: bool = False,
+        jobs: Optional[int] = None,
+        git_index: bool = False,
+        languages: Optional[Languages] = None,
+        compdb_index: bool = False,
+        keep_workers: bool = False,
+    ):
+        if isinstance(build_dirs, str):
+            build_dirs = [build_dirs]
+        self.compiler_path = os.path.abspath(os.path.normpath(compiler_path))
+        self.src_dir = os.path.abspath(os.path.normpath(src_dir))
+        self.build_dirs = [os.path.abspath(os.path.normpath(d)) for d in build_dirs]
+        self.scan_ignore_globs = [*const.SCAN_IGNORE_GLOBS, *scan_ignore]
+        self.compact_compdb = compact_compdb
+        self.jobs = jobs
+        self.git_index = git_index
+        self.languages = dict(const.SOURCE_LANGUAGES if languages is None else languages)
+        self.compdb_index = compdb_index
+        self.keep_workers = keep_workers
+
+        self.vscode_dir = os.path.join(self.src_dir, ".vscode")
+        self.index_path = os.path.join(self.vscode_dir, const.SOURCE_INDEX_FILE_NAME)
+        self.config_jsons = [
+            os.path.join(self.vscode_dir, "settings.json"),
+            os.path.join(self.vscode_dir, "c_cpp_properties.json"),
+            os.path.join(self.vscode_dir, "tasks.json"),
+        ]
+        # the cache and the stage results of each build dir and of the .vscode dir
+        self.caches: Dict[str, BuildCache] = {}
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._ignore_cache_files = False
+        self._process_pools: List[Executor] = []
+
+    def _get_process_pools(self) -> List[Executor]:
+        """One pool of workers for the builds, or one pool per kept worker to pin the builds."""
+        if not self._process_pools:
+            # multiprocessing takes a while to import, a single build does not need it
+            from concurrent.futures import ProcessPoolExecutor
+
+            max_workers = min(len(self.build_dirs), self.jobs or os.cpu_count() or 1)
+            self._process_pools = (
+                [ProcessPoolExecutor(max_workers=1) for _ in range(max_workers)]
+                if self.keep_workers
+                else [ProcessPoolExecutor(max_workers=max_workers)]
+            )
+        return self._process_pools
+
+    def close(self):
+        """Shut down the worker processes of the builds."""
+        for pool in self._process_pools:
+            pool.shutdown()
+        self._process_pools = []
+
+    def _cache_key(self, cache_dir: str) -> Dict[str, Any]:
+        key: Dict[str, Any] = {
+            "src_dir": self.src_dir,
+            "compact_compdb": self.compact_compdb,
+            "compdb_index": self.compdb_index,
+            "languages": {name: list(suffixes) for name, suffixes in self.languages.items()},
+        }
+        if cache_dir == self.vscode_dir:
+            key.update(
+                compiler_path=self.compiler_path,
+                build_dirs=self.build_dirs,
+                scan_ignore=self.scan_ignore_globs,
+                git_index=self.git_index,
+                # tasks.json runs this Python and this copy of the package
+                python=sys.executable,
+                package_parent_dir=PACKAGE_PARENT_DIR,
+            )
+        return key
+
+    def cache(self, cache_dir: str) -> BuildCache:
+        if cache_dir not in self.caches:
+            key = self._cache_key(cache_dir)
+            self.caches[cache_dir] = (
+                BuildCache(cache_dir, key)
+                if self._ignore_cache_files
+                else BuildCache.load(cache_dir, key)
+            )
+        return self.caches[cache_dir]
+
+    def invalidate(self, *stages: str):
+        """Recompute the given stages, or all of them, when they are needed next.
+
+        The stages depending on them are recomputed as well. The stages of the build dirs are
+        invalidated in every build dir.
+        """
+        if not stages:
+            self._ignore_cache_files = True
+        for cache_dir in [*self.build_dirs, self.vscode_dir]:
+            self.cache(cache_dir).invalidate(stages)
+
+    def rules(self, build_dir: Optional[str] = None) -> List[str]:
+        return self._run_stage(build_dir or self.build_dirs[0], "rules")
+
+    def used_files(self, build_dir: Optional[str] = None) -> List[str]:
+        return self._run_stage(build_dir or self.build_dirs[0], "used_files")
+
+    def used_h_files(self, build_dir: Optional[str] = None) -> Optional[List[str]]:
+        return self._run_stage(build_dir or self.build_dirs[0], "used_h_files")
+
+    def compdb(self, build_dir: Optional[str] = None) -> str:
+        return self._run_stage(build_dir or self.build_dirs[0], "compdb")
+
+    def all_files(self) -> List[str]:
+        return self._run_stage(self.vscode_dir, "all_files")
+
+    def configs(self) -> List[str]:
+        return self._run_stage(self.vscode_dir, "configs")
+
+    def _stages(self, cache_dir: str) -> Stages:
+        results = self.results.setdefault(cache_dir, {})
+        if cache_dir == self.vscode_dir:
+            return self._workspace_stages(results)
+        stages = get_build_stages(
+            cache_dir, self.src_dir, self.compact_compdb, results, self.languages, self.compdb_index
+        )
+        if self.build_stage_names is None:
+            return stages
+        return {name: stages[name] for name in self.build_stage_names}
+
+    def _run_stage(self, cache_dir: str, name: str, run_depends: bool = True) -> Any:
+        stages = self._stages(cache_dir)
+        compute, inputs, outputs, depends = stages[name]
+        for depend in depends if run_depends else ():
+            if depend in stages:
+                self._run_stage(cache_dir, depend)
+            elif depend == "builds":
+                for build_dir in self.build_dirs:
+                    for build_stage in self.configs_build_stages:
+                        self._run_stage(build_dir, build_stage)
+                self._update_builds_revision()
+
+        cache = self.cache(cache_dir)
+        self.results[cache_dir][name] = cache.run(name, compute, inputs, outputs, depends)
+        cache.save()
+        return self.results[cache_dir][name]
+
+    def _update_builds_revision(self):
+        # the configs are current as long as the build stages they are made of are
+        self.cache(self.vscode_dir).external["builds"] = {
+            build_dir: self.cache(build_dir).revisions(self.configs_build_stages)
+            for build_dir in self.build_dirs
+        }
+
+    def _scan_inputs(self) -> List[str]:
+        # a build may generate sources in the tree, the source tree is rescanned after every build
+        inputs = [
+            os.path.join(build_dir, name)
+            for build_dir in self.build_dirs
+            for name in ("build.ninja", ".ninja_log")
+        ]
+        git_index_file = get_git_index_file(self.src_dir) if self.git_index else None
+        return inputs if git_index_file is None else [*inputs, git_index_file]
+
+    def _split_used_files(
+        self, all_files: Iterable[str], builds: List[Dict[str, Any]]
+    ) -> Tuple[Set[str], Set[str]]:
+        """Return the used and the unused files of every language which can be excluded."""
+        # the files of the deps languages are only excluded when every build has a deps log
+        with_deps = all(build["used_h_files"] is not None for build in builds)
+        used = split_by_language(
+            {f for build in builds for f in (*build["used_files"], *(build["used_h_files"] or ()))},
+            self.languages,
+        )
+        used_files: Set[str] = set()
+        unused_files: Set[str] = set()
+        for name, files in split_by_language(all_files, self.languages).items():
+            if with_deps or name not in const.DEPS_LANGUAGES:
+                unused = files - used[name]
+                used_files |= used[name]
+                unused_files |= unused
+                print(f"Exclude [{len(unused)}] unused {name} files.\n")
+        return used_files, unused_files
+
+    def _workspace_stages(self, results: Dict[str, Any]) -> Stages:
+        src_dir, build_dirs = self.src_dir, self.build_dirs
+
+        def generate_configs() -> List[str]:
+            builds = [self.results[build_dir] for build_dir in build_dirs]
+            used_files, unused_files = self._split_used_files(results["all_files"], builds)
+
+            # the tag parser of the C/C++ extension only reads the C and C++ sources
+            browse_suffixes = get_suffixes(
+                {n: s for n, s in self.languages.items() if n in const.BROWSE_LANGUAGES}
+            )
+            configurations = [
+                make_c_cpp_configuration(
+                    name,
+                    self.compiler_path,
+                    build["compdb"],
+                    get_browse_paths(
+                        src_dir,
+                        [f for f in build["used_files"] if f.endswith(browse_suffixes)],
+                        *build["include_paths"],
+                    ),
+                )
+                for name, build in zip(get_configuration_names(build_dirs), builds)
+            ]
+
+            generate_vscode_config_jsons(
+                unused_files,
+                used_files,
+                self.compiler_path,
+                "",
+                src_dir,
+                configurations=configurations,
+                build_dirs=build_dirs,
+            )
+            tasks_path = os.path.join(self.vscode_dir, "tasks.json")
+            if update_json_file(tasks_path, make_tasks(build_dirs), merge_tasks):
+                print(f"VS Code task compiling the current file saved in:\n[{tasks_path}]\n")
+            return self.config_jsons
+
+        return {
+            "all_files": (
+                lambda: sorted(
+                    get_all_source_files_relative_path(
+                        src_dir,
+                        get_suffixes(self.languages),
+                        self.scan_ignore_globs,
+                        build_dirs,
+                        self.jobs,
+                        self.index_path,
+                        self.git_index,
+                    )
+                ),
+                self._scan_inputs(),
+                [],
+                [],
+            ),
+            "configs": (generate_configs, [], self.config_jsons, ["all_files", "builds"]),
+        }
+
+    def stale_stages(self) -> List[str]:
+        """Return the stages which would be recomputed, without computing anything."""
+        stale = []
+        for build_dir in self.build_dirs:
+            cache = self.cache(build_dir)
+            stale += [
+                f"{name} [{build_dir}]"
+                for name, (_, inputs, outputs, depends) in self._stages(build_dir).items()
+                if not cache.is_current(name, inputs, outputs, depends)
+            ]
+        self._update_builds_revision()
+        cache = self.cache(self.vscode_dir)
+        stale += [
+            name
+            for name, (_, inputs, outputs, depends) in self._stages(self.vscode_dir).items()
+            if not cache.is_current(name, inputs, outputs, depends)
+        ]
+        return stale
+
+    def generate(self):
+        """Bring every stage up to date.
+
+        The builds are processed while the source tree is scanned: a single build on a thread,
+        where its stages overlap as well, and several builds in other processes. While the peak
+        memory of each stage is traced, the stages of this process run one at a time.
+        """
+        build_dirs = self.build_dirs
+        workspace_stages = self._stages(self.vscode_dir)
+
+        def get_build_args(build_dir: str) -> Tuple[Any, ...]:
+            return (
+                build_dir,
+                self.src_dir,
+                self.compact_compdb,
+                self.cache(build_dir),
+                self.jobs,
+                self.build_stage_names,
+                self.languages,
+                self.compdb_index,
+            )
+
+        def scan():
+            for name in workspace_stages:
+                if name != "configs":
+                    self._run_stage(self.vscode_dir, name)
+
+        if len(build_dirs) == 1 and instrument.traces_memory():
+            self.results[build_dirs[0]], self.caches[build_dirs[0]] = run_build(
+                *get_build_args(build_dirs[0])
+            )
+            scan()
+        elif len(build_dirs) == 1:
+            with ThreadPoolExecutor(max_workers=1) as thread_pool:
+                build_future = thread_pool.submit(
+                    instrument.bind(run_build), *get_build_args(build_dirs[0])
+                )
+                scan()
+                self.results[build_dirs[0]], self.caches[build_dirs[0]] = build_future.result()
+        else:
+            # the workers send the records of their stages back
+            profiler = instrument.get_profiler()
+            pools = self._get_process_pools()
+            try:
+                futures = [
+                    pools[i % len(pools)].submit(
+                        process_build,
+                        *get_build_args(build_dir),
+                        trace_memory=profiler is not None and profiler.trace_memory,
+                        keep_manifest=self.keep_workers,
+                    )
+                    for i, build_dir in enumerate(build_dirs)
+                ]
+                scan()
+                for build_dir, future in zip(build_dirs, futures):
+                    self.results[build_dir], self.caches[build_dir], records = future.result()
+                    if profiler is not None:
+                        profiler.records.extend(records)
+            finally:
+                if not self.keep_workers:
+                    self.close()
+
+        self._update_builds_revision()
+        self._run_stage(self.vscode_dir, "configs", run_depends=False)